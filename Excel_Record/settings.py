@@ -36,8 +36,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'Recorder.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    # WhiteNoise, async capable so it doesn't push the chain into threads under ASGI
+    'Recorder.middleware.StaticFilesMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -119,8 +121,24 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 CRISPY_ALLOWED_TEMPLATE_PACKS = "bootstrap5"
 CRISPY_TEMPLATE_PACK = "bootstrap5"
 
+# Cache shared by every worker process on the host
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('DJANGO_CACHE_DIR', os.path.join(BASE_DIR, 'cache')),
+        'TIMEOUT': 60 * 60 * 24,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    }
+}
+
 # Session settings
-SESSION_ENGINE = 'django.contrib.sessions.backends.db'
+# Session storage backend: 'db', 'cached_db' (reads served from CACHES,
+# falling back to the database) or 'signed_cookies' (no server-side
+# storage). CACHES is per host, so only use cached_db when every worker
+# shares the same cache.
+SESSION_ENGINE = 'django.contrib.sessions.backends.' + os.getenv('DJANGO_SESSION_BACKEND', 'db')
 SESSION_COOKIE_AGE = 1209600  # 2 weeks in seconds
 SESSION_COOKIE_SECURE = not DEBUG
 CSRF_COOKIE_SECURE = not DEBUG
@@ -132,6 +150,46 @@ SESSION_SERIALIZER = 'django.contrib.sessions.serializers.JSONSerializer'
 INVOICE_EXCEL_DIR = os.path.join(MEDIA_ROOT, 'invoice_excel')
 os.makedirs(INVOICE_EXCEL_DIR, exist_ok=True)
 
+# Invoice list pagination (rows per page, overridable with ?page_size=)
+INVOICE_LIST_PAGE_SIZE = int(os.getenv('INVOICE_LIST_PAGE_SIZE', '50'))
+INVOICE_LIST_MAX_PAGE_SIZE = 500
+
+# Rows validated and inserted per bulk_create during CSV imports
+INVOICE_IMPORT_BATCH_SIZE = int(os.getenv('INVOICE_IMPORT_BATCH_SIZE', '1000'))
+
+# Processes parsing rows in parallel during CSV imports; below 2 rows are
+# parsed in the importing process. Worth it for files of 100k+ rows.
+INVOICE_IMPORT_WORKERS = int(os.getenv('INVOICE_IMPORT_WORKERS', '0'))
+
+# Rows fetched per database round trip when streaming exports
+INVOICE_EXPORT_CHUNK_SIZE = int(os.getenv('INVOICE_EXPORT_CHUNK_SIZE', '2000'))
+
+# Queue CSV uploads for `manage.py run_import_worker` instead of importing
+# them inside the request. Only enable it where a worker is running, or
+# uploads stay queued.
+INVOICE_IMPORT_BACKGROUND = os.getenv('INVOICE_IMPORT_BACKGROUND', 'False') == 'True'
+
+# Seconds without a heartbeat after which a running import job is treated as
+# abandoned by its worker and queued again
+INVOICE_IMPORT_STALE_AFTER = int(os.getenv('INVOICE_IMPORT_STALE_AFTER', '600'))
+
+# Route the invoice list, detail and CSV export views to their async
+# versions; turn on when serving Excel_Record.asgi under uvicorn
+RECORDER_ASYNC_VIEWS = os.getenv('RECORDER_ASYNC_VIEWS', 'False') == 'True'
+
+# Per-request metrics, written per process to METRICS_DIR and served
+# merged at /metrics. Off by default; /metrics answers 404 while disabled.
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'False') == 'True'
+METRICS_DIR = os.getenv('METRICS_DIR', os.path.join(BASE_DIR, 'metrics'))
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', '5'))
+# When set, /metrics requires an "Authorization: Bearer <token>" header.
+# Set it whenever /metrics is reachable from outside the host.
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+# Log requests slower than this many milliseconds with their SQL (off when unset)
+SLOW_REQUEST_THRESHOLD_MS = (
+    float(os.environ['SLOW_REQUEST_THRESHOLD_MS']) if os.getenv('SLOW_REQUEST_THRESHOLD_MS') else None
+)
+
 # Ensure media files are served in development
 if DEBUG:
     MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
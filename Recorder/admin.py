@@ -1,13 +1,140 @@
+from collections import Counter
+
 from django.contrib import admin
+from django.contrib.admin.views.main import ORDER_VAR, PAGE_VAR, ChangeList
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Max
+from django.utils.functional import cached_property
+
+from .exports import stream_csv
 from .models import Invoice
+from .recalculation import recalculate_payment_2
+from .search import search_invoices
+from .settlement import mark_settled
+
+
+def estimated_row_count(model, using):
+    """A cheap estimate of the number of rows in model's table"""
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        # The planner's estimate, kept up to date by autovacuum
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+                [connection.ops.quote_name(model._meta.db_table)],
+            )
+            row = cursor.fetchone()
+        return max(int(row[0]), 0) if row else 0
+    # Ids are never reused, so the highest one bounds the row count and is
+    # read straight off the primary key index
+    return model._default_manager.using(using).aggregate(last=Max('pk'))['last'] or 0
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that never runs an exact COUNT(*) over a large table.
+
+    The count stops at COUNT_LIMIT rows, or one page past the current page
+    if that is further. Past that an unfiltered changelist shows the
+    estimated table size, and a filtered one is marked ``capped``: the
+    changelist shows the count as a lower bound and links one page past
+    the current one, so every page stays reachable.
+    """
+    COUNT_LIMIT = 10000
+
+    def __init__(self, *args, current_page=1, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.current_page = current_page
+        self.capped = False
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        limit = max(self.COUNT_LIMIT, (self.current_page + 1) * self.per_page)
+        bounded = queryset.values('pk').order_by()[:limit + 1].count()
+        if bounded <= limit:
+            return bounded
+        if not queryset.query.where:
+            return max(estimated_row_count(queryset.model, queryset.db), limit)
+        self.capped = True
+        return limit
+
+
+class InvoiceChangeList(ChangeList):
+    """Orders search results by relevance unless a column sort is chosen"""
+
+    def get_ordering(self, request, queryset):
+        if 'search_rank' in queryset.query.annotations and ORDER_VAR not in self.params:
+            return ['-search_rank', '-invoice_date', '-id']
+        return super().get_ordering(request, queryset)
+
+
+class FirmFilter(admin.SimpleListFilter):
+    """
+    Filter by firm, offering the firms used most among the latest invoices.
+
+    Listing every firm would take a DISTINCT over the whole table on each
+    changelist load; reading the latest FIRM_SAMPLE rows down the primary
+    key stays cheap however large the table grows.
+    """
+    title = 'firm'
+    parameter_name = 'firm'
+
+    FIRM_SAMPLE = 5000
+    FIRM_CHOICES = 20
+
+    def lookups(self, request, model_admin):
+        recent = Invoice.objects.order_by('-pk').values_list('firm', flat=True)[:self.FIRM_SAMPLE]
+        firms = sorted(firm for firm, _ in Counter(recent).most_common(self.FIRM_CHOICES))
+        # A firm chosen through the URL stays visible as the selection
+        if self.value() and self.value() not in firms:
+            firms.append(self.value())
+        return [(firm, firm) for firm in firms]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(firm=self.value())
+        return queryset
+
+
+class OverdueFilter(admin.SimpleListFilter):
+    """Filter invoices by how far past their due date they are"""
+    title = 'days overdue'
+    parameter_name = 'overdue'
+
+    BUCKETS = (
+        ('1', '1+ days', 1),
+        ('30', '30+ days', 30),
+        ('60', '60+ days', 60),
+        ('90', '90+ days', 90),
+    )
+
+    def lookups(self, request, model_admin):
+        return [(value, label) for value, label, _ in self.BUCKETS]
+
+    def queryset(self, request, queryset):
+        for value, _, days in self.BUCKETS:
+            if self.value() == value:
+                return queryset.filter(days_overdue__gte=days)
+        return queryset
+
 
 @admin.register(Invoice)
 class InvoiceAdmin(admin.ModelAdmin):
-    list_display = ('invoice_number', 'party', 'firm', 'invoice_date', 'total_amount', 'balance', 'payment_2')
-    list_filter = ('firm', 'invoice_date', 'created_at')
+    list_display = (
+        'invoice_number', 'party', 'firm', 'invoice_date', 'total_amount', 'balance', 'payment_2',
+        'days_overdue', 'accrued_interest', 'user',
+    )
+    list_select_related = ('user',)
+    list_filter = (OverdueFilter, FirmFilter, 'invoice_date', 'created_at')
     search_fields = ('invoice_number', 'party', 'firm')
     readonly_fields = ('payment_2', 'created_at', 'updated_at')
-    date_hierarchy = 'invoice_date'
+    # No date_hierarchy or full result count: on a large table both cost a
+    # scan on every changelist load
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = ['recalculate_payment_2', 'mark_settled', 'export_csv']
     
     fieldsets = (
         ('Basic Information', {
@@ -25,8 +152,53 @@ class InvoiceAdmin(admin.ModelAdmin):
         })
     )
     
+    def get_queryset(self, request):
+        # Database-computed columns, so the changelist can sort and filter on them
+        return super().get_queryset(request).with_days_overdue().with_interest()
+
+    @admin.display(description='Days overdue', ordering='days_overdue')
+    def days_overdue(self, obj):
+        return obj.days_overdue
+
+    @admin.display(description='Accrued interest', ordering='accrued_interest')
+    def accrued_interest(self, obj):
+        return obj.accrued_interest
+
+    def get_changelist(self, request, **kwargs):
+        return InvoiceChangeList
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        # The page being viewed decides how far a filtered count has to go
+        try:
+            current_page = max(int(request.GET.get(PAGE_VAR, 1)), 1)
+        except ValueError:
+            current_page = 1
+        return self.paginator(
+            queryset, per_page, orphans, allow_empty_first_page, current_page=current_page,
+        )
+
+    def get_search_results(self, request, queryset, search_term):
+        # Use the full-text index, most relevant first, instead of LIKE scans
+        if not search_term:
+            return queryset, False
+        return search_invoices(queryset, search_term, rank=True), False
+
     def save_model(self, request, obj, form, change):
         # Calculate payment_2 when saving through admin
         if not obj.payment_2:
             obj.payment_2 = obj.calculate_payment_2()
-        super().save_model(request, obj, form, change)
\ No newline at end of file
+        super().save_model(request, obj, form, change)
+
+    @admin.action(description='Recalculate payment 2 for selected invoices')
+    def recalculate_payment_2(self, request, queryset):
+        updated = recalculate_payment_2(queryset)
+        self.message_user(request, f'Recalculated payment 2 for {updated} invoice(s).')
+
+    @admin.action(description='Mark selected invoices as fully settled')
+    def mark_settled(self, request, queryset):
+        updated = mark_settled(queryset)
+        self.message_user(request, f'Marked {updated} invoice(s) as fully settled.')
+
+    @admin.action(description='Export selected invoices as CSV')
+    def export_csv(self, request, queryset):
+        return stream_csv(queryset, 'invoices_selected.csv')
@@ -0,0 +1,86 @@
+"""
+Receivables aging report.
+
+Outstanding balances are grouped by party and split into buckets by how far
+past its due date each invoice is. Every bucket for every party comes from
+one GROUP BY query with conditional sums; bucket edges are plain due_date
+comparisons, so the (user, due_date) index still applies.
+
+The result is cached per user through caching.py, so any change to one of
+the user's invoices invalidates it. The as-of date is part of the cache
+name, since buckets move as days pass.
+"""
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db.models import Count, Q, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .caching import cached
+from .models import Invoice
+
+# (key, heading, days overdue from, days overdue to); None means unbounded
+AGING_BUCKETS = (
+    ('current', 'Current', None, 0),
+    ('days_1_30', '1-30 Days', 1, 30),
+    ('days_31_60', '31-60 Days', 31, 60),
+    ('days_61_90', '61-90 Days', 61, 90),
+    ('days_over_90', '90+ Days', 91, None),
+)
+
+BUCKET_FIELDS = tuple(key for key, _, _, _ in AGING_BUCKETS)
+AMOUNT_FIELDS = BUCKET_FIELDS + ('total',)
+
+CENTS = Decimal('0.01')
+
+
+def bucket_condition(today, first_day, last_day):
+    """Q matching invoices first_day..last_day days past due on today"""
+    condition = Q()
+    if first_day is not None:
+        condition &= Q(due_date__lte=today - timedelta(days=first_day))
+    if last_day is not None:
+        condition &= Q(due_date__gte=today - timedelta(days=last_day))
+    return condition
+
+
+def _sum(condition=None):
+    return Coalesce(Sum('balance', filter=condition), Value(Decimal('0.00')))
+
+
+def compute_aging(user_id, today):
+    """Run the grouped aging query and return (rows, totals)"""
+    aggregates = {
+        key: _sum(bucket_condition(today, first_day, last_day))
+        for key, _, first_day, last_day in AGING_BUCKETS
+    }
+    rows = list(
+        Invoice.objects.filter(user_id=user_id, balance__gt=0)
+        .values('party')
+        .annotate(invoice_count=Count('id'), total=_sum(), **aggregates)
+        .order_by('-total', 'party')
+    )
+    totals = dict.fromkeys(AMOUNT_FIELDS, Decimal('0.00'))
+    totals['invoice_count'] = 0
+    for row in rows:
+        # SQLite sums decimals as floats, so bring them back to two places
+        for field in AMOUNT_FIELDS:
+            row[field] = Decimal(row[field]).quantize(CENTS)
+            totals[field] += row[field]
+        totals['invoice_count'] += row['invoice_count']
+    return rows, totals
+
+
+def aging_report(user_id, today=None):
+    """
+    Return the user's aging report as a dict with as_of, rows and totals,
+    from the cache when it is still current.
+    """
+    today = today or timezone.localdate()
+
+    def build():
+        rows, totals = compute_aging(user_id, today)
+        return {'as_of': today, 'rows': rows, 'totals': totals}
+
+    return cached(user_id, f'aging:{today:%Y-%m-%d}', build)
@@ -0,0 +1,202 @@
+"""
+Read-only JSON API for invoices.
+
+Endpoints mirror the HTML views: a filtered, cursor-paginated invoice list,
+invoice detail and the summary statistics. Rows are serialized straight
+from ``values()`` projections, and every response carries an ETag and
+Last-Modified derived from ``updated_at`` so a poll with nothing new gets an
+empty 304 back.
+"""
+import hashlib
+from datetime import datetime, time
+from functools import wraps
+
+from django.conf import settings
+from django.db.models import Count, Max, Sum
+from django.http import JsonResponse
+from django.utils import timezone
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_GET
+
+from .caching import cached
+from .filters import filter_invoices, filter_payment_status, parse_month
+from .models import Invoice, MonthlySummary
+from .pagination import paginate_keyset, parse_page_size
+from .summaries import month_summary, user_summary
+
+# Fields returned for each invoice in the list endpoint
+API_LIST_FIELDS = (
+    'id', 'invoice_number', 'invoice_date', 'party', 'firm', 'quality',
+    'total_amount', 'due_date', 'balance', 'payment_2', 'settled_payment_2',
+    'days_overdue', 'updated_at',
+)
+
+# Fields returned by the detail endpoint
+API_DETAIL_FIELDS = (
+    'id', 'firm', 'quality', 'invoice_date', 'invoice_number', 'party', 'meter',
+    'total_amount', 'due_date', 'balance', 'payment_date_1', 'payment_1',
+    'dhara_day', 'taka', 'payment_date_2', 'payment_2', 'settled_payment_2',
+    'days_diff', 'days_after_dhara', 'accrued_interest', 'days_overdue',
+    'created_at', 'updated_at',
+)
+
+
+def api_login_required(view):
+    """Like login_required, but answers 401 JSON instead of redirecting"""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({'error': 'Authentication required'}, status=401)
+        return view(request, *args, **kwargs)
+    return wrapper
+
+
+def _make_etag(request, *parts):
+    """Hash the user, the full request path and the state parts into an ETag"""
+    raw = '|'.join(str(part) for part in (request.user.pk, request.get_full_path()) + parts)
+    return hashlib.md5(raw.encode()).hexdigest()
+
+
+def _invoice_last_modified(updated_at):
+    """
+    Invoice payloads include days_overdue, which changes at midnight without
+    any row being updated, so they are never older than the start of today.
+    """
+    if updated_at is None:
+        return None
+    start_of_today = timezone.make_aware(datetime.combine(timezone.localdate(), time.min))
+    return max(updated_at, start_of_today)
+
+
+def _list_queryset(request):
+    invoices, _ = filter_invoices(
+        Invoice.objects.filter(user=request.user).with_days_overdue(),
+        request.GET,
+        request.user.pk,
+    )
+    return filter_payment_status(invoices, request.GET.get('payment_status'))
+
+
+def _list_state(request):
+    """
+    Count and latest updated_at of the filtered invoices, computed once per
+    request for both the ETag and Last-Modified.
+    """
+    if not hasattr(request, '_api_list_state'):
+        try:
+            invoices = _list_queryset(request)
+        except ValueError:
+            request._api_list_state = None
+        else:
+            request._api_list_state = invoices.aggregate(count=Count('id'), last_modified=Max('updated_at'))
+    return request._api_list_state
+
+
+def _list_etag(request):
+    state = _list_state(request)
+    if state is None:
+        return None
+    return _make_etag(request, state['count'], _invoice_last_modified(state['last_modified']))
+
+
+def _list_last_modified(request):
+    state = _list_state(request)
+    return _invoice_last_modified(state['last_modified']) if state else None
+
+
+@require_GET
+@api_login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=_list_etag, last_modified_func=_list_last_modified)
+def invoice_list(request):
+    """Invoices filtered like the HTML list, newest first, one cursor page at a time"""
+    try:
+        invoices = _list_queryset(request)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid month format. Please use YYYY-MM format.'}, status=400)
+
+    page_size = parse_page_size(
+        request.GET.get('page_size'),
+        settings.INVOICE_LIST_PAGE_SIZE,
+        settings.INVOICE_LIST_MAX_PAGE_SIZE,
+    )
+    page = paginate_keyset(
+        invoices.values(*API_LIST_FIELDS),
+        cursor=request.GET.get('cursor'),
+        page_size=page_size,
+    )
+    return JsonResponse({
+        'results': page.object_list,
+        'next_cursor': page.next_cursor,
+        'page_size': page.page_size,
+    })
+
+
+def _detail_queryset(request, pk):
+    return Invoice.objects.filter(pk=pk, user=request.user)
+
+
+def _detail_last_modified(request, pk):
+    if not hasattr(request, '_api_detail_updated_at'):
+        request._api_detail_updated_at = (
+            _detail_queryset(request, pk).values_list('updated_at', flat=True).first()
+        )
+    return _invoice_last_modified(request._api_detail_updated_at)
+
+
+def _detail_etag(request, pk):
+    last_modified = _detail_last_modified(request, pk)
+    return _make_etag(request, last_modified) if last_modified else None
+
+
+@require_GET
+@api_login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=_detail_etag, last_modified_func=_detail_last_modified)
+def invoice_detail(request, pk):
+    """A single invoice with its database-computed day counts and interest"""
+    invoice = (
+        _detail_queryset(request, pk)
+        .with_days_diff().with_days_after_dhara().with_interest().with_days_overdue()
+        .values(*API_DETAIL_FIELDS)
+        .first()
+    )
+    if invoice is None:
+        return JsonResponse({'error': 'Invoice not found'}, status=404)
+    return JsonResponse(invoice)
+
+
+def _summary_state(request):
+    """Latest update and content version of the user's monthly summary rows"""
+    if not hasattr(request, '_api_summary_state'):
+        request._api_summary_state = MonthlySummary.objects.filter(user=request.user).aggregate(
+            last_modified=Max('updated_at'), versions=Sum('version'),
+        )
+    return request._api_summary_state
+
+
+def _summary_etag(request):
+    state = _summary_state(request)
+    return _make_etag(request, state['last_modified'], state['versions'])
+
+
+def _summary_last_modified(request):
+    return _summary_state(request)['last_modified']
+
+
+@require_GET
+@api_login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=_summary_etag, last_modified_func=_summary_last_modified)
+def summary(request):
+    """Summary statistics for all invoices, or for ?month=YYYY-MM"""
+    month_filter = request.GET.get('month')
+    if month_filter:
+        try:
+            month = parse_month(month_filter)
+        except ValueError:
+            return JsonResponse({'error': 'Invalid month format. Please use YYYY-MM format.'}, status=400)
+        stats = cached(request.user.pk, 'summary', lambda: month_summary(request.user, month), month=month)
+    else:
+        stats = cached(request.user.pk, 'summary', lambda: user_summary(request.user))
+    return JsonResponse({'month': month_filter, **stats})
@@ -0,0 +1,188 @@
+"""
+Async versions of the invoice read and export views.
+
+Served under ASGI (uvicorn workers), these let one worker process hold many
+requests at once: the views await the ORM instead of blocking, and exports
+and downloads stream from async iterators, so a slow client ties up a
+coroutine rather than a whole worker. urls.py routes invoice_list,
+invoice_detail, generate_csv and download_csv here when
+RECORDER_ASYNC_VIEWS is set. Under WSGI the sync views in views.py remain
+the better fit, since each async view there gets its own event loop.
+
+The cache, the session and template rendering are synchronous, so those
+steps go through sync_to_async.
+"""
+import asyncio
+import calendar
+import logging
+import os
+from datetime import date
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import messages
+from django.contrib.auth.views import redirect_to_login
+from django.http import Http404, StreamingHttpResponse
+from django.shortcuts import redirect, render
+
+from .exports import astream_csv
+from .filters import filter_invoices, filter_payment_status
+from .models import Invoice
+from .pagination import apaginate_keyset, parse_page_size
+from .reports import get_report
+from .views import (
+    INVOICE_LIST_COLUMNS, REPORT_CONTENT_TYPES, _export_month, list_summary, month_choices,
+    update_session,
+)
+
+logger = logging.getLogger(__name__)
+
+# Bytes read from a stored report per chunk sent
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+
+def async_login_required(view):
+    """login_required for async views (Django 4.2's decorator is sync only)"""
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        # Loads the session and user off the event loop
+        if not await sync_to_async(lambda: request.user.is_authenticated)():
+            return redirect_to_login(request.get_full_path(), 'Recorder:login')
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+async def _month_invoices(request, year, month):
+    """Invoices for the current user in the given month, or None if there are none"""
+    invoices = Invoice.objects.filter(user=request.user).for_month(date(int(year), int(month), 1))
+    if not await invoices.aexists():
+        month_name = calendar.month_name[int(month)]
+        messages.warning(request, f'No invoices found for {month_name} {year}')
+        return None
+    return invoices
+
+
+@async_login_required
+async def invoice_list(request):
+    """Async version of views.invoice_list"""
+    invoices = Invoice.objects.filter(user=request.user).with_days_overdue()
+    months = await sync_to_async(month_choices)(request.user)
+
+    month_filter = request.GET.get('month')
+    party_search = request.GET.get('party_search', '').strip()
+    search_query = request.GET.get('q', '').strip()
+    try:
+        invoices, month = filter_invoices(invoices, request.GET, request.user.pk)
+    except ValueError:
+        messages.error(request, "Invalid month format. Please use YYYY-MM format.")
+        return redirect('Recorder:invoice_list')
+
+    summary_stats = await sync_to_async(list_summary)(
+        request.user, invoices, month, searching=bool(party_search or search_query),
+    )
+
+    payment_status = request.GET.get('payment_status')
+    invoices = filter_payment_status(invoices, payment_status)
+
+    page_size = parse_page_size(
+        request.GET.get('page_size'),
+        settings.INVOICE_LIST_PAGE_SIZE,
+        settings.INVOICE_LIST_MAX_PAGE_SIZE,
+    )
+    page_obj = await apaginate_keyset(
+        invoices.only(*INVOICE_LIST_COLUMNS),
+        cursor=request.GET.get('cursor'),
+        page_size=page_size,
+    )
+
+    filter_params = request.GET.copy()
+    filter_params.pop('cursor', None)
+
+    await sync_to_async(update_session)(request.session, current_month_filter=month_filter)
+
+    context = {
+        'page_obj': page_obj,
+        'filter_query': filter_params.urlencode(),
+        'months': months,
+        'current_month': month_filter,
+        'current_payment_status': payment_status,
+        'summary_stats': summary_stats,
+        'party_search': party_search,
+        'search_query': search_query,
+    }
+    return await sync_to_async(render)(request, 'Recorder/invoice_list.html', context)
+
+
+@async_login_required
+async def invoice_detail(request, pk):
+    """Async version of views.invoice_detail"""
+    try:
+        invoice = await Invoice.objects.with_days_diff().with_days_after_dhara().with_interest().aget(
+            pk=pk, user=request.user,
+        )
+    except Invoice.DoesNotExist:
+        raise Http404('No Invoice matches the given query.')
+
+    context = {
+        'invoice': invoice,
+        'days_diff': invoice.days_diff,
+        'days_minus_dhara': invoice.days_after_dhara,
+        'payment_2': invoice.accrued_interest,
+    }
+    return await sync_to_async(render)(request, 'Recorder/invoice_detail.html', context)
+
+
+@async_login_required
+async def generate_csv(request):
+    """Async version of views.generate_csv"""
+    try:
+        export_month = _export_month(request)
+        if export_month is None:
+            return redirect('Recorder:invoice_list')
+        year, month = export_month
+
+        invoices = await _month_invoices(request, year, month)
+        if invoices is None:
+            return redirect('Recorder:invoice_list')
+
+        return astream_csv(invoices, f'invoices_{year}-{month}.csv')
+
+    except Exception as e:
+        logger.exception('Error in generate_csv view')
+        messages.error(request, f'Error generating CSV: {str(e)}')
+        return redirect('Recorder:invoice_list')
+
+
+async def read_file_chunks(source, chunk_size=DOWNLOAD_CHUNK_SIZE):
+    """Yield an open file's contents chunk by chunk, reading off the event loop"""
+    try:
+        while True:
+            chunk = await asyncio.to_thread(source.read, chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        source.close()
+
+
+@async_login_required
+async def download_csv(request, year_month):
+    """Async version of views.download_csv"""
+    try:
+        year, month = year_month.split('-')
+        invoices = await _month_invoices(request, year, month)
+        if invoices is None:
+            return redirect('Recorder:invoice_list')
+
+        file_path = await sync_to_async(get_report)(request.user.id, date(int(year), int(month), 1), 'csv')
+        # Opened here so a newer version replacing the file can't pull it away mid-download
+        source = await asyncio.to_thread(open, file_path, 'rb')
+        response = StreamingHttpResponse(read_file_chunks(source), content_type=REPORT_CONTENT_TYPES['csv'])
+        response['Content-Length'] = str(os.fstat(source.fileno()).st_size)
+        response['Content-Disposition'] = f'attachment; filename="invoices_{year_month}.csv"'
+        return response
+    except Exception as e:
+        logger.exception('Error downloading CSV')
+        messages.error(request, f'Error downloading CSV: {str(e)}')
+        return redirect('Recorder:invoice_list')
@@ -0,0 +1,363 @@
+"""
+Benchmarks for the request hot paths.
+
+``run_benchmarks`` drives the real views through the Django test client as
+one user, times each case over several iterations and reports the timings
+and query counts as a JSON-serializable dict. Everything runs inside a
+transaction that is rolled back at the end, so uploads and settlements
+leave the data as they found it.
+
+``run_concurrent_exports`` compares how long one worker takes to serve a
+number of slow clients downloading the monthly CSV export: a sync worker
+serves them one after another through the WSGI handler, while the async
+view serves them all at once through the ASGI handler from one event loop.
+Both go through the configured middleware. Clients are simulated by
+pausing for ``client_delay`` seconds per CLIENT_CHUNK_BYTES received.
+
+``run_import_parsing`` times the parsing stage of a CSV import over a
+synthetic file, parsed in the importing process and with process pools of
+different sizes. It needs no data and writes nothing.
+"""
+import asyncio
+import csv
+import io
+import os
+import platform
+import statistics
+import time
+from datetime import timedelta
+from importlib import import_module
+from types import ModuleType
+
+import django
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.messages.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import connection, transaction
+from django.test import AsyncRequestFactory, Client, RequestFactory
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import path, reverse
+from django.utils import timezone
+
+from . import async_views, views
+from .importer import batched
+from .models import Invoice
+from .parsing import OPTIONAL_FIELDS, REQUIRED_FIELDS, parse_batches
+
+# A simulated slow client pauses once per this many bytes received
+CLIENT_CHUNK_BYTES = 64 * 1024
+
+UPLOAD_COLUMNS = (
+    'firm', 'quality', 'invoice_date', 'invoice_number', 'party', 'meter',
+    'total_amount', 'due_date', 'balance', 'dhara_day', 'taka',
+)
+
+
+class Case:
+    """One benchmarked request"""
+
+    def __init__(self, name, method, path, data=None, make_data=None):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.data = data or {}
+        # Called for each iteration when the request body can't be reused
+        self.make_data = make_data
+
+    def request(self, client, iteration):
+        data = self.make_data(iteration) if self.make_data else self.data
+        if self.method == 'POST':
+            response = client.post(self.path, data)
+        else:
+            response = client.get(self.path, data)
+        if response.streaming:
+            # Time the whole body, not just the first chunk
+            for _ in response.streaming_content:
+                pass
+        return response
+
+
+def upload_file(user, rows, iteration):
+    """A CSV upload of `rows` new invoices with numbers unique per iteration"""
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(UPLOAD_COLUMNS)
+    template = Invoice.objects.filter(user=user).order_by('-id').first()
+    invoice_date = template.invoice_date if template else timezone.localdate()
+    for n in range(rows):
+        writer.writerow([
+            'Bench Firm', 'Cotton', invoice_date.isoformat(), f'UPLOAD-{iteration}-{n}',
+            f'Bench Party {n % 50}', '100', '10000', (invoice_date + timedelta(days=30)).isoformat(),
+            '10000', '30', '5',
+        ])
+    return SimpleUploadedFile('benchmark.csv', output.getvalue().encode(), content_type='text/csv')
+
+
+def build_cases(user, upload_rows):
+    """The hot paths, with targets picked from the user's own invoices"""
+    invoices = Invoice.objects.filter(user=user)
+    latest = invoices.order_by('-invoice_date', '-id').first()
+    if latest is None:
+        raise ValueError(f'User {user.username} has no invoices to benchmark against')
+    month = latest.invoice_date.strftime('%Y-%m')
+    party_word = latest.party.split()[0]
+    pending = invoices.filter(balance__gt=1).order_by('-id').first()
+    with_payment_2 = invoices.filter(payment_2__gt=1, settled_payment_2=False).order_by('-id').first()
+
+    list_url = reverse('Recorder:invoice_list')
+    cases = [
+        Case('invoice_list', 'GET', list_url),
+        Case('invoice_list.month', 'GET', list_url, {'month': month}),
+        Case('invoice_list.party_search', 'GET', list_url, {'party_search': latest.party}),
+        Case('invoice_list.q', 'GET', list_url, {'q': party_word}),
+    ] + [
+        Case(f'invoice_list.{status}', 'GET', list_url, {'payment_status': status})
+        for status in ('pending', 'overdue', 'payment_1_settled', 'both_settled')
+    ] + [
+        Case('invoice_detail', 'GET', reverse('Recorder:invoice_detail', args=[latest.pk])),
+        Case('generate_csv', 'GET', reverse('Recorder:generate_csv'), {'month': month}),
+        Case(
+            'invoice_csv_upload', 'POST', reverse('Recorder:invoice_csv_upload'),
+            make_data=lambda iteration: {'csv_file': upload_file(user, upload_rows, iteration)},
+        ),
+    ]
+    if pending:
+        cases.append(Case(
+            'settle_payment_1', 'POST', reverse('Recorder:settle_payment_1', args=[pending.pk]),
+            {'amount': '0.01'},
+        ))
+    if with_payment_2:
+        cases.append(Case(
+            'settle_payment_2', 'POST', reverse('Recorder:settle_payment_2', args=[with_payment_2.pk]),
+            {'amount': '0.01'},
+        ))
+    return cases
+
+
+def time_case(client, case, iterations, warmup):
+    """Run a case and summarise its timings in milliseconds"""
+    for i in range(warmup):
+        case.request(client, f'w{i}')
+    timings = []
+    with CaptureQueriesContext(connection) as queries:
+        response = case.request(client, 0)
+    query_count = len(queries.captured_queries)
+    for i in range(1, iterations + 1):
+        start = time.perf_counter()
+        case.request(client, i)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {
+        'name': case.name,
+        'method': case.method,
+        'path': case.path,
+        'params': {key: str(value) for key, value in case.data.items()},
+        'status': response.status_code,
+        'queries': query_count,
+        'iterations': iterations,
+        'min_ms': round(timings[0], 3),
+        'median_ms': round(statistics.median(timings), 3),
+        'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+        'max_ms': round(timings[-1], 3),
+    }
+
+
+def run_benchmarks(user, iterations=10, warmup=1, upload_rows=200, only=None):
+    """Benchmark every hot path as user and return the report dict"""
+    results = []
+    # Uploads run inline so their cost is measured; the test client's host
+    # is allowed whatever ALLOWED_HOSTS says.
+    with override_settings(INVOICE_IMPORT_BACKGROUND=False, ALLOWED_HOSTS=['*']):
+        with transaction.atomic():
+            client = Client()
+            client.force_login(user)
+            for case in build_cases(user, upload_rows):
+                if only and case.name not in only:
+                    continue
+                results.append(time_case(client, case, iterations, warmup))
+            transaction.set_rollback(True)
+
+    return {
+        'environment': {
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+        },
+        'dataset': {
+            'user': user.username,
+            'invoices': Invoice.objects.filter(user=user).count(),
+        },
+        'results': results,
+    }
+
+
+def prepared_request(factory, user, path, data=None):
+    """
+    A GET request for calling a view function directly, with the user,
+    session and message storage the middleware would have attached.
+    """
+    request = factory.get(path, data)
+    request.user = user
+    request.session = import_module(settings.SESSION_ENGINE).SessionStore()
+    request._messages = default_storage(request)
+    return request
+
+
+def _export_data(user):
+    latest = Invoice.objects.filter(user=user).order_by('-invoice_date', '-id').first()
+    if latest is None:
+        raise ValueError(f'User {user.username} has no invoices to benchmark against')
+    return {'month': latest.invoice_date.strftime('%Y-%m')}
+
+
+# Where the export benchmark mounts the CSV export view it times
+EXPORT_PATH = 'benchmark/export.csv'
+
+
+def _export_urlconf(views_module):
+    """The project's URLconf with views_module's CSV export at EXPORT_PATH"""
+    urlconf = ModuleType('Recorder.benchmark_urls')
+    urlconf.urlpatterns = [
+        path(EXPORT_PATH, views_module.generate_csv),
+    ] + import_module(settings.ROOT_URLCONF).urlpatterns
+    return urlconf
+
+
+def _sync_exports(cookies, clients, client_delay, data):
+    """Serve the clients one at a time through the WSGI handler, as a sync worker does"""
+    handler = WSGIHandler()
+    factory = RequestFactory()
+    factory.cookies = cookies
+    size = 0
+    for _ in range(clients):
+        environ = factory.get(f'/{EXPORT_PATH}', data).environ
+        body = handler(environ, lambda status, headers: None)
+        received = 0
+        try:
+            for chunk in body:
+                received += len(chunk)
+                while received >= CLIENT_CHUNK_BYTES:
+                    received -= CLIENT_CHUNK_BYTES
+                    size += CLIENT_CHUNK_BYTES
+                    time.sleep(client_delay)
+        finally:
+            body.close()
+        size += received
+    return size // clients
+
+
+async def _async_exports(cookies, clients, client_delay, data):
+    """Serve all the clients at once through the ASGI handler, from one event loop"""
+    handler = ASGIHandler()
+    factory = AsyncRequestFactory()
+    factory.cookies = cookies
+    scope = factory.get(f'/{EXPORT_PATH}', data).scope
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def client():
+        received = size = 0
+
+        async def send(message):
+            nonlocal received, size
+            if message['type'] != 'http.response.body':
+                return
+            received += len(message.get('body', b''))
+            while received >= CLIENT_CHUNK_BYTES:
+                received -= CLIENT_CHUNK_BYTES
+                size += CLIENT_CHUNK_BYTES
+                await asyncio.sleep(client_delay)
+
+        await handler(dict(scope), receive, send)
+        return size + received
+
+    sizes = await asyncio.gather(*(client() for _ in range(clients)))
+    return sizes[0]
+
+
+def run_concurrent_exports(user, clients=10, client_delay=0.01):
+    """
+    Time serving `clients` slow CSV export downloads with the sync view
+    through the WSGI handler and the async view through the ASGI handler,
+    so both pay for the project's full middleware stack.
+    """
+    data = _export_data(user)
+    session = Client()
+    session.force_login(user)
+    # The handlers' host check sees the test client's host name
+    with override_settings(ALLOWED_HOSTS=['*']):
+        try:
+            with override_settings(ROOT_URLCONF=_export_urlconf(views)):
+                start = time.perf_counter()
+                sync_size = _sync_exports(session.cookies, clients, client_delay, data)
+                sync_seconds = time.perf_counter() - start
+
+            with override_settings(ROOT_URLCONF=_export_urlconf(async_views)):
+                start = time.perf_counter()
+                async_size = async_to_sync(_async_exports)(session.cookies, clients, client_delay, data)
+                async_seconds = time.perf_counter() - start
+        finally:
+            session.logout()
+
+    if sync_size != async_size:
+        raise RuntimeError(f'Sync and async exports differ in size ({sync_size} != {async_size} bytes)')
+    return {
+        'clients': clients,
+        'client_delay_s': client_delay,
+        'client_chunk_bytes': CLIENT_CHUNK_BYTES,
+        'export_bytes': sync_size,
+        'month': data['month'],
+        'sync_worker_s': round(sync_seconds, 3),
+        'async_worker_s': round(async_seconds, 3),
+        'speedup': round(sync_seconds / async_seconds, 2) if async_seconds else None,
+    }
+
+
+def parsing_file(rows):
+    """An in-memory CSV of `rows` invoices in the formats suppliers send"""
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(REQUIRED_FIELDS + OPTIONAL_FIELDS)
+    for n in range(rows):
+        writer.writerow([
+            'Bench Firm', 'Cotton', '2025-05-10', f'PARSE-{n}', f'Bench Party {n % 50}', '100',
+            '2,13,546.00', '2025-06-10', '1,000.00', '30', '5', '2025-07-01', '1,050.00', '',
+        ])
+    return output.getvalue()
+
+
+def _time_parsing(content, workers, batch_size):
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    rows = csv.DictReader(io.StringIO(content))
+    parsed = [p for _, p in parse_batches(batched(enumerate(rows, 1), batch_size), workers)]
+    return time.perf_counter() - start, time.process_time() - cpu_start, parsed
+
+
+def run_import_parsing(rows=100000, workers=(2, 4), batch_size=None):
+    """
+    Time parsing `rows` CSV rows in the importing process and with each
+    pool size in workers. CPU time is the importing process's own, which
+    bounds the throughput once there are cores enough for the workers.
+    """
+    batch_size = batch_size or settings.INVOICE_IMPORT_BATCH_SIZE
+    content = parsing_file(rows)
+    runs = []
+    expected = None
+    for count in (0,) + tuple(workers):
+        seconds, cpu_seconds, parsed = _time_parsing(content, count, batch_size)
+        if expected is None:
+            expected = parsed
+        elif parsed != expected:
+            raise RuntimeError(f'Parsing with {count} workers differs from parsing in process')
+        runs.append({
+            'workers': count,
+            'wall_s': round(seconds, 3),
+            'importer_cpu_s': round(cpu_seconds, 3),
+            'rows_per_s': round(rows / seconds),
+        })
+    return {'rows': rows, 'batch_size': batch_size, 'cpu_count': os.cpu_count(), 'runs': runs}
@@ -0,0 +1,83 @@
+"""
+Per-user result caching with versioned keys.
+
+Every user has a version token, and so does each of their invoice months
+(keyed on invoice_date, the same month the reports use). Cached results
+embed the tokens they depend on in their key, so invalidating is just
+replacing a token: older entries are never read again and age out of the
+cache on their own. The signals call ``invalidate`` whenever an invoice is
+saved, deleted or bulk-written.
+
+Tokens are random rather than incremented counters so that two workers
+invalidating at the same moment can never write the same value back.
+
+CACHES in settings points at a file-based cache by default, so all
+gunicorn workers on a host see the same entries.
+"""
+import uuid
+
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import month_start
+
+# Cached results expire after a day even if nothing invalidates them
+RESULT_TIMEOUT = 60 * 60 * 24
+
+
+def _user_key(user_id):
+    return f'recorder:version:{user_id}'
+
+
+def _month_key(user_id, month):
+    return f'recorder:version:{user_id}:{month_start(month):%Y-%m}'
+
+
+def _token(key):
+    # Tokens never expire; if one is evicted a fresh token is just a miss
+    return cache.get_or_set(key, lambda: uuid.uuid4().hex, timeout=None)
+
+
+def user_token(user_id):
+    """Version token covering all of a user's invoices"""
+    return _token(_user_key(user_id))
+
+
+def month_token(user_id, month):
+    """Version token covering a user's invoices dated in month"""
+    return _token(_month_key(user_id, month))
+
+
+def _replace_tokens(user_id, months):
+    keys = [_user_key(user_id)] + [_month_key(user_id, month) for month in months]
+    cache.set_many({key: uuid.uuid4().hex for key in keys}, timeout=None)
+
+
+def invalidate(user_id, months=()):
+    """
+    Invalidate everything cached for the user, plus the given invoice months.
+
+    The tokens are replaced straight away, so the rest of the current request
+    sees its own changes, and again once the transaction commits, so a result
+    computed by another worker from the old rows in the meantime is not kept.
+    """
+    months = {month_start(month) for month in months if month}
+    _replace_tokens(user_id, months)
+    transaction.on_commit(lambda: _replace_tokens(user_id, months))
+
+
+def cached(user_id, name, compute, month=None, timeout=RESULT_TIMEOUT):
+    """
+    Return compute() for this user, cached under name.
+
+    Without month the entry is dropped on any change to the user's invoices;
+    with month only changes to invoices dated in that month drop it.
+    """
+    token = month_token(user_id, month) if month is not None else user_token(user_id)
+    scope = f'{month_start(month):%Y-%m}' if month is not None else 'all'
+    key = f'recorder:{user_id}:{scope}:{name}:{token}'
+    value = cache.get(key)
+    if value is None:
+        value = compute()
+        cache.set(key, value, timeout)
+    return value
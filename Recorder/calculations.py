@@ -0,0 +1,150 @@
+"""
+The payment 2 (late payment interest) formula.
+
+    payment_2 = payment_1 / 1.05 * 0.0004931507 * (days_diff - dhara_day)
+
+where days_diff is the number of days from invoice_date to payment_date_1.
+Interest is only due when payment came later than the dhara (credit) days,
+and a settled payment 2 is always zero.
+
+The same formula is available in Python (``calculate_payment_2``) for single
+invoices and as a database expression (``payment_2_expression``) for
+recomputing many invoices in one UPDATE.
+
+Both give the gross interest. Part of it may already have been collected
+through settle_payment_2 (recorded in payment_2_collected), so a stored
+payment 2 is recomputed with ``outstanding_payment_2`` or
+``outstanding_payment_2_expression``, which take the collected amount off.
+"""
+from decimal import Decimal
+
+from django.db import NotSupportedError
+from django.db.models import Case, DateField, DecimalField, F, Func, IntegerField, Q, Value, When
+from django.db.models.functions import Coalesce, Greatest, Round
+
+# Divisor removing the 5% tax from payment 1
+PAYMENT_2_DIVISOR = Decimal('1.05')
+
+# Daily interest rate (18% a year / 365)
+PAYMENT_2_DAILY_RATE = Decimal('0.0004931507')
+
+ZERO = Decimal('0.00')
+
+# Backends that can evaluate payment_2_expression
+EXPRESSION_VENDORS = ('sqlite', 'postgresql')
+
+
+def calculate_payment_2(payment_1, payment_date_1, invoice_date, dhara_day, settled_payment_2):
+    """Calculate payment 2 for one invoice, or None when no interest is due."""
+    if settled_payment_2:
+        return Decimal('0.00')
+
+    if not all([payment_date_1, invoice_date, dhara_day, payment_1]):
+        return None
+
+    # Calculate days difference
+    days_diff = (payment_date_1 - invoice_date).days
+
+    if dhara_day < days_diff:
+        return (payment_1 / PAYMENT_2_DIVISOR) * (PAYMENT_2_DAILY_RATE * (days_diff - dhara_day))
+    return None
+
+
+def outstanding_payment_2(payment_2, collected):
+    """Payment 2 still owed once `collected` of it has been settled"""
+    if not collected:
+        return payment_2
+    if payment_2 is None:
+        return ZERO
+    return max(payment_2 - collected, ZERO)
+
+
+class DaysBetween(Func):
+    """Whole days from the start date expression to the end date expression."""
+    output_field = IntegerField()
+
+    def __init__(self, end, start, **extra):
+        super().__init__(end, start, **extra)
+
+    def as_sql(self, compiler, connection, **extra_context):
+        raise NotSupportedError(f'DaysBetween is not implemented for {connection.vendor}')
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return super().as_sql(
+            compiler, connection,
+            template='CAST(julianday(%(expressions)s) AS INTEGER)',
+            arg_joiner=') - julianday(',
+            **extra_context
+        )
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        # Subtracting two dates gives an integer number of days
+        return super().as_sql(
+            compiler, connection,
+            template='(%(expressions)s)',
+            arg_joiner=' - ',
+            **extra_context
+        )
+
+
+def days_diff_expression():
+    """Days from invoice_date to payment_date_1 (NULL until payment 1 is made)."""
+    return DaysBetween(F('payment_date_1'), F('invoice_date'))
+
+
+def days_after_dhara_expression():
+    """Days paid beyond the dhara (credit) period; negative when paid within it."""
+    return days_diff_expression() - F('dhara_day')
+
+
+def days_overdue_expression(today):
+    """Days an invoice with an outstanding balance is past its due date (0 otherwise)."""
+    return Case(
+        When(
+            balance__gt=0, due_date__lt=today,
+            then=DaysBetween(Value(today, output_field=DateField()), F('due_date')),
+        ),
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+
+
+def payment_2_expression():
+    """Database expression equal to calculate_payment_2, rounded to paise."""
+    amount = DecimalField(max_digits=15, decimal_places=2)
+    interest = Round(
+        F('payment_1') / Value(PAYMENT_2_DIVISOR)
+        * Value(PAYMENT_2_DAILY_RATE)
+        * days_after_dhara_expression(),
+        2,
+        output_field=amount,
+    )
+    interest_due = (
+        Q(payment_date_1__isnull=False, payment_1__isnull=False)
+        & ~Q(payment_1=0)
+        & ~Q(dhara_day=0)
+        & Q(dhara_day__lt=days_diff_expression())
+    )
+    return Case(
+        When(settled_payment_2=True, then=Value(Decimal('0.00'))),
+        When(interest_due, then=interest),
+        default=Value(None),
+        output_field=amount,
+    )
+
+
+def outstanding_payment_2_expression():
+    """Database expression equal to outstanding_payment_2 of payment_2_expression."""
+    amount = DecimalField(max_digits=15, decimal_places=2)
+    return Case(
+        When(payment_2_collected=0, then=payment_2_expression()),
+        default=Greatest(
+            Round(
+                Coalesce(payment_2_expression(), Value(ZERO)) - F('payment_2_collected'),
+                2,
+                output_field=amount,
+            ),
+            Value(ZERO),
+        ),
+        output_field=amount,
+    )
@@ -0,0 +1,150 @@
+"""
+Synthetic invoice data for local load testing.
+
+``generate_dataset`` creates users and invoices that look like production
+data: a few firms per user, a pool of repeat parties, invoices spread over
+the chosen months, and a mix of pending, payment 1 settled and fully
+settled invoices with late payments that accrue payment 2. Rows are written
+with bulk_create and the monthly summaries and search index are refreshed
+once per user through invoices_bulk_changed.
+"""
+import random
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import Invoice, month_start
+from .signals import invoices_bulk_changed
+
+PARTY_PREFIXES = (
+    'Shree', 'Om', 'Jai', 'Mahalaxmi', 'Ganesh', 'Krishna', 'Sai', 'Ambika',
+    'Balaji', 'Radhe', 'Vardhman', 'Navkar', 'Shiv', 'Laxmi', 'Durga', 'Arihant',
+)
+PARTY_SUFFIXES = (
+    'Traders', 'Textiles', 'Fabrics', 'Mills', 'Sons', 'Enterprises',
+    'Creations', 'Silk House', 'Fashion', 'Synthetics', 'Sarees', 'Exports',
+)
+FIRMS = ('Acme Textiles', 'Surat Weaving Co', 'Royal Fabrics', 'Sunrise Mills', 'Pioneer Silk')
+QUALITIES = ('Cotton', 'Rayon', 'Georgette', 'Chiffon', 'Crepe', 'Satin', 'Linen', 'Viscose')
+DHARA_DAYS = (30, 45, 60, 90)
+
+CENTS = Decimal('0.01')
+
+
+def party_names(count, rng):
+    """count distinct party names, numbered once the combinations run out"""
+    names = [f'{prefix} {suffix}' for prefix in PARTY_PREFIXES for suffix in PARTY_SUFFIXES]
+    rng.shuffle(names)
+    return [
+        names[i] if i < len(names) else f'{names[i % len(names)]} {i // len(names) + 1}'
+        for i in range(count)
+    ]
+
+
+def month_starts(months, today):
+    """The first day of each of the last `months` months, oldest first"""
+    starts = []
+    current = month_start(today)
+    for _ in range(months):
+        starts.append(current)
+        current = month_start(current - timedelta(days=1))
+    return list(reversed(starts))
+
+
+def build_invoice(user, number, invoice_date, party, rng, settled_share, paid_share, today):
+    """One unsaved Invoice with amounts and a settlement state drawn from rng"""
+    meter = Decimal(rng.randint(50, 2000)).quantize(CENTS)
+    rate = Decimal(rng.randint(40, 400))
+    total_amount = (meter * rate).quantize(CENTS)
+    dhara_day = rng.choice(DHARA_DAYS)
+    due_date = invoice_date + timedelta(days=dhara_day)
+    invoice = Invoice(
+        user=user,
+        firm=rng.choice(FIRMS),
+        quality=rng.choice(QUALITIES),
+        invoice_date=invoice_date,
+        invoice_number=number,
+        party=party,
+        meter=meter,
+        total_amount=total_amount,
+        due_date=due_date,
+        balance=total_amount,
+        dhara_day=dhara_day,
+        taka=Decimal(rng.randint(1, 60)).quantize(CENTS),
+    )
+
+    draw = rng.random()
+    if draw < settled_share + paid_share:
+        # Paid, sometimes well after the dhara period so payment 2 accrues
+        payment_date = min(invoice_date + timedelta(days=rng.randint(5, dhara_day + 60)), today)
+        invoice.payment_date_1 = payment_date
+        invoice.payment_1 = total_amount
+        invoice.balance = Decimal('0.00')
+        invoice.settled_payment_2 = draw < settled_share
+        if invoice.settled_payment_2:
+            invoice.payment_date_2 = payment_date
+        payment_2 = invoice.calculate_payment_2()
+        invoice.payment_2 = payment_2.quantize(CENTS) if payment_2 is not None else None
+    elif rng.random() < 0.3:
+        # Part payment received
+        invoice.balance = (total_amount * Decimal(rng.randint(10, 90)) / 100).quantize(CENTS)
+    return invoice
+
+
+def generate_dataset(users=1, parties=50, months=12, invoices_per_month=100,
+                     settled_share=0.3, paid_share=0.3, username_prefix='bench',
+                     password=None, seed=None, batch_size=2000, today=None, progress=None):
+    """
+    Create (or reuse) `users` users named <username_prefix>_<n> and give each
+    invoices_per_month invoices in each of the last `months` months.
+
+    Returns the number of invoices created.
+    """
+    rng = random.Random(seed)
+    today = today or timezone.localdate()
+    starts = month_starts(months, today)
+    names = party_names(parties, rng)
+    created = 0
+
+    for n in range(1, users + 1):
+        user, user_created = User.objects.get_or_create(username=f'{username_prefix}_{n}')
+        if user_created:
+            if password:
+                user.set_password(password)
+            else:
+                user.set_unusable_password()
+            user.save()
+
+        # Continue numbering after any invoices generated earlier; numbers
+        # are zero padded, so the highest sorts last
+        last = Invoice.objects.filter(user=user, invoice_number__startswith='GEN-').aggregate(
+            last=Max('invoice_number'),
+        )['last']
+        number = int(last[4:]) if last else 0
+        batch = []
+        for start in starts:
+            days_in_month = (month_start(start + timedelta(days=32)) - start).days
+            for _ in range(invoices_per_month):
+                number += 1
+                invoice_date = min(start + timedelta(days=rng.randrange(days_in_month)), today)
+                batch.append(build_invoice(
+                    user, f'GEN-{number:07d}', invoice_date, rng.choice(names),
+                    rng, settled_share, paid_share, today,
+                ))
+                if len(batch) >= batch_size:
+                    Invoice.objects.bulk_create(batch)
+                    created += len(batch)
+                    batch = []
+                    if progress:
+                        progress(created)
+        if batch:
+            Invoice.objects.bulk_create(batch)
+            created += len(batch)
+            if progress:
+                progress(created)
+
+        invoices_bulk_changed.send(sender=Invoice, user_id=user.pk, months=starts)
+    return created
@@ -0,0 +1,226 @@
+"""
+Monthly invoice exports.
+
+Rows are read with ``values_list().iterator()`` and written out as they
+arrive, so memory stays flat however many invoices a month has. The CSV
+totals row comes from a single aggregate query instead of running sums in
+Python; the XLSX export uses SUM formulas instead.
+
+``astream_csv`` is the CSV stream for async views: it reads with the async
+ORM and yields from an async iterator, which ASGI servers send without
+tying up a thread (a plain iterator would be read in full first).
+"""
+import csv
+import io
+import tempfile
+from decimal import Decimal
+
+import xlsxwriter
+from xlsxwriter.utility import xl_rowcol_to_cell
+
+from django.conf import settings
+from django.db.models import Sum
+from django.http import FileResponse, StreamingHttpResponse
+
+# Column headings, in export order
+EXPORT_COLUMNS = [
+    'Firm', 'Quality', 'Invoice Date', 'Invoice Number', 'Party',
+    'Total Amount', 'Due Date', 'Balance', 'Payment Date 1',
+    'Payment 1', 'Dhara Day', 'Taka', 'Payment Date 2', 'Payment 2', 'Meter'
+]
+
+# Invoice fields matching EXPORT_COLUMNS
+EXPORT_FIELDS = (
+    'firm', 'quality', 'invoice_date', 'invoice_number', 'party',
+    'total_amount', 'due_date', 'balance', 'payment_date_1',
+    'payment_1', 'dhara_day', 'taka', 'payment_date_2', 'payment_2', 'meter',
+)
+
+# Fields summed on the totals row
+TOTAL_FIELDS = ('total_amount', 'balance', 'payment_1', 'taka', 'payment_2', 'meter')
+
+CENTS = Decimal('0.01')
+
+DATE_FIELDS = ('invoice_date', 'due_date', 'payment_date_1', 'payment_date_2')
+
+INTEGER_FIELDS = ('dhara_day',)
+
+# Optional amounts are left blank when empty or zero
+BLANK_IF_EMPTY_FIELDS = ('payment_1', 'payment_2')
+
+
+class Echo:
+    """A file-like object whose write() hands the value back to the caller"""
+
+    def write(self, value):
+        return value
+
+
+def format_row(values):
+    """Format one values_list row (in EXPORT_FIELDS order) for the CSV file"""
+    row = []
+    for field, value in zip(EXPORT_FIELDS, values):
+        if field in DATE_FIELDS:
+            row.append(value.strftime('%Y-%m-%d') if value else '')
+        elif field in BLANK_IF_EMPTY_FIELDS:
+            row.append(str(value) if value else '')
+        else:
+            row.append(str(value))
+    return row
+
+
+def _total_aggregates():
+    return {field: Sum(field) for field in TOTAL_FIELDS}
+
+
+def _quantize_totals(totals):
+    # SQLite sums decimals as floats, so bring them back to two places
+    return {
+        field: Decimal(value).quantize(CENTS) if value is not None else Decimal('0')
+        for field, value in totals.items()
+    }
+
+
+def export_totals(queryset):
+    """Sum the TOTAL_FIELDS over queryset in one aggregate query"""
+    return _quantize_totals(queryset.aggregate(**_total_aggregates()))
+
+
+def totals_row(totals):
+    return [
+        'Total' if field == 'firm' else str(totals[field]) if field in TOTAL_FIELDS else ''
+        for field in EXPORT_FIELDS
+    ]
+
+
+def export_rows(queryset, chunk_size=None):
+    """
+    Yield the header, every invoice row and the totals row as lists.
+
+    The header is yielded before any query runs, so a streaming response
+    can start sending bytes straight away.
+    """
+    chunk_size = chunk_size or settings.INVOICE_EXPORT_CHUNK_SIZE
+    yield EXPORT_COLUMNS
+    rows = queryset.order_by('invoice_date', 'id').values_list(*EXPORT_FIELDS)
+    for values in rows.iterator(chunk_size=chunk_size):
+        yield format_row(values)
+    yield totals_row(export_totals(queryset))
+
+
+def write_csv(queryset, target):
+    """Write queryset as a CSV export to an open text file"""
+    csv.writer(target).writerows(export_rows(queryset))
+
+
+def stream_csv(queryset, filename):
+    """Return a StreamingHttpResponse writing queryset as a CSV export"""
+    writer = csv.writer(Echo())
+    response = StreamingHttpResponse(
+        (writer.writerow(row) for row in export_rows(queryset)),
+        content_type='text/csv',
+    )
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+async def astream_csv_chunks(queryset, chunk_size=None):
+    """
+    Yield the CSV export as text, one chunk of rows at a time, reading the
+    rows with the async ORM.
+
+    Rows are joined per database chunk rather than sent one by one, which
+    keeps the number of ASGI messages (and event loop wake-ups) small.
+    """
+    chunk_size = chunk_size or settings.INVOICE_EXPORT_CHUNK_SIZE
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    yield buffer.getvalue()
+
+    # values() rather than values_list(): Django 4.2's aiterator() runs a
+    # values_list() query on the event loop and fails
+    rows = queryset.order_by('invoice_date', 'id').values(*EXPORT_FIELDS)
+    count = 0
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    async for values in rows.aiterator(chunk_size=chunk_size):
+        writer.writerow(format_row(values[field] for field in EXPORT_FIELDS))
+        count += 1
+        if count % chunk_size == 0:
+            yield buffer.getvalue()
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+
+    writer.writerow(totals_row(_quantize_totals(await queryset.aaggregate(**_total_aggregates()))))
+    yield buffer.getvalue()
+
+
+def astream_csv(queryset, filename):
+    """Return a StreamingHttpResponse streaming queryset as a CSV export from an async iterator"""
+    response = StreamingHttpResponse(astream_csv_chunks(queryset), content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+def write_xlsx(queryset, target, chunk_size=None):
+    """
+    Write queryset as an .xlsx workbook to target (a path or binary file).
+
+    XlsxWriter's constant_memory mode flushes each row to disk as soon as
+    the next one starts, so only one row is held in memory at a time. Dates
+    and amounts are written as typed cells and the totals row uses SUM
+    formulas.
+    """
+    chunk_size = chunk_size or settings.INVOICE_EXPORT_CHUNK_SIZE
+    workbook = xlsxwriter.Workbook(target, {'constant_memory': True})
+    worksheet = workbook.add_worksheet('Invoices')
+    header_format = workbook.add_format({'bold': True})
+    date_format = workbook.add_format({'num_format': 'yyyy-mm-dd'})
+    amount_format = workbook.add_format({'num_format': '#,##0.00'})
+    total_format = workbook.add_format({'bold': True, 'num_format': '#,##0.00'})
+
+    worksheet.write_row(0, 0, EXPORT_COLUMNS, header_format)
+
+    row_index = 0
+    rows = queryset.order_by('invoice_date', 'id').values_list(*EXPORT_FIELDS)
+    for row_index, values in enumerate(rows.iterator(chunk_size=chunk_size), start=1):
+        for col, (field, value) in enumerate(zip(EXPORT_FIELDS, values)):
+            if value is None:
+                continue
+            if field in DATE_FIELDS:
+                worksheet.write_datetime(row_index, col, value, date_format)
+            elif field in INTEGER_FIELDS:
+                worksheet.write_number(row_index, col, value)
+            elif field in TOTAL_FIELDS:
+                worksheet.write_number(row_index, col, float(value), amount_format)
+            else:
+                worksheet.write_string(row_index, col, value)
+
+    totals_index = row_index + 1
+    worksheet.write_string(totals_index, 0, 'Total', header_format)
+    for col, field in enumerate(EXPORT_FIELDS):
+        if field not in TOTAL_FIELDS:
+            continue
+        if not row_index:
+            # With no data rows a SUM range would cover the totals row itself
+            worksheet.write_number(totals_index, col, 0, total_format)
+            continue
+        first = xl_rowcol_to_cell(1, col)
+        last = xl_rowcol_to_cell(row_index, col)
+        worksheet.write_formula(totals_index, col, f'=SUM({first}:{last})', total_format)
+
+    workbook.close()
+
+
+def stream_xlsx(queryset, filename):
+    """Build the workbook in a temporary file and stream it back"""
+    output = tempfile.TemporaryFile()
+    write_xlsx(queryset, output)
+    output.seek(0)
+    return FileResponse(
+        output,
+        as_attachment=True,
+        filename=filename,
+        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    )
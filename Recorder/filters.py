@@ -0,0 +1,57 @@
+"""
+Invoice list filters shared by the HTML list and the JSON API.
+
+Both read the same query parameters: month (YYYY-MM), party_search (party
+substring), q (full-text search) and payment_status.
+"""
+from datetime import date
+
+from .search import filter_party, search_invoices
+
+PAYMENT_STATUSES = ('pending', 'overdue', 'payment_1_settled', 'both_settled')
+
+
+def parse_month(value):
+    """Parse a YYYY-MM string into the first day of that month (ValueError if invalid)"""
+    year, month = value.split('-')
+    return date(int(year), int(month), 1)
+
+
+def filter_invoices(queryset, params, user_id):
+    """
+    Apply the month, party_search and q parameters to an Invoice queryset.
+
+    Returns (queryset, month), month being the first day of the requested
+    month or None. Raises ValueError for a malformed month.
+    """
+    month = None
+    month_filter = params.get('month')
+    if month_filter:
+        month = parse_month(month_filter)
+        queryset = queryset.for_month(month)
+
+    party_search = params.get('party_search', '').strip()
+    if party_search:
+        queryset = filter_party(queryset, party_search)
+
+    search_query = params.get('q', '').strip()
+    if search_query:
+        queryset = search_invoices(queryset, search_query, user_id=user_id)
+
+    return queryset, month
+
+
+def filter_payment_status(queryset, payment_status):
+    """
+    Filter by payment status. The 'overdue' status expects the queryset to
+    carry the with_days_overdue() annotation.
+    """
+    if payment_status == 'both_settled':
+        return queryset.filter(balance=0, settled_payment_2=True)
+    elif payment_status == 'payment_1_settled':
+        return queryset.filter(balance=0, settled_payment_2=False)
+    elif payment_status == 'pending':
+        return queryset.filter(balance__gt=0)
+    elif payment_status == 'overdue':
+        return queryset.filter(days_overdue__gt=0)
+    return queryset
@@ -73,4 +73,15 @@ class InvoiceForm(forms.ModelForm):
         for field_name, field in self.fields.items():
             field.widget.attrs['class'] = 'form-control'
             if isinstance(field, forms.DateField):
-                field.widget.attrs['data-date-format'] = 'yyyy-mm-dd'
\ No newline at end of file
+                field.widget.attrs['data-date-format'] = 'yyyy-mm-dd'
+
+    def clean_invoice_number(self):
+        # The (user, invoice_number) constraint isn't checked by the form
+        # itself because user is not one of its fields
+        invoice_number = self.cleaned_data['invoice_number'].strip()
+        duplicates = Invoice.objects.filter(user_id=self.instance.user_id, invoice_number=invoice_number)
+        if self.instance.pk:
+            duplicates = duplicates.exclude(pk=self.instance.pk)
+        if duplicates.exists():
+            raise forms.ValidationError('You already have an invoice with this number.')
+        return invoice_number
@@ -0,0 +1,287 @@
+"""
+Streaming invoice import.
+
+Rows are read incrementally from the uploaded file, validated a batch at a
+time and written with ``bulk_create`` inside a single transaction. Bulk
+inserts skip the per-instance post_save receivers, so the import sends one
+``invoices_bulk_changed`` signal at the end instead.
+
+Imports are upserts keyed on (user, invoice_number): re-uploading a
+corrected file updates the invoices already imported instead of adding
+duplicates. Each invoice stores a hash of the row it was last imported
+from, so rows that haven't changed since are skipped without a write, and
+the rest of a batch goes to the database as one INSERT ... ON CONFLICT DO
+UPDATE. An update leaves the settlement state alone: the stored balance
+is kept, and payment 2 is recalculated less what has been collected.
+
+Row parsing lives in parsing.py and can run in a process pool
+(INVOICE_IMPORT_WORKERS), overlapping with the writes here.
+
+Uploads may be CSV or .xlsx. Excel sheets are streamed with openpyxl's
+read-only mode and turned into the same row dicts as the CSV reader, so
+both formats share one column contract, validation and write path.
+"""
+import codecs
+import csv
+from contextlib import nullcontext
+from datetime import date, datetime, time
+from itertools import islice
+
+from openpyxl import load_workbook
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+
+from .models import Invoice
+from .parsing import OPTIONAL_FIELDS, REQUIRED_FIELDS, parse_batches
+from .signals import invoices_bulk_changed
+
+# Written over an existing invoice when its row changes on re-import. The
+# columns settlements own are left alone: the balance, which settlements
+# and receipts pay down, and settled_payment_2 and payment_2_collected.
+# payment_2 is recalculated net of what has been collected.
+SETTLEMENT_FIELDS = ['balance']
+UPSERT_FIELDS = [
+    field for field in REQUIRED_FIELDS + OPTIONAL_FIELDS
+    if field != 'invoice_number' and field not in SETTLEMENT_FIELDS
+] + ['payment_2', 'content_hash', 'updated_at']
+
+# What a write can fail with because of one row's values. Decimals that
+# don't fit their column raise decimal.InvalidOperation (an ArithmeticError)
+# while the query is built, before the database sees it.
+WRITE_ERRORS = (DatabaseError, ArithmeticError, ValueError)
+
+
+class ImportResult:
+    """Counts and per-row error messages collected during an import"""
+
+    def __init__(self):
+        self.inserted_count = 0
+        self.updated_count = 0
+        self.unchanged_count = 0
+        self.error_count = 0
+        self.errors = []
+        self.rows_processed = 0
+
+    @property
+    def success_count(self):
+        return self.inserted_count + self.updated_count + self.unchanged_count
+
+    @property
+    def summary(self):
+        message = f'Successfully imported {self.success_count} invoices'
+        if self.updated_count or self.unchanged_count:
+            message += (
+                f' ({self.inserted_count} new, {self.updated_count} updated, '
+                f'{self.unchanged_count} unchanged)'
+            )
+        return message
+
+    def add_error(self, row_num, error):
+        self.error_count += 1
+        self.errors.append((row_num, str(error)))
+
+    @property
+    def error_details(self):
+        return [f"Row {row_num}: {message}" for row_num, message in self.errors]
+
+
+# File types the invoice upload accepts
+UPLOAD_EXTENSIONS = ('.csv', '.xlsx')
+
+
+def read_csv(uploaded_file):
+    """
+    Return a DictReader that decodes the upload line by line instead of
+    reading the whole file into memory. utf-8-sig strips a leading BOM.
+    """
+    return csv.DictReader(codecs.iterdecode(uploaded_file, 'utf-8-sig'))
+
+
+class XlsxReader:
+    """
+    Row dicts from the first worksheet of an .xlsx upload, read like a
+    csv.DictReader: the first row holds the column names. Rows are read from
+    the file as they are iterated, so memory doesn't grow with the sheet.
+    """
+
+    def __init__(self, uploaded_file):
+        self.workbook = load_workbook(uploaded_file, read_only=True, data_only=True)
+        self.rows = self.workbook.worksheets[0].iter_rows(values_only=True)
+        self.fieldnames = [cell_text(value) for value in next(self.rows, ())]
+
+    def __iter__(self):
+        try:
+            for values in self.rows:
+                row = dict(zip(self.fieldnames, map(cell_text, values)))
+                # Formatted but empty rows often trail the data
+                if any(row.values()):
+                    yield row
+        finally:
+            self.workbook.close()
+
+
+def cell_text(value):
+    """A cell value as the text the same cell would have in a CSV export"""
+    if value is None:
+        return ''
+    if isinstance(value, datetime) and value.time() == time():
+        return value.date().isoformat()
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, float) and value.is_integer():
+        # Whole numbers, invoice numbers included, are stored as floats
+        return str(int(value))
+    return str(value).strip()
+
+
+def read_upload(uploaded_file, name):
+    """A reader of row dicts for a CSV or .xlsx upload, chosen by file name"""
+    if name.lower().endswith('.xlsx'):
+        return XlsxReader(uploaded_file)
+    return read_csv(uploaded_file)
+
+
+def missing_fields(fieldnames):
+    """Required columns absent from a header row"""
+    fieldnames = fieldnames or []
+    return [field for field in REQUIRED_FIELDS if field not in fieldnames]
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def validate_batch(user, parsed, result):
+    """Turn a parsed batch into unsaved (row_num, invoice) pairs, recording errors"""
+    invoices = []
+    for row_num, values, row_hash, error in parsed:
+        if error is not None:
+            result.add_error(row_num, error)
+            continue
+        invoice = Invoice(user=user, content_hash=row_hash, **values)
+        invoice.payment_2 = invoice.calculate_payment_2()
+        invoices.append((row_num, invoice))
+    return invoices
+
+
+def _upsert(invoices):
+    Invoice.objects.bulk_create(
+        invoices,
+        update_conflicts=True,
+        unique_fields=['user', 'invoice_number'],
+        update_fields=UPSERT_FIELDS,
+    )
+
+
+def upsert_batch(user, numbered_invoices, result, first_rows):
+    """
+    Insert new invoices and update changed ones with one bulk upsert,
+    skipping rows whose content hash matches the stored invoice. Returns the
+    invoice months touched, including the old month of an invoice whose
+    date changed.
+
+    ``first_rows`` maps each invoice number seen so far in the file to the
+    row that used it first. A number repeated anywhere in the file is
+    rejected on every row after the first, so the outcome doesn't depend
+    on how the file is split into batches.
+    """
+    latest = {}
+    for row_num, invoice in numbered_invoices:
+        first = first_rows.setdefault(invoice.invoice_number, row_num)
+        if first != row_num:
+            result.add_error(row_num, f'Duplicate invoice_number; already used on row {first}')
+            continue
+        latest[invoice.invoice_number] = (row_num, invoice)
+
+    existing = {
+        row['invoice_number']: row
+        for row in Invoice.objects.filter(user=user, invoice_number__in=latest).values(
+            'invoice_number', 'content_hash', 'invoice_date', 'settled_payment_2',
+            'payment_2_collected',
+        )
+    }
+
+    pending = []
+    months = set()
+    for number, (row_num, invoice) in latest.items():
+        stored = existing.get(number)
+        if stored is not None:
+            if stored['content_hash'] == invoice.content_hash:
+                result.unchanged_count += 1
+                continue
+            # Keep payment 2 consistent with the invoice's settlement state
+            invoice.settled_payment_2 = stored['settled_payment_2']
+            invoice.payment_2_collected = stored['payment_2_collected']
+            invoice.payment_2 = invoice.calculate_payment_2()
+            months.add(stored['invoice_date'])
+        pending.append((row_num, invoice, stored is not None))
+
+    def record(invoice, updated):
+        months.add(invoice.invoice_date)
+        if updated:
+            result.updated_count += 1
+        else:
+            result.inserted_count += 1
+
+    try:
+        with transaction.atomic():
+            _upsert([invoice for _, invoice, _ in pending])
+    except WRITE_ERRORS:
+        # Retry row by row so the offending rows are reported individually
+        for row_num, invoice, updated in pending:
+            try:
+                with transaction.atomic():
+                    _upsert([invoice])
+            except WRITE_ERRORS as e:
+                result.add_error(row_num, e)
+                continue
+            record(invoice, updated)
+    else:
+        for _, invoice, updated in pending:
+            record(invoice, updated)
+    return months
+
+
+def import_invoices(user, rows, batch_size=None, progress=None, atomic=True, workers=None):
+    """
+    Import an iterable of CSV row dicts for user and return an ImportResult.
+
+    With ``atomic`` the whole import runs in one transaction. Without it each
+    batch commits on its own, which lets background jobs report progress
+    that other connections can see. ``progress`` is called with the result
+    after every batch. With two or more ``workers`` rows are parsed in a
+    process pool while earlier batches are written.
+    """
+    batch_size = batch_size or settings.INVOICE_IMPORT_BATCH_SIZE
+    if workers is None:
+        workers = settings.INVOICE_IMPORT_WORKERS
+    result = ImportResult()
+    months = set()
+    first_rows = {}
+
+    with transaction.atomic() if atomic else nullcontext():
+        try:
+            for batch, parsed in parse_batches(batched(enumerate(rows, 1), batch_size), workers):
+                valid = validate_batch(user, parsed, result)
+                if valid:
+                    months |= upsert_batch(user, valid, result, first_rows)
+                result.rows_processed += len(batch)
+                if progress:
+                    progress(result)
+        except Exception:
+            # Batches already committed by a non-atomic import still count
+            if not atomic and months:
+                invoices_bulk_changed.send(sender=Invoice, user_id=user.pk, months=months)
+            raise
+
+        # Invalidate summaries and caches once for the whole import
+        if months:
+            invoices_bulk_changed.send(sender=Invoice, user_id=user.pk, months=months)
+
+    return result
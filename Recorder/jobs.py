@@ -0,0 +1,143 @@
+"""
+Background CSV imports.
+
+Uploads are saved to an ImportJob row and processed later by
+``manage.py run_import_worker``. The ImportJob table is the queue: workers
+claim the oldest queued job with a conditional UPDATE, so several workers
+can poll the same database without an external broker.
+
+A running job records a heartbeat after every batch. If its worker dies,
+the heartbeat goes stale and the job is queued again for the next worker
+(INVOICE_IMPORT_STALE_AFTER). Imports are upserts, so rerunning the batches
+the dead worker had already committed leaves them unchanged.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .importer import import_invoices, missing_fields, read_upload
+from .models import ImportJob
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_import(user, uploaded_file):
+    """Store an uploaded CSV or .xlsx file and queue it for the import worker"""
+    return ImportJob.objects.create(
+        user=user,
+        file=uploaded_file,
+        file_name=uploaded_file.name,
+    )
+
+
+def claim_next_job():
+    """
+    Mark the oldest queued job as running and return it, or None if the
+    queue is empty. Safe to call from several workers at once.
+    """
+    with transaction.atomic():
+        queued = ImportJob.objects.filter(status=ImportJob.QUEUED).order_by('created_at')
+        if connection.features.has_select_for_update_skip_locked:
+            queued = queued.select_for_update(skip_locked=True)
+        job = queued.first()
+        if job is None:
+            return None
+        # The status check makes the claim atomic on backends without row locks
+        now = timezone.now()
+        claimed = ImportJob.objects.filter(pk=job.pk, status=ImportJob.QUEUED).update(
+            status=ImportJob.RUNNING,
+            started_at=now,
+            heartbeat_at=now,
+        )
+    if not claimed:
+        return None
+    job.refresh_from_db()
+    return job
+
+
+def requeue_stale_jobs():
+    """
+    Queue running jobs whose worker has stopped sending heartbeats again,
+    and return how many were requeued.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.INVOICE_IMPORT_STALE_AFTER)
+    stale = ImportJob.objects.filter(status=ImportJob.RUNNING).filter(
+        Q(heartbeat_at__lt=cutoff) | Q(heartbeat_at__isnull=True, started_at__lt=cutoff)
+    )
+    requeued = stale.update(
+        status=ImportJob.QUEUED,
+        started_at=None,
+        heartbeat_at=None,
+        rows_processed=0,
+        rows_imported=0,
+        rows_failed=0,
+    )
+    if requeued:
+        logger.warning('Requeued %s stalled import job(s)', requeued)
+    return requeued
+
+
+def _save_progress(job, result):
+    ImportJob.objects.filter(pk=job.pk).update(
+        rows_processed=result.rows_processed,
+        rows_imported=result.success_count,
+        rows_failed=result.error_count,
+        heartbeat_at=timezone.now(),
+    )
+
+
+def run_job(job):
+    """Process a claimed job, recording progress after every batch"""
+    try:
+        with job.file.open('rb') as upload:
+            reader = read_upload(upload, job.file_name)
+            missing = missing_fields(reader.fieldnames)
+            if missing:
+                _finish(job, ImportJob.FAILED, message=f'Missing required fields: {", ".join(missing)}')
+                return job
+            result = import_invoices(
+                job.user,
+                reader,
+                progress=lambda result: _save_progress(job, result),
+                atomic=False,
+            )
+    except Exception as e:
+        logger.exception('Import job %s failed', job.pk)
+        _finish(job, ImportJob.FAILED, message=f'Error processing uploaded file: {str(e)}')
+        return job
+
+    job.rows_processed = result.rows_processed
+    job.rows_imported = result.success_count
+    job.rows_failed = result.error_count
+    job.errors = result.errors
+    _finish(job, ImportJob.SUCCEEDED, message=result.summary)
+    return job
+
+
+def _finish(job, status, message=''):
+    job.status = status
+    job.message = message
+    job.finished_at = timezone.now()
+    # The upload is no longer needed once the job has run
+    job.file.delete(save=False)
+    job.save()
+
+
+def run_pending_jobs(limit=None):
+    """
+    Run queued jobs until the queue is empty (or limit jobs have run),
+    requeueing stalled ones first.
+    """
+    requeue_stale_jobs()
+    processed = 0
+    while limit is None or processed < limit:
+        job = claim_next_job()
+        if job is None:
+            break
+        run_job(job)
+        processed += 1
+    return processed
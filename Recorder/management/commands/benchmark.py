@@ -0,0 +1,67 @@
+import json
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from Recorder.benchmarks import run_benchmarks, run_concurrent_exports, run_import_parsing
+
+
+class Command(BaseCommand):
+    help = 'Time the invoice hot paths against the current data and print the results as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', default='bench_1', help='Username to benchmark as (default: bench_1)')
+        parser.add_argument('--iterations', type=int, default=10, help='Timed runs per case (default: 10)')
+        parser.add_argument('--warmup', type=int, default=1, help='Untimed runs per case (default: 1)')
+        parser.add_argument('--upload-rows', type=int, default=200, help='Rows in the benchmark CSV upload (default: 200)')
+        parser.add_argument('--only', nargs='+', help='Only run the named cases, e.g. invoice_list generate_csv')
+        parser.add_argument(
+            '--export-clients', type=int, default=0,
+            help='Also compare serving this many slow CSV export clients with the sync and async views',
+        )
+        parser.add_argument(
+            '--client-delay', type=float, default=0.01,
+            help='Seconds each simulated export client pauses per 64 KiB received (default: 0.01)',
+        )
+        parser.add_argument(
+            '--parse-rows', type=int, default=0,
+            help='Also time parsing a synthetic CSV import of this many rows, in process and in process pools',
+        )
+        parser.add_argument(
+            '--parse-workers', type=int, nargs='+', default=[2, 4],
+            help='Process pool sizes to time with --parse-rows (default: 2 4)',
+        )
+        parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f"User '{options['user']}' does not exist; run generate_invoices first")
+        if options['iterations'] < 1:
+            raise CommandError('--iterations must be at least 1')
+
+        try:
+            report = run_benchmarks(
+                user,
+                iterations=options['iterations'],
+                warmup=options['warmup'],
+                upload_rows=options['upload_rows'],
+                only=options['only'],
+            )
+            if options['export_clients'] > 0:
+                report['concurrent_exports'] = run_concurrent_exports(
+                    user, clients=options['export_clients'], client_delay=options['client_delay'],
+                )
+            if options['parse_rows'] > 0:
+                report['import_parsing'] = run_import_parsing(options['parse_rows'], options['parse_workers'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as target:
+                target.write(output + '\n')
+            self.stdout.write(self.style.SUCCESS(f"Wrote {len(report['results'])} result(s) to {options['output']}"))
+        else:
+            self.stdout.write(output)
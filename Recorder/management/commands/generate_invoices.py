@@ -0,0 +1,54 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from Recorder.datagen import generate_dataset
+
+
+class Command(BaseCommand):
+    help = 'Generate realistic synthetic invoices for load testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1, help='Number of users (default: 1)')
+        parser.add_argument('--parties', type=int, default=50, help='Distinct parties per user (default: 50)')
+        parser.add_argument('--months', type=int, default=12, help='Months of history, ending this month (default: 12)')
+        parser.add_argument(
+            '--invoices-per-month', type=int, default=100,
+            help='Invoices per user per month (default: 100)',
+        )
+        parser.add_argument(
+            '--settled', type=float, default=0.3,
+            help='Share of invoices with both payments settled (default: 0.3)',
+        )
+        parser.add_argument(
+            '--paid', type=float, default=0.3,
+            help='Share of invoices with only payment 1 settled (default: 0.3)',
+        )
+        parser.add_argument('--username-prefix', default='bench', help='Users are named <prefix>_<n> (default: bench)')
+        parser.add_argument('--password', help='Password for newly created users (default: unusable)')
+        parser.add_argument('--seed', type=int, help='Random seed for a reproducible dataset')
+        parser.add_argument('--batch-size', type=int, default=2000, help='Rows per bulk_create (default: 2000)')
+
+    def handle(self, *args, **options):
+        if options['settled'] + options['paid'] > 1:
+            raise CommandError('--settled and --paid must add up to at most 1')
+
+        start = time.perf_counter()
+        created = generate_dataset(
+            users=options['users'],
+            parties=options['parties'],
+            months=options['months'],
+            invoices_per_month=options['invoices_per_month'],
+            settled_share=options['settled'],
+            paid_share=options['paid'],
+            username_prefix=options['username_prefix'],
+            password=options['password'],
+            seed=options['seed'],
+            batch_size=options['batch_size'],
+            progress=lambda count: self.stdout.write(f'  {count} invoices written'),
+        )
+        elapsed = time.perf_counter() - start
+        rate = created / elapsed if elapsed else created
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated {created} invoice(s) in {elapsed:.1f}s ({rate:.0f} rows/s)'
+        ))
@@ -0,0 +1,41 @@
+from datetime import datetime
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from Recorder.models import Invoice
+from Recorder.recalculation import recalculate_payment_2
+
+
+class Command(BaseCommand):
+    help = 'Recompute payment 2 for invoices after the interest formula changes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            help='Only recalculate invoices belonging to this username',
+        )
+        parser.add_argument(
+            '--month',
+            help='Only recalculate invoices dated in this month (YYYY-MM)',
+        )
+
+    def handle(self, *args, **options):
+        invoices = Invoice.objects.all()
+
+        if options['user']:
+            try:
+                user = User.objects.get(username=options['user'])
+            except User.DoesNotExist:
+                raise CommandError(f"User '{options['user']}' does not exist")
+            invoices = invoices.filter(user=user)
+
+        if options['month']:
+            try:
+                month = datetime.strptime(options['month'], '%Y-%m').date()
+            except ValueError:
+                raise CommandError('Invalid month format. Please use YYYY-MM format.')
+            invoices = invoices.for_month(month)
+
+        updated = recalculate_payment_2(invoices)
+        self.stdout.write(self.style.SUCCESS(f'Recalculated payment 2 for {updated} invoice(s)'))
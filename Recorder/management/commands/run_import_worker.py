@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from Recorder.jobs import run_pending_jobs
+
+
+class Command(BaseCommand):
+    help = 'Process queued CSV import jobs outside the request cycle'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Process the jobs currently queued and exit instead of polling',
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=2.0,
+            help='Seconds to wait between polls when the queue is empty (default: 2)',
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write('Import worker started')
+        while True:
+            processed = run_pending_jobs()
+            if processed:
+                self.stdout.write(f'Processed {processed} import job(s)')
+            if options['once']:
+                break
+            time.sleep(options['poll_interval'])
@@ -0,0 +1,457 @@
+"""
+Per-request performance metrics.
+
+``MetricsMiddleware`` times every request and records, per resolved view
+name, histograms of wall time, SQL query count, SQL time and response size.
+Streaming responses are recorded when their body has been produced, so the
+queries and time of a streamed export are part of its numbers.
+Observations go into an in-process registry. Each process periodically
+writes its registry to its own JSON file in METRICS_DIR, and ``/metrics``
+merges every process's file into the Prometheus text format, so the numbers
+cover all gunicorn workers rather than whichever worker answers the scrape.
+Files of processes that have exited are folded into a retired total on the
+next scrape, so restarts neither lose counts nor leave files behind (on
+platforms without fcntl the files are merged but never retired).
+
+Requests slower than SLOW_REQUEST_THRESHOLD_MS (unset by default) are
+logged to the 'Recorder.metrics' logger together with the SQL they ran.
+"""
+import atexit
+import glob
+import json
+import logging
+import os
+import re
+import secrets
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+
+from django.conf import settings
+from django.db import connection
+from django.http import Http404, HttpResponse, HttpResponseForbidden
+
+logger = logging.getLogger('Recorder.metrics')
+
+# name: (help text, bucket upper bounds)
+HISTOGRAMS = {
+    'recorder_request_duration_seconds': (
+        'Wall time spent producing a response, streamed bodies included',
+        (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+    ),
+    'recorder_request_queries': (
+        'SQL queries run per request',
+        (0, 1, 2, 5, 10, 20, 50, 100, 200, 500),
+    ),
+    'recorder_request_query_duration_seconds': (
+        'Time spent in SQL per request',
+        (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+    ),
+    'recorder_response_size_bytes': (
+        'Size of the response body',
+        (1000, 10000, 100000, 1000000, 10000000),
+    ),
+}
+
+UNRESOLVED_VIEW = '<unresolved>'
+
+# Totals of processes that have exited, and the lock serializing updates to it
+RETIRED_FILE = 'retired.json'
+LOCK_FILE = 'metrics.lock'
+
+
+class Registry:
+    """
+    Histograms for this process, keyed by (metric name, view name).
+
+    Each entry is {'buckets': [count per bucket + one overflow], 'sum', 'count'}.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.series = {}
+        self.last_flush = 0.0
+        self._key = None
+
+    def observe(self, name, view, value):
+        bounds = HISTOGRAMS[name][1]
+        with self.lock:
+            entry = self.series.get((name, view))
+            if entry is None:
+                entry = {'buckets': [0] * (len(bounds) + 1), 'sum': 0.0, 'count': 0}
+                self.series[(name, view)] = entry
+            entry['buckets'][bisect_left(bounds, value)] += 1
+            entry['sum'] += value
+            entry['count'] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return [
+                {'name': name, 'view': view, 'buckets': list(entry['buckets']),
+                 'sum': entry['sum'], 'count': entry['count']}
+                for (name, view), entry in self.series.items()
+            ]
+
+    def flush(self, force=False):
+        """Write this process's snapshot to its file if the flush interval has passed"""
+        now = time.monotonic()
+        if not force and now - self.last_flush < settings.METRICS_FLUSH_INTERVAL:
+            return
+        self.last_flush = now
+        _write_series(self.snapshot(), process_file(self.key))
+
+    @property
+    def key(self):
+        """
+        This process's file key: its pid and a random nonce, so a process
+        that gets a recycled pid doesn't overwrite a dead one's counters.
+        """
+        pid = os.getpid()
+        if self._key is None or self._key[0] != pid:
+            # A forked worker starts its own file
+            self._key = (pid, secrets.token_hex(4))
+        return self._key
+
+
+registry = Registry()
+
+
+def process_file(key):
+    pid, nonce = key
+    return os.path.join(settings.METRICS_DIR, f'metrics_{pid}_{nonce}.json')
+
+
+def _write_series(series, path):
+    os.makedirs(settings.METRICS_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=settings.METRICS_DIR, suffix='.tmp')
+    with os.fdopen(fd, 'w') as target:
+        json.dump(series, target)
+    os.replace(tmp_path, path)
+
+
+@atexit.register
+def _flush_at_exit():
+    if registry.series:
+        try:
+            registry.flush(force=True)
+        except Exception:
+            pass
+
+
+PROCESS_FILE_RE = re.compile(r'metrics_(\d+)_([0-9a-f]+)\.json\Z')
+
+
+def _read_series(path):
+    try:
+        with open(path) as source:
+            return json.load(source)
+    except (OSError, ValueError):
+        # A file being replaced or a truncated write; the next scrape reads it
+        return None
+
+
+def _add_series(merged, series):
+    for entry in series:
+        key = (entry['name'], entry['view'])
+        total = merged.get(key)
+        if total is None:
+            merged[key] = {'buckets': list(entry['buckets']), 'sum': entry['sum'], 'count': entry['count']}
+        else:
+            total['buckets'] = [a + b for a, b in zip(total['buckets'], entry['buckets'])]
+            total['sum'] += entry['sum']
+            total['count'] += entry['count']
+
+
+def _pid_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def dead_process_files(paths):
+    """
+    The files of processes that have exited: their pid is gone, or a newer
+    file has the same pid, which the dead process's pid was recycled for.
+    """
+    newest = {}
+    for path in paths:
+        pid = int(PROCESS_FILE_RE.match(os.path.basename(path)).group(1))
+        newest.setdefault(pid, []).append(path)
+    dead = []
+    for pid, pid_paths in newest.items():
+        pid_paths.sort(key=os.path.getmtime)
+        if _pid_running(pid):
+            dead.extend(pid_paths[:-1])
+        else:
+            dead.extend(pid_paths)
+    return dead
+
+
+def retire_dead_processes(paths):
+    """
+    Fold the files of exited processes into retired.json and delete them, so
+    the directory doesn't grow with every worker restart while the counters
+    keep their totals. Returns the live processes' files.
+    """
+    dead = dead_process_files(paths)
+    if not dead:
+        return paths
+    retired_path = os.path.join(settings.METRICS_DIR, RETIRED_FILE)
+    retired = {}
+    _add_series(retired, _read_series(retired_path) or [])
+    for path in dead:
+        _add_series(retired, _read_series(path) or [])
+    _write_series(
+        [dict(entry, name=name, view=view) for (name, view), entry in retired.items()],
+        retired_path,
+    )
+    for path in dead:
+        os.remove(path)
+    return [path for path in paths if path not in dead]
+
+
+def merged_series():
+    """Sum the series written by every process, past and present"""
+    os.makedirs(settings.METRICS_DIR, exist_ok=True)
+    paths = [
+        path for path in glob.glob(os.path.join(settings.METRICS_DIR, 'metrics_*.json'))
+        if PROCESS_FILE_RE.match(os.path.basename(path))
+    ]
+    merged = {}
+    # Scrapes served by different workers must not retire the same file twice
+    with open(os.path.join(settings.METRICS_DIR, LOCK_FILE), 'a') as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            paths = retire_dead_processes(paths)
+        for path in paths + [os.path.join(settings.METRICS_DIR, RETIRED_FILE)]:
+            _add_series(merged, _read_series(path) or [])
+    return merged
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render_prometheus(series):
+    """Format merged series as Prometheus text exposition"""
+    lines = []
+    for name, (help_text, bounds) in HISTOGRAMS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} histogram')
+        for (series_name, view), entry in sorted(series.items()):
+            if series_name != name:
+                continue
+            view_label = f'view="{_label(view)}"'
+            cumulative = 0
+            for bound, count in zip(bounds + ('+Inf',), entry['buckets']):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{view_label},le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_sum{{{view_label}}} {entry["sum"]}')
+            lines.append(f'{name}_count{{{view_label}}} {entry["count"]}')
+    return '\n'.join(lines) + '\n'
+
+
+class QueryRecorder:
+    """A database execute_wrapper that counts and times queries"""
+
+    def __init__(self, keep_sql=False):
+        self.count = 0
+        self.duration = 0.0
+        self.keep_sql = keep_sql
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.count += 1
+            self.duration += elapsed
+            if self.keep_sql:
+                self.queries.append((elapsed, sql))
+
+
+class RequestMeasurement:
+    """
+    Wall time, SQL and body size of one request, recorded once the response
+    is complete. A streaming response is measured until its last chunk has
+    been produced, so queries run while the body is generated count too.
+    """
+
+    def __init__(self, request):
+        self.request = request
+        self.threshold = settings.SLOW_REQUEST_THRESHOLD_MS
+        self.queries = QueryRecorder(keep_sql=self.threshold is not None)
+        self.size = 0
+        self.finished = False
+        self.counted_wrappers = None
+        self.start = time.perf_counter()
+
+    def counting_queries(self):
+        return connection.execute_wrapper(self.queries)
+
+    def start_counting(self):
+        """Count this thread's queries until finish() or stop_counting()"""
+        self.counted_wrappers = connection.execute_wrappers
+        self.counted_wrappers.append(self.queries)
+
+    def stop_counting(self):
+        if self.counted_wrappers is not None:
+            self.counted_wrappers.remove(self.queries)
+            self.counted_wrappers = None
+
+    def stream(self, response):
+        """Wrap a streaming response's content so the body is measured too"""
+        if response.is_async:
+            return MeasuredAsyncStream(self, response.streaming_content)
+        return MeasuredStream(self, response.streaming_content)
+
+    def finish(self, size=None):
+        """Record the observations; later calls do nothing"""
+        if self.finished:
+            return
+        self.finished = True
+        self.stop_counting()
+        duration = time.perf_counter() - self.start
+        request = self.request
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else UNRESOLVED_VIEW
+        registry.observe('recorder_request_duration_seconds', view, duration)
+        registry.observe('recorder_request_queries', view, self.queries.count)
+        registry.observe('recorder_request_query_duration_seconds', view, self.queries.duration)
+        registry.observe('recorder_response_size_bytes', view, self.size if size is None else size)
+
+        if self.threshold is not None and duration * 1000 >= self.threshold:
+            logger.warning(
+                'Slow request: %s %s (%s) took %.0f ms with %d queries (%.0f ms SQL)\n%s',
+                request.method, request.path, view, duration * 1000,
+                self.queries.count, self.queries.duration * 1000,
+                '\n'.join(f'  [{elapsed * 1000:.1f} ms] {sql}' for elapsed, sql in self.queries.queries),
+            )
+
+        try:
+            registry.flush()
+        except OSError:
+            logger.exception('Could not write metrics to %s', settings.METRICS_DIR)
+
+
+class MeasuredContent:
+    """
+    Streaming content that counts the queries run while each chunk is
+    produced, but not while the server sends it. The measurement finishes
+    when the content runs out, or when the response is closed early because
+    the client went away.
+    """
+
+    def __init__(self, measurement, content):
+        self.measurement = measurement
+        self.content = content
+
+    def close(self):
+        self.measurement.finish()
+
+
+class MeasuredStream(MeasuredContent):
+    def __iter__(self):
+        iterator = iter(self.content)
+        while True:
+            with self.measurement.counting_queries():
+                chunk = next(iterator, None)
+            if chunk is None:
+                break
+            self.measurement.size += len(chunk)
+            yield chunk
+        self.close()
+
+
+class MeasuredAsyncStream(MeasuredContent):
+    # The chunks' queries run on sync_to_async threads, where the async
+    # middleware path counts them
+    async def __aiter__(self):
+        async for chunk in self.content:
+            self.measurement.size += len(chunk)
+            yield chunk
+        self.close()
+
+
+class MetricsMiddleware:
+    """
+    Record per-view timing, query and size histograms for each request.
+
+    Sync and async capable, so under ASGI it doesn't force the rest of the
+    middleware chain and the async views into a thread.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not settings.METRICS_ENABLED:
+            return self.get_response(request)
+
+        measurement = RequestMeasurement(request)
+        with measurement.counting_queries():
+            response = self.get_response(request)
+        return self.measure_body(measurement, response)
+
+    async def __acall__(self, request):
+        if not settings.METRICS_ENABLED:
+            return await self.get_response(request)
+
+        measurement = RequestMeasurement(request)
+        # The request's queries run on its thread-sensitive executor thread,
+        # so count them on that thread's connection until the response is done
+        await sync_to_async(measurement.start_counting)()
+        try:
+            response = await self.get_response(request)
+        except BaseException:
+            measurement.stop_counting()
+            raise
+        return self.measure_body(measurement, response)
+
+    @staticmethod
+    def measure_body(measurement, response):
+        if getattr(response, 'file_to_stream', None) is not None:
+            # Leave file downloads to the server's sendfile; nothing is
+            # queried while the file is sent
+            length = response.get('Content-Length')
+            measurement.finish(int(length) if length else 0)
+        elif response.streaming:
+            response.streaming_content = measurement.stream(response)
+        else:
+            measurement.finish(len(response.content))
+        return response
+
+
+def metrics_view(request):
+    """Expose the merged metrics of every worker in Prometheus text format"""
+    if not settings.METRICS_ENABLED:
+        raise Http404
+    token = settings.METRICS_TOKEN
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return HttpResponseForbidden('Forbidden')
+    # Include this process's latest observations
+    registry.flush(force=True)
+    return HttpResponse(
+        render_prometheus(merged_series()),
+        content_type='text/plain; version=0.0.4; charset=utf-8',
+    )
@@ -0,0 +1,39 @@
+"""
+Middleware adapters.
+
+WhiteNoise's middleware (6.x) is sync-only. Under ASGI Django runs a
+sync-only middleware in a thread and wraps everything below it, the async
+views included, in async_to_sync, so each request gets its own event loop
+in a thread and the async views stop paying off. ``StaticFilesMiddleware``
+keeps WhiteNoise's behaviour but takes part in an async chain: static files
+are looked up on the event loop and served from a thread, and every other
+request is awaited straight through.
+"""
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+
+class StaticFilesMiddleware(WhiteNoiseMiddleware):
+    """WhiteNoiseMiddleware that is also async capable"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, *args, **kwargs):
+        super().__init__(get_response, *args, **kwargs)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            # Looks on disk, which would block the event loop
+            static_file = await sync_to_async(self.find_file)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return await sync_to_async(self.serve)(static_file, request)
+        return await self.get_response(request)
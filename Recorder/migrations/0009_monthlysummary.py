@@ -0,0 +1,73 @@
+# Generated by Django 4.2 on 2026-10-18 13:43
+
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum, Value
+from django.db.models.functions import Coalesce, TruncMonth
+import django.db.models.deletion
+
+
+def build_monthly_summaries(apps, schema_editor):
+    """Backfill MonthlySummary from the existing invoices"""
+    Invoice = apps.get_model('Recorder', 'Invoice')
+    MonthlySummary = apps.get_model('Recorder', 'MonthlySummary')
+
+    zero = Value(Decimal('0.00'))
+    pending = Q(balance__gt=0)
+    payment_1_settled = Q(balance=0, settled_payment_2=False)
+    both_settled = Q(balance=0, settled_payment_2=True)
+
+    rows = (
+        Invoice.objects.annotate(month=TruncMonth('invoice_date'))
+        .values('user_id', 'month')
+        .annotate(
+            invoice_count=Count('id'),
+            pending_count=Count('id', filter=pending),
+            pending_amount=Coalesce(Sum('balance', filter=pending), zero),
+            payment_1_settled_count=Count('id', filter=payment_1_settled),
+            payment_1_settled_amount=Coalesce(Sum('total_amount', filter=payment_1_settled), zero),
+            both_settled_count=Count('id', filter=both_settled),
+            both_settled_amount=Coalesce(Sum('total_amount', filter=both_settled), zero),
+            total_balance=Coalesce(Sum('balance'), zero),
+        )
+        .order_by()
+    )
+    MonthlySummary.objects.bulk_create([MonthlySummary(**row) for row in rows], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('Recorder', '0008_alter_invoice_payment_1_alter_invoice_payment_2_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlySummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('invoice_count', models.IntegerField(default=0)),
+                ('pending_count', models.IntegerField(default=0)),
+                ('pending_amount', models.DecimalField(decimal_places=2, default=0, max_digits=17)),
+                ('payment_1_settled_count', models.IntegerField(default=0)),
+                ('payment_1_settled_amount', models.DecimalField(decimal_places=2, default=0, max_digits=17)),
+                ('both_settled_count', models.IntegerField(default=0)),
+                ('both_settled_amount', models.DecimalField(decimal_places=2, default=0, max_digits=17)),
+                ('total_balance', models.DecimalField(decimal_places=2, default=0, max_digits=17)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='monthly_summaries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-month'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='monthlysummary',
+            constraint=models.UniqueConstraint(fields=('user', 'month'), name='unique_monthly_summary'),
+        ),
+        migrations.RunPython(build_monthly_summaries, migrations.RunPython.noop),
+    ]
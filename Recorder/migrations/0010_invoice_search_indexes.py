@@ -0,0 +1,78 @@
+# Generated by Django 4.2 on 2026-10-18 13:45
+
+from django.db import migrations, models
+
+# The party search index as of this migration. The SQL is kept here rather
+# than imported from Recorder.search so later changes there can't alter
+# what this migration does.
+SQLITE_CREATE = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS recorder_invoice_party_trgm
+    USING fts5(party, content='Recorder_invoice', content_rowid='id', tokenize='trigram')
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS recorder_invoice_party_trgm_ai AFTER INSERT ON Recorder_invoice BEGIN
+        INSERT INTO recorder_invoice_party_trgm(rowid, party) VALUES (new.id, new.party);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS recorder_invoice_party_trgm_ad AFTER DELETE ON Recorder_invoice BEGIN
+        INSERT INTO recorder_invoice_party_trgm(recorder_invoice_party_trgm, rowid, party) VALUES ('delete', old.id, old.party);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS recorder_invoice_party_trgm_au AFTER UPDATE OF party ON Recorder_invoice BEGIN
+        INSERT INTO recorder_invoice_party_trgm(recorder_invoice_party_trgm, rowid, party) VALUES ('delete', old.id, old.party);
+        INSERT INTO recorder_invoice_party_trgm(rowid, party) VALUES (new.id, new.party);
+    END
+    """,
+    "INSERT INTO recorder_invoice_party_trgm(recorder_invoice_party_trgm) VALUES ('rebuild')",
+]
+
+SQLITE_DROP = [
+    'DROP TRIGGER IF EXISTS recorder_invoice_party_trgm_ai',
+    'DROP TRIGGER IF EXISTS recorder_invoice_party_trgm_ad',
+    'DROP TRIGGER IF EXISTS recorder_invoice_party_trgm_au',
+    'DROP TABLE IF EXISTS recorder_invoice_party_trgm',
+]
+
+POSTGRESQL_CREATE = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX IF NOT EXISTS invoice_party_trgm_idx ON "Recorder_invoice" USING gin (UPPER(party) gin_trgm_ops)',
+]
+
+POSTGRESQL_DROP = ['DROP INDEX IF EXISTS invoice_party_trgm_idx']
+
+
+def run_for_vendor(sqlite, postgresql):
+    def run(apps, schema_editor):
+        statements = {'sqlite': sqlite, 'postgresql': postgresql}.get(schema_editor.connection.vendor, [])
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Recorder', '0009_monthlysummary'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['user', 'invoice_date'], name='invoice_user_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['user', 'balance', 'settled_payment_2'], name='invoice_user_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['user', 'due_date'], name='invoice_user_due_idx'),
+        ),
+        migrations.RunPython(
+            run_for_vendor(SQLITE_CREATE, POSTGRESQL_CREATE),
+            run_for_vendor(SQLITE_DROP, POSTGRESQL_DROP),
+        ),
+    ]
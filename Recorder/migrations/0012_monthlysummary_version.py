@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-18 13:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Recorder', '0011_importjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='monthlysummary',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 4.2 on 2026-10-18 14:20
+
+from django.db import migrations
+
+# The full-text search index as of this migration, kept here rather than
+# imported from Recorder.search so later changes there can't alter what
+# this migration does.
+SQLITE_CREATE = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS recorder_invoice_search
+    USING fts5(owner, invoice_number, party, firm, quality, tokenize='unicode61 remove_diacritics 2', prefix='2 3')
+    """,
+    'DELETE FROM recorder_invoice_search',
+    """
+    INSERT INTO recorder_invoice_search(rowid, owner, invoice_number, party, firm, quality)
+    SELECT id, 'u' || user_id, invoice_number, party, firm, quality FROM Recorder_invoice
+    """,
+]
+
+SQLITE_DROP = ['DROP TABLE IF EXISTS recorder_invoice_search']
+
+POSTGRESQL_CREATE = [
+    """
+    CREATE INDEX IF NOT EXISTS invoice_fulltext_idx ON "Recorder_invoice" USING gin ((
+        to_tsvector('simple'::regconfig, "invoice_number" || ' ' || "party" || ' ' || "firm" || ' ' || "quality")
+    ))
+    """,
+]
+
+POSTGRESQL_DROP = ['DROP INDEX IF EXISTS invoice_fulltext_idx']
+
+
+def run_for_vendor(sqlite, postgresql):
+    def run(apps, schema_editor):
+        statements = {'sqlite': sqlite, 'postgresql': postgresql}.get(schema_editor.connection.vendor, [])
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Recorder', '0012_monthlysummary_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_for_vendor(SQLITE_CREATE, POSTGRESQL_CREATE),
+            run_for_vendor(SQLITE_DROP, POSTGRESQL_DROP),
+        ),
+    ]
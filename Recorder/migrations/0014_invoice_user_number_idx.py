@@ -0,0 +1,17 @@
+# Generated by Django 4.2 on 2026-10-18 14:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Recorder', '0013_invoice_fulltext_search'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['user', 'invoice_number'], name='invoice_user_number_idx'),
+        ),
+    ]
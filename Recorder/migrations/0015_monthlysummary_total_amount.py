@@ -0,0 +1,41 @@
+# Generated by Django 4.2 on 2026-10-18 14:52
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Sum, Value
+from django.db.models.functions import Coalesce, TruncMonth
+
+
+def backfill_total_amount(apps, schema_editor):
+    """Fill total_amount on the existing summary rows from the invoices"""
+    Invoice = apps.get_model('Recorder', 'Invoice')
+    MonthlySummary = apps.get_model('Recorder', 'MonthlySummary')
+
+    totals = {
+        (row['user_id'], row['month']): row['total']
+        for row in Invoice.objects.annotate(month=TruncMonth('invoice_date'))
+        .values('user_id', 'month')
+        .annotate(total=Coalesce(Sum('total_amount'), Value(Decimal('0.00'))))
+        .order_by()
+    }
+    summaries = list(MonthlySummary.objects.all())
+    for summary in summaries:
+        summary.total_amount = totals.get((summary.user_id, summary.month), Decimal('0.00'))
+    MonthlySummary.objects.bulk_update(summaries, ['total_amount'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Recorder', '0014_invoice_user_number_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='monthlysummary',
+            name='total_amount',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=17),
+        ),
+        migrations.RunPython(backfill_total_amount, migrations.RunPython.noop),
+    ]
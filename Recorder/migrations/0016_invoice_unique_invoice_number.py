@@ -0,0 +1,70 @@
+# Generated by Django 4.2 on 2026-10-18 16:20
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def reindex_renamed(connection, ids):
+    # The SQLite search table as of migration 0013
+    if connection.vendor != 'sqlite' or 'recorder_invoice_search' not in connection.introspection.table_names():
+        return
+    with connection.cursor() as cursor:
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            cursor.execute(
+                'INSERT OR REPLACE INTO recorder_invoice_search(rowid, owner, invoice_number, party, firm, quality) '
+                "SELECT id, 'u' || user_id, invoice_number, party, firm, quality FROM Recorder_invoice "
+                f"WHERE id IN ({', '.join(['%s'] * len(chunk))})",
+                chunk,
+            )
+
+
+def rename_duplicate_numbers(apps, schema_editor):
+    """
+    Make invoice numbers unique per user before the constraint is added.
+
+    The oldest invoice keeps its number; the others get a -dup<id> suffix so
+    nothing is lost and they can be found and corrected by hand.
+    """
+    Invoice = apps.get_model('Recorder', 'Invoice')
+    duplicated = (
+        Invoice.objects.values('user_id', 'invoice_number')
+        .annotate(count=Count('id'), first_id=Min('id'))
+        .filter(count__gt=1)
+        .order_by()
+    )
+    renamed = []
+    for group in duplicated:
+        extras = Invoice.objects.filter(
+            user_id=group['user_id'], invoice_number=group['invoice_number'],
+        ).exclude(pk=group['first_id'])
+        for invoice in extras.only('id', 'invoice_number'):
+            suffix = f'-dup{invoice.pk}'
+            invoice.invoice_number = invoice.invoice_number[:100 - len(suffix)] + suffix
+            invoice.save(update_fields=['invoice_number'])
+            renamed.append(invoice.pk)
+    reindex_renamed(schema_editor.connection, renamed)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Recorder', '0015_monthlysummary_total_amount'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.RunPython(rename_duplicate_numbers, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='invoice',
+            name='invoice_user_number_idx',
+        ),
+        migrations.AddConstraint(
+            model_name='invoice',
+            constraint=models.UniqueConstraint(fields=('user', 'invoice_number'), name='unique_invoice_number_per_user'),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 4.2 on 2026-10-18 14:37
+
+from decimal import Decimal
+
+from django.db import migrations, models
+
+CENTS = Decimal('0.01')
+
+
+def gross_payment_2(invoice):
+    # The payment 2 formula as of this migration
+    if not all([invoice.payment_date_1, invoice.invoice_date, invoice.dhara_day, invoice.payment_1]):
+        return None
+    days_diff = (invoice.payment_date_1 - invoice.invoice_date).days
+    if invoice.dhara_day >= days_diff:
+        return None
+    return (invoice.payment_1 / Decimal('1.05') * Decimal('0.0004931507') * (days_diff - invoice.dhara_day)).quantize(CENTS)
+
+
+def backfill_collected(apps, schema_editor):
+    """
+    Record partial payment 2 settlements made before the column existed:
+    an unsettled invoice whose stored payment 2 is below the formula's
+    value has had the difference collected.
+    """
+    Invoice = apps.get_model('Recorder', 'Invoice')
+    collected = []
+    invoices = Invoice.objects.filter(settled_payment_2=False, payment_2__isnull=False).only(
+        'id', 'payment_1', 'payment_date_1', 'invoice_date', 'dhara_day', 'payment_2',
+    )
+    for invoice in invoices.iterator(chunk_size=2000):
+        gross = gross_payment_2(invoice)
+        if gross is not None and invoice.payment_2 < gross:
+            invoice.payment_2_collected = gross - invoice.payment_2
+            collected.append(invoice)
+    Invoice.objects.bulk_update(collected, ['payment_2_collected'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Recorder', '0016_invoice_unique_invoice_number'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='payment_2_collected',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=15),
+        ),
+        migrations.RunPython(backfill_collected, migrations.RunPython.noop),
+    ]
@@ -1,8 +1,65 @@
 from django.db import models
 from django.utils import timezone
-from decimal import Decimal
 from django.contrib.auth.models import User
 
+from .calculations import (
+    calculate_payment_2,
+    days_after_dhara_expression,
+    days_diff_expression,
+    days_overdue_expression,
+    outstanding_payment_2,
+    payment_2_expression,
+)
+
+
+def month_start(value):
+    """Return the first day of the month containing value."""
+    return value.replace(day=1)
+
+
+def month_bounds(value):
+    """Return (first day, first day of next month) for the month containing value."""
+    start = month_start(value)
+    if start.month == 12:
+        return start, start.replace(year=start.year + 1, month=1)
+    return start, start.replace(month=start.month + 1)
+
+
+class InvoiceQuerySet(models.QuerySet):
+    def for_month(self, value):
+        """Invoices whose invoice_date falls in the month containing value.
+
+        Uses a half-open date range rather than __year/__month lookups so the
+        (user, invoice_date) index can be used.
+        """
+        start, end = month_bounds(value)
+        return self.filter(invoice_date__gte=start, invoice_date__lt=end)
+
+    # The annotations below are computed by the database, so querysets can
+    # filter and order on them without loading rows into Python.
+
+    def with_days_diff(self):
+        """Annotate days_diff: days from invoice_date to payment_date_1."""
+        return self.annotate(days_diff=days_diff_expression())
+
+    def with_days_after_dhara(self):
+        """Annotate days_after_dhara: days_diff minus the dhara days."""
+        return self.annotate(days_after_dhara=days_after_dhara_expression())
+
+    def with_interest(self):
+        """Annotate accrued_interest: payment 2 as the formula gives it now."""
+        return self.annotate(accrued_interest=payment_2_expression())
+
+    def with_days_overdue(self, today=None):
+        """Annotate days_overdue: days an unpaid invoice is past its due date."""
+        today = today or timezone.localdate()
+        return self.annotate(days_overdue=days_overdue_expression(today))
+
+    def overdue(self, today=None):
+        """Invoices with an outstanding balance past their due date."""
+        return self.with_days_overdue(today).filter(days_overdue__gt=0)
+
+
 class Invoice(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='invoices')
     firm = models.CharField(max_length=255)
@@ -21,11 +78,30 @@ class Invoice(models.Model):
     payment_date_2 = models.DateField(null=True, blank=True)
     payment_2 = models.DecimalField(max_digits=15, decimal_places=2, null=True, blank=True)
     settled_payment_2 = models.BooleanField(default=False)
+    # Payment 2 settled so far; recalculations and re-imports leave it owed less this
+    payment_2_collected = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    # Hash of the CSV row the invoice was last imported from (see importer.py)
+    content_hash = models.CharField(max_length=64, blank=True, default='')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = InvoiceQuerySet.as_manager()
+
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Month filters, keyset pagination and exports
+            models.Index(fields=['user', 'invoice_date'], name='invoice_user_date_idx'),
+            # Payment status filters and summary statistics
+            models.Index(fields=['user', 'balance', 'settled_payment_2'], name='invoice_user_status_idx'),
+            # Due date / aging lookups
+            models.Index(fields=['user', 'due_date'], name='invoice_user_due_idx'),
+        ]
+        constraints = [
+            # Also serves receipt matching and import upserts by invoice number
+            models.UniqueConstraint(fields=['user', 'invoice_number'], name='unique_invoice_number_per_user'),
+        ]
+        # The party search index is backend specific and lives in search.py
     
     @property
     def month_year(self):
@@ -43,21 +119,14 @@ class Invoice(models.Model):
             return 'pending'
     
     def calculate_payment_2(self):
-        """Calculate payment 2 based on the formula."""
-        if self.settled_payment_2:
-            return Decimal('0.00')
-            
-        if not all([self.payment_date_1, self.invoice_date, self.dhara_day, self.payment_1]):
-            return None
-            
-        # Calculate days difference
-        days_diff = (self.payment_date_1 - self.invoice_date).days
-        
-        # Calculate Payment 2 based on the formula
-        if self.dhara_day < days_diff:
-            interest_factor = (self.payment_1 / Decimal('1.05')) * (Decimal('0.0004931507') * (days_diff - self.dhara_day))
-            return Decimal(interest_factor)
-        return None
+        """Calculate the payment 2 still owed: the formula less what was collected."""
+        return outstanding_payment_2(
+            calculate_payment_2(
+                self.payment_1, self.payment_date_1, self.invoice_date,
+                self.dhara_day, self.settled_payment_2,
+            ),
+            self.payment_2_collected,
+        )
             
     def save(self, *args, **kwargs):
         # Calculate payment_2 before saving if not settled
@@ -66,4 +135,91 @@ class Invoice(models.Model):
         super().save(*args, **kwargs)
     
     def __str__(self):
-        return f"Invoice {self.invoice_number} - {self.party}"
\ No newline at end of file
+        return f"Invoice {self.invoice_number} - {self.party}"
+
+
+class MonthlySummary(models.Model):
+    """
+    Per-user, per-month invoice totals keyed on the first day of the
+    invoice_date month. Kept current by the receivers in signals.py so the
+    dashboard can read its numbers without aggregating over Invoice. Rows
+    with a non-zero invoice_count double as the index of the user's
+    invoice months for the month filter.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='monthly_summaries')
+    month = models.DateField()
+    invoice_count = models.IntegerField(default=0)
+    pending_count = models.IntegerField(default=0)
+    pending_amount = models.DecimalField(max_digits=17, decimal_places=2, default=0)
+    payment_1_settled_count = models.IntegerField(default=0)
+    payment_1_settled_amount = models.DecimalField(max_digits=17, decimal_places=2, default=0)
+    both_settled_count = models.IntegerField(default=0)
+    both_settled_amount = models.DecimalField(max_digits=17, decimal_places=2, default=0)
+    total_balance = models.DecimalField(max_digits=17, decimal_places=2, default=0)
+    total_amount = models.DecimalField(max_digits=17, decimal_places=2, default=0)
+    # Bumped on every change to the month's invoices; keys the cached report files
+    version = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-month']
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'month'], name='unique_monthly_summary'),
+        ]
+
+    def __str__(self):
+        return f"Summary {self.month:%Y-%m} - {self.user}"
+
+
+class ImportJob(models.Model):
+    """
+    A CSV upload waiting for, or being processed by, the import worker
+    (``manage.py run_import_worker``). The table doubles as the job queue.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='import_jobs')
+    file = models.FileField(upload_to='imports/', blank=True)
+    file_name = models.CharField(max_length=255)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=QUEUED)
+    rows_processed = models.IntegerField(default=0)
+    rows_imported = models.IntegerField(default=0)
+    rows_failed = models.IntegerField(default=0)
+    errors = models.JSONField(default=list, blank=True)
+    message = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    # Bumped by the worker after every batch; a running job that stops
+    # bumping it is requeued (see jobs.requeue_stale_jobs)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='importjob_queue_idx'),
+        ]
+
+    @property
+    def is_finished(self):
+        return self.status in (self.SUCCEEDED, self.FAILED)
+
+    @property
+    def throughput(self):
+        """Rows processed per second since the job started."""
+        if not self.started_at:
+            return 0.0
+        elapsed = ((self.finished_at or timezone.now()) - self.started_at).total_seconds()
+        return round(self.rows_processed / elapsed, 1) if elapsed > 0 else 0.0
+
+    def __str__(self):
+        return f"Import {self.pk} ({self.file_name}) - {self.status}"
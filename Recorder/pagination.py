@@ -0,0 +1,107 @@
+"""
+Keyset (cursor) pagination for invoice querysets.
+
+Pages are ordered newest first on (invoice_date, id). Instead of an OFFSET,
+each page remembers the key of its last row and the next page starts
+strictly after it, so every page costs the same no matter how deep it is.
+"""
+from datetime import date
+
+from django.db.models import Q
+
+
+class KeysetPage:
+    """A single page of results plus the cursor for the page after it"""
+
+    def __init__(self, object_list, next_cursor, cursor, page_size):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.cursor = cursor
+        self.page_size = page_size
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __bool__(self):
+        return bool(self.object_list)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        # Keyset pages can always jump back to the start, but not one page back
+        return self.cursor is not None
+
+
+def encode_cursor(invoice_date, pk):
+    """Build a cursor string such as '2025-05-17.42' from a row key"""
+    return f'{invoice_date.isoformat()}.{pk}'
+
+
+def decode_cursor(cursor):
+    """Parse a cursor string back into (invoice_date, pk), or None if invalid"""
+    if not cursor:
+        return None
+    try:
+        date_part, pk_part = cursor.split('.')
+        return date.fromisoformat(date_part), int(pk_part)
+    except ValueError:
+        return None
+
+
+def parse_page_size(value, default, maximum):
+    """Clamp a requested page size to 1..maximum, falling back to default"""
+    try:
+        page_size = int(value)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(page_size, maximum))
+
+
+def _keyset_queryset(queryset, key):
+    queryset = queryset.order_by('-invoice_date', '-id')
+    if key is not None:
+        last_date, last_pk = key
+        queryset = queryset.filter(
+            Q(invoice_date__lt=last_date) | Q(invoice_date=last_date, id__lt=last_pk)
+        )
+    return queryset
+
+
+def _keyset_page(rows, key, cursor, page_size):
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = encode_cursor(_row_value(rows[-1], 'invoice_date'), _row_value(rows[-1], 'id'))
+    return KeysetPage(rows, next_cursor, cursor if key is not None else None, page_size)
+
+
+def paginate_keyset(queryset, cursor=None, page_size=50):
+    """
+    Return a KeysetPage of queryset ordered by (-invoice_date, -id).
+
+    Rows are read with one LIMIT page_size + 1 query; the extra row only
+    tells us whether there is another page.
+    """
+    key = decode_cursor(cursor)
+    rows = list(_keyset_queryset(queryset, key)[:page_size + 1])
+    return _keyset_page(rows, key, cursor, page_size)
+
+
+async def apaginate_keyset(queryset, cursor=None, page_size=50):
+    """Async version of paginate_keyset"""
+    key = decode_cursor(cursor)
+    rows = [row async for row in _keyset_queryset(queryset, key)[:page_size + 1]]
+    return _keyset_page(rows, key, cursor, page_size)
+
+
+def _row_value(row, field):
+    """Read a field from a model instance or a values() dict"""
+    if isinstance(row, dict):
+        return row[field]
+    return getattr(row, field)
@@ -0,0 +1,220 @@
+"""
+Row parsing for invoice imports.
+
+Turns CSV row dicts into Invoice field values. Nothing here touches Django,
+so ``parse_batches`` can hand batches to a process pool whose workers only
+import this module, whatever the multiprocessing start method. Workers
+return the parsed values and content hashes in batch order, and the
+importing process builds the invoices and writes them.
+
+The common formats take fast paths: ISO dates go through
+``date.fromisoformat`` instead of ``strptime``, which is several times
+slower, and anything else falls back to the original parsing so the
+accepted formats and error messages don't change. Parsed rows come back
+from the workers as tuples of strings, since Decimal and date objects cost
+more to pickle than to parse again.
+"""
+import hashlib
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+
+# Columns every row must provide
+REQUIRED_FIELDS = [
+    'firm', 'quality', 'invoice_date', 'invoice_number', 'party',
+    'meter', 'total_amount', 'due_date', 'balance', 'dhara_day', 'taka'
+]
+
+# Columns that may be left empty
+OPTIONAL_FIELDS = ['payment_date_1', 'payment_1', 'payment_date_2']
+
+# The keys of parse_row's values, in content hash order
+HASH_FIELDS = sorted(REQUIRED_FIELDS + OPTIONAL_FIELDS)
+
+# How each parsed value is rebuilt from its string form after crossing
+# the process boundary
+UNPACK = {
+    'invoice_date': date.fromisoformat,
+    'due_date': date.fromisoformat,
+    'payment_date_1': date.fromisoformat,
+    'payment_date_2': date.fromisoformat,
+    'total_amount': Decimal,
+    'balance': Decimal,
+    'payment_1': Decimal,
+    'taka': Decimal,
+    'meter': Decimal,
+}
+
+# (max_digits, decimal_places) of the Invoice decimal columns, so values that
+# would not fit are rejected while parsing instead of failing the write
+DECIMAL_LIMITS = {
+    'total_amount': (15, 2),
+    'balance': (10, 2),
+    'payment_1': (15, 2),
+    'taka': (15, 2),
+    'meter': (10, 2),
+}
+
+ISO_DATE = re.compile(r'\d{4}-\d{2}-\d{2}\Z')
+
+# Batches submitted to the pool ahead of the one being written, per worker
+BATCHES_AHEAD = 2
+
+
+def parse_indian_number(number_str):
+    """Convert Indian number format (e.g., 2,13,546.00) to Decimal."""
+    try:
+        # Remove all commas and convert to Decimal
+        return Decimal(number_str.replace(',', ''))
+    except (ValueError, InvalidOperation):
+        raise ValueError(f"Invalid number format: {number_str}. Expected format: 2,13,546.00")
+
+
+def parse_amount(row, field):
+    """Parse a decimal column and check that it fits the Invoice field"""
+    value = parse_indian_number(row[field])
+    max_digits, decimal_places = DECIMAL_LIMITS[field]
+    if not value.is_finite():
+        raise ValueError(f"Invalid number format: {row[field]}. Expected format: 2,13,546.00")
+    _, digits, exponent = value.as_tuple()
+    decimals = max(-exponent, 0)
+    whole_digits = max(len(digits) + exponent, 0)
+    if whole_digits > max_digits - decimal_places:
+        raise ValueError(
+            f"Invalid {field}: {row[field]}. Must have at most "
+            f"{max_digits - decimal_places} digits before the decimal point"
+        )
+    if decimals > decimal_places:
+        raise ValueError(
+            f"Invalid {field}: {row[field]}. Must have at most {decimal_places} decimal places"
+        )
+    return value
+
+
+def parse_date(row, field):
+    """Parse a YYYY-MM-DD date column, naming the column in the error"""
+    value = row[field]
+    try:
+        if ISO_DATE.match(value):
+            return date.fromisoformat(value)
+        # strptime also takes unpadded months and days
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise ValueError(f"Invalid {field} format: {value}. Expected YYYY-MM-DD")
+
+
+def parse_row(row):
+    """
+    Validate one CSV row and return the Invoice field values.
+
+    Raises ValueError with the same messages the upload view has always shown.
+    """
+    # Validate required fields are not empty
+    for field in REQUIRED_FIELDS:
+        if not row.get(field):
+            raise ValueError(f"Required field '{field}' is empty")
+
+    values = {
+        'firm': row['firm'],
+        'quality': row['quality'],
+        'invoice_date': parse_date(row, 'invoice_date'),
+        'invoice_number': row['invoice_number'],
+        'party': row['party'],
+        'due_date': parse_date(row, 'due_date'),
+        'payment_date_1': parse_date(row, 'payment_date_1') if row.get('payment_date_1') else None,
+        'payment_date_2': parse_date(row, 'payment_date_2') if row.get('payment_date_2') else None,
+        'total_amount': parse_amount(row, 'total_amount'),
+        'balance': parse_amount(row, 'balance'),
+        'payment_1': parse_amount(row, 'payment_1') if row.get('payment_1') else None,
+    }
+
+    try:
+        values['dhara_day'] = int(row['dhara_day'])
+    except ValueError:
+        raise ValueError(f"Invalid dhara_day: {row['dhara_day']}. Must be a valid integer")
+
+    values['taka'] = parse_amount(row, 'taka')
+    values['meter'] = parse_amount(row, 'meter')
+    return values
+
+
+def content_hash(values):
+    """A hash of the parsed row values, to tell whether a re-imported row changed"""
+    content = '\x1f'.join([f'{field}={values[field]}' for field in HASH_FIELDS])
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def parse_batch(numbered_rows):
+    """
+    Parse a batch of (row_num, row) pairs into (row_num, values, hash, error)
+    tuples; values and hash are None for an invalid row.
+    """
+    parsed = []
+    for row_num, row in numbered_rows:
+        try:
+            values = parse_row(row)
+        except Exception as e:
+            parsed.append((row_num, None, None, str(e)))
+            continue
+        parsed.append((row_num, values, content_hash(values), None))
+    return parsed
+
+
+def _pack(values):
+    return tuple(
+        str(values[field]) if field in UNPACK and values[field] is not None else values[field]
+        for field in HASH_FIELDS
+    )
+
+
+def _unpack(packed):
+    return {
+        field: UNPACK[field](value) if field in UNPACK and value is not None else value
+        for field, value in zip(HASH_FIELDS, packed)
+    }
+
+
+def parse_packed_batch(numbered_rows):
+    """parse_batch for a pool worker, with the values packed for pickling"""
+    return [
+        (row_num, values if values is None else _pack(values), row_hash, error)
+        for row_num, values, row_hash, error in parse_batch(numbered_rows)
+    ]
+
+
+def _unpack_batch(parsed):
+    return [
+        (row_num, values if values is None else _unpack(values), row_hash, error)
+        for row_num, values, row_hash, error in parsed
+    ]
+
+
+def parse_batches(batches, workers=0):
+    """
+    Yield (batch, parsed) for each batch of (row_num, row) pairs, in order.
+
+    With two or more workers the batches are parsed in a process pool. Only
+    a few batches per worker are read ahead, so a large file is never held
+    in memory whole.
+    """
+    if workers < 2:
+        for batch in batches:
+            yield batch, parse_batch(batch)
+        return
+
+    pool = ProcessPoolExecutor(workers)
+    try:
+        pending = deque()
+        for batch in batches:
+            pending.append((batch, pool.submit(parse_packed_batch, batch)))
+            if len(pending) > workers * BATCHES_AHEAD:
+                batch, parsed = pending.popleft()
+                yield batch, _unpack_batch(parsed.result())
+        while pending:
+            batch, parsed = pending.popleft()
+            yield batch, _unpack_batch(parsed.result())
+    finally:
+        # Drop the read-ahead if the import stopped early
+        pool.shutdown(cancel_futures=True)
@@ -0,0 +1,78 @@
+"""
+Bulk payment 2 recalculation.
+
+``recalculate_payment_2`` recomputes payment 2 for every invoice in a
+queryset, less whatever of it was already collected through settlements
+(payment_2_collected). On SQLite and PostgreSQL the formula runs inside the
+database as a single UPDATE; other backends fall back to computing the
+values in Python and writing them back with bulk_update. Either way no per-row save() runs,
+so the affected summary months are refreshed through invoices_bulk_changed.
+"""
+from collections import defaultdict
+
+from django.db import connections
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from .calculations import (
+    EXPRESSION_VENDORS, calculate_payment_2, outstanding_payment_2, outstanding_payment_2_expression,
+)
+from .signals import invoices_bulk_changed
+
+# Fields read by the Python fallback
+FORMULA_FIELDS = (
+    'id', 'payment_1', 'payment_date_1', 'invoice_date', 'dhara_day', 'settled_payment_2', 'payment_2_collected',
+)
+
+
+def affected_months(queryset):
+    """Map each user id in queryset to the set of invoice months it covers"""
+    months = defaultdict(set)
+    rows = (
+        queryset.annotate(month=TruncMonth('invoice_date'))
+        .values_list('user_id', 'month')
+        .order_by()
+        .distinct()
+    )
+    for user_id, month in rows:
+        months[user_id].add(month)
+    return months
+
+
+def recalculate_payment_2(queryset, batch_size=None):
+    """
+    Recompute payment_2 for every invoice in queryset.
+
+    Returns the number of invoices updated.
+    """
+    months = affected_months(queryset)
+    if not months:
+        return 0
+
+    vendor = connections[queryset.db].vendor
+    if vendor in EXPRESSION_VENDORS:
+        updated = queryset.update(payment_2=outstanding_payment_2_expression(), updated_at=timezone.now())
+    else:
+        updated = _recalculate_in_python(queryset, batch_size)
+
+    for user_id, user_months in months.items():
+        invoices_bulk_changed.send(sender=queryset.model, user_id=user_id, months=user_months)
+    return updated
+
+
+def _recalculate_in_python(queryset, batch_size):
+    batch_size = batch_size or 1000
+    model = queryset.model
+    now = timezone.now()
+    batch = []
+    updated = 0
+    for values in queryset.values_list(*FORMULA_FIELDS).iterator(chunk_size=batch_size):
+        pk, payment_1, payment_date_1, invoice_date, dhara_day, settled, collected = values
+        payment_2 = calculate_payment_2(payment_1, payment_date_1, invoice_date, dhara_day, settled)
+        batch.append(model(pk=pk, payment_2=outstanding_payment_2(payment_2, collected), updated_at=now))
+        if len(batch) >= batch_size:
+            updated += model.objects.bulk_update(batch, ['payment_2', 'updated_at'])
+            batch = []
+    if batch:
+        updated += model.objects.bulk_update(batch, ['payment_2', 'updated_at'])
+    return updated
@@ -0,0 +1,152 @@
+"""
+Bulk settlement from a payment-receipt file.
+
+A receipt file lists payments received, one per row: the invoice number,
+the amount and optionally the party. ``apply_receipts`` matches a batch of
+rows to the user's invoices with one ``invoice_number IN (...)`` lookup on
+the unique (user, invoice_number) index, takes each amount off the matched
+invoice's balance and writes the batch back with a single bulk_update. The
+whole file is applied in one transaction and reconciled row by row:
+
+applied      the payment clears the invoice's balance
+partial      the payment leaves part of the balance outstanding
+overpayment  the payment is more than the balance; nothing is applied
+unmatched    no invoice has the number, or it belongs to another party
+error        the row itself is invalid
+
+Rows for the same invoice are applied in file order against the running
+balance.
+"""
+from collections import Counter, defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .importer import batched
+from .models import Invoice
+from .parsing import parse_indian_number
+from .signals import invoices_bulk_changed
+
+REQUIRED_RECEIPT_FIELDS = ['invoice_number', 'amount']
+
+RECEIPT_STATUSES = ('applied', 'partial', 'overpayment', 'unmatched', 'error')
+
+
+class ReceiptResult:
+    """The reconciliation of a receipt file: one line per row plus totals"""
+
+    def __init__(self):
+        self.lines = []
+        self.counts = Counter()
+        self.amounts = defaultdict(lambda: Decimal('0.00'))
+
+    def add(self, row_num, row, status, amount=None, balance=None, message=''):
+        self.lines.append({
+            'row': row_num,
+            'invoice_number': (row.get('invoice_number') or '').strip(),
+            'party': (row.get('party') or '').strip(),
+            'amount': amount,
+            'status': status,
+            'balance': balance,
+            'message': message,
+        })
+        self.counts[status] += 1
+        if amount is not None:
+            self.amounts[status] += amount
+
+    @property
+    def summary(self):
+        return [
+            {'status': status, 'count': self.counts[status], 'amount': self.amounts[status]}
+            for status in RECEIPT_STATUSES
+        ]
+
+
+def missing_receipt_fields(fieldnames):
+    """Required receipt columns absent from a header row"""
+    fieldnames = fieldnames or []
+    return [field for field in REQUIRED_RECEIPT_FIELDS if field not in fieldnames]
+
+
+def parse_receipt(row):
+    """Return (invoice_number, party, amount) for a row, raising ValueError if invalid"""
+    invoice_number = (row.get('invoice_number') or '').strip()
+    if not invoice_number:
+        raise ValueError("Required field 'invoice_number' is empty")
+    if not (row.get('amount') or '').strip():
+        raise ValueError("Required field 'amount' is empty")
+    amount = parse_indian_number(row['amount'].strip())
+    if amount <= 0:
+        raise ValueError(f"Amount must be positive: {row['amount']}")
+    return invoice_number, (row.get('party') or '').strip(), amount
+
+
+def _match(invoice, party):
+    """The invoice for a row, or (None, reason); the party, if given, must agree"""
+    if invoice is None:
+        return None, 'No invoice with this number'
+    if party and invoice.party.strip().lower() != party.lower():
+        return None, f'Invoice belongs to {invoice.party}, not {party}'
+    return invoice, ''
+
+
+def settle_batch(user, numbered_rows, result, now):
+    """Apply one batch of receipt rows; returns the invoice months it changed"""
+    parsed = []
+    for row_num, row in numbered_rows:
+        try:
+            parsed.append((row_num, row) + parse_receipt(row))
+        except ValueError as e:
+            result.add(row_num, row, 'error', message=str(e))
+
+    numbers = {invoice_number for _, _, invoice_number, _, _ in parsed}
+    # Locks the matched rows until commit where the database supports it
+    invoices = {
+        invoice.invoice_number: invoice
+        for invoice in Invoice.objects.select_for_update()
+        .filter(user=user, invoice_number__in=numbers)
+        .only('id', 'invoice_number', 'party', 'balance', 'invoice_date')
+    }
+
+    changed = {}
+    for row_num, row, invoice_number, party, amount in parsed:
+        invoice, reason = _match(invoices.get(invoice_number), party)
+        if invoice is None:
+            result.add(row_num, row, 'unmatched', amount, message=reason)
+            continue
+        if amount > invoice.balance:
+            result.add(
+                row_num, row, 'overpayment', amount, invoice.balance,
+                f'Payment exceeds the outstanding balance by {amount - invoice.balance}',
+            )
+            continue
+        invoice.balance -= amount
+        invoice.updated_at = now
+        changed[invoice.pk] = invoice
+        result.add(row_num, row, 'applied' if invoice.balance == 0 else 'partial', amount, invoice.balance)
+
+    if changed:
+        Invoice.objects.bulk_update(changed.values(), ['balance', 'updated_at'])
+    return {invoice.invoice_date for invoice in changed.values()}
+
+
+def apply_receipts(user, rows, batch_size=None):
+    """
+    Settle the user's invoices from an iterable of receipt row dicts and
+    return the ReceiptResult.
+    """
+    batch_size = batch_size or settings.INVOICE_IMPORT_BATCH_SIZE
+    result = ReceiptResult()
+    months = set()
+    now = timezone.now()
+    with transaction.atomic():
+        for batch in batched(enumerate(rows, 1), batch_size):
+            months |= settle_batch(user, batch, result, now)
+        # bulk_update skips post_save, so refresh summaries and caches once
+        if months:
+            invoices_bulk_changed.send(sender=Invoice, user_id=user.pk, months=months)
+    # Invalid rows are recorded before their batch is matched
+    result.lines.sort(key=lambda line: line['row'])
+    return result
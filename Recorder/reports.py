@@ -0,0 +1,84 @@
+"""
+Cached monthly report files.
+
+Generated exports are stored under INVOICE_EXCEL_DIR/<user id>/ with the
+month's content version in the file name. The version lives on the user's
+MonthlySummary row and is bumped by the signals whenever an invoice in that
+month changes, so a file whose version matches is known to be current and
+can be served without touching the invoice table.
+"""
+import glob
+import os
+import tempfile
+
+from django.conf import settings
+
+from .exports import write_csv, write_xlsx
+from .models import Invoice, month_start
+from .summaries import month_version
+
+REPORT_FORMATS = ('csv', 'xlsx')
+
+
+def report_dir(user_id):
+    return os.path.join(settings.INVOICE_EXCEL_DIR, str(user_id))
+
+
+def report_path(user_id, month, version, fmt):
+    """Path of the report file for a user, month, content version and format"""
+    return os.path.join(report_dir(user_id), f'invoices_{month:%Y-%m}_v{version}.{fmt}')
+
+
+def _month_files(user_id, month, fmt='*'):
+    return glob.glob(os.path.join(report_dir(user_id), f'invoices_{month:%Y-%m}_v*.{fmt}'))
+
+
+def build_report(user_id, month, fmt, path):
+    """Write the month's export to path, replacing it atomically"""
+    invoices = Invoice.objects.filter(user_id=user_id).for_month(month)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write next to the final path and rename, so readers never see a partial file
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=f'.{fmt}.tmp')
+    try:
+        if fmt == 'csv':
+            with os.fdopen(fd, 'w', newline='', encoding='utf-8') as target:
+                write_csv(invoices, target)
+        else:
+            os.close(fd)
+            write_xlsx(invoices, tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def get_report(user_id, month, fmt='csv'):
+    """
+    Return the path of an up-to-date report file for the month, building it
+    only if the stored file is missing or belongs to an older version.
+    """
+    if fmt not in REPORT_FORMATS:
+        raise ValueError(f'Unsupported report format: {fmt}')
+    month = month_start(month)
+    path = report_path(user_id, month, month_version(user_id, month), fmt)
+    if not os.path.exists(path):
+        build_report(user_id, month, fmt, path)
+        # Drop the files of older versions for this month and format
+        for stale in _month_files(user_id, month, fmt):
+            if stale != path:
+                remove_file(stale)
+    return path
+
+
+def remove_reports(user_id, month):
+    """Delete every stored report file for a user's month"""
+    for path in _month_files(user_id, month_start(month)):
+        remove_file(path)
+
+
+def remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
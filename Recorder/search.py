@@ -0,0 +1,216 @@
+"""
+Indexed invoice search.
+
+Party substring search
+----------------------
+
+``party__icontains`` is a leading-wildcard LIKE that cannot use a b-tree
+index, so party search is backed by a trigram index instead:
+
+* PostgreSQL: a pg_trgm GIN index on UPPER(party). Django's icontains
+  compiles to ``UPPER(party::text) LIKE UPPER(%s)``, which the planner can
+  answer from that index directly.
+* SQLite: an external-content FTS5 table with the trigram tokenizer, kept in
+  sync with Recorder_invoice by triggers. Substring queries become a MATCH
+  against that table.
+
+Search terms shorter than three characters have no trigrams, so they fall
+back to a plain icontains filter on every backend.
+
+Full-text search
+----------------
+``search_invoices`` matches every word of a query as a prefix of a word in
+invoice_number, party, firm or quality, and ranks the hits:
+
+* PostgreSQL: a GIN index on a 'simple' tsvector expression over the four
+  columns, queried with prefix tsquery terms and ranked with ts_rank. The
+  index is maintained by PostgreSQL itself.
+* SQLite: an FTS5 table (unicode61 tokenizer with 2 and 3 character prefix
+  indexes) holding the four columns plus an ``owner`` token, so a query only
+  ever walks the searching user's entries. It is kept in sync by the
+  receivers in signals.py and ranked with bm25.
+"""
+import re
+
+from django.db import connection
+from django.db.models import BooleanField, FloatField, Q
+from django.db.models.expressions import RawSQL
+
+from .models import month_bounds
+
+PARTY_TRIGRAM_TABLE = 'recorder_invoice_party_trgm'
+
+MIN_TRIGRAM_LENGTH = 3
+
+# The sync triggers, as created by migration 0010
+SQLITE_PARTY_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {PARTY_TRIGRAM_TABLE}_ai AFTER INSERT ON Recorder_invoice BEGIN
+        INSERT INTO {PARTY_TRIGRAM_TABLE}(rowid, party) VALUES (new.id, new.party);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {PARTY_TRIGRAM_TABLE}_ad AFTER DELETE ON Recorder_invoice BEGIN
+        INSERT INTO {PARTY_TRIGRAM_TABLE}({PARTY_TRIGRAM_TABLE}, rowid, party) VALUES ('delete', old.id, old.party);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {PARTY_TRIGRAM_TABLE}_au AFTER UPDATE OF party ON Recorder_invoice BEGIN
+        INSERT INTO {PARTY_TRIGRAM_TABLE}({PARTY_TRIGRAM_TABLE}, rowid, party) VALUES ('delete', old.id, old.party);
+        INSERT INTO {PARTY_TRIGRAM_TABLE}(rowid, party) VALUES (new.id, new.party);
+    END
+    """,
+]
+
+
+def restore_party_search_triggers(db_connection):
+    """
+    Recreate the SQLite sync triggers if they have gone missing.
+
+    SQLite migrations that alter Recorder_invoice rebuild the table, which
+    drops its triggers (the FTS rows survive because ids are preserved).
+    This runs after every migrate to put them back.
+    """
+    if db_connection.vendor != 'sqlite':
+        return
+    if PARTY_TRIGRAM_TABLE not in db_connection.introspection.table_names():
+        return
+    with db_connection.cursor() as cursor:
+        for statement in SQLITE_PARTY_TRIGGERS:
+            cursor.execute(statement)
+
+
+def filter_party(queryset, term):
+    """Filter an Invoice queryset to parties containing term (case-insensitive)"""
+    if connection.vendor == 'sqlite' and len(term) >= MIN_TRIGRAM_LENGTH:
+        # A quoted FTS5 phrase matches the term as a substring; quotes inside
+        # the term are escaped by doubling them
+        phrase = '"{}"'.format(term.replace('"', '""'))
+        return queryset.filter(id__in=RawSQL(
+            f'SELECT rowid FROM {PARTY_TRIGRAM_TABLE} WHERE {PARTY_TRIGRAM_TABLE} MATCH %s',
+            [phrase],
+        ))
+    return queryset.filter(party__icontains=term)
+
+
+INVOICE_SEARCH_TABLE = 'recorder_invoice_search'
+INVOICE_SEARCH_INDEX = 'invoice_fulltext_idx'
+
+# Indexed columns and their ranking weights, most significant first
+SEARCH_FIELDS = ('invoice_number', 'party', 'firm', 'quality')
+SQLITE_SEARCH_WEIGHTS = '0, 10.0, 5.0, 2.0, 1.0'  # owner, then SEARCH_FIELDS
+
+
+def _postgresql_document(table=None):
+    """The tsvector expression over SEARCH_FIELDS, as indexed and as queried"""
+    prefix = f'"{table}".' if table else ''
+    columns = " || ' ' || ".join(f'{prefix}"{field}"' for field in SEARCH_FIELDS)
+    return f"to_tsvector('simple'::regconfig, {columns})"
+
+
+SEARCH_WORD_RE = re.compile(r'\w+')
+
+
+def search_words(term):
+    """Split a search query into lower-case words (punctuation is dropped)"""
+    return [word.lower() for word in SEARCH_WORD_RE.findall(term)]
+
+
+def _sqlite_index_select(where=''):
+    columns = ', '.join(SEARCH_FIELDS)
+    return (
+        f"(rowid, owner, {columns}) "
+        f"SELECT id, 'u' || user_id, {columns} FROM Recorder_invoice {where}"
+    )
+
+
+def _uses_search_table():
+    return connection.vendor == 'sqlite'
+
+
+def index_invoices(ids):
+    """(Re)index the given invoices in the SQLite search table"""
+    if not _uses_search_table() or not ids:
+        return
+    placeholders = ', '.join(['%s'] * len(ids))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT OR REPLACE INTO {INVOICE_SEARCH_TABLE}'
+            + _sqlite_index_select(f'WHERE id IN ({placeholders})'),
+            list(ids),
+        )
+
+
+def unindex_invoice(pk):
+    """Remove a deleted invoice from the SQLite search table"""
+    if not _uses_search_table():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {INVOICE_SEARCH_TABLE} WHERE rowid = %s', [pk])
+
+
+def reindex_months(user_id, months):
+    """Reindex a user's invoices in the given months after a bulk write"""
+    if not _uses_search_table():
+        return
+    with connection.cursor() as cursor:
+        for month in months:
+            start, end = month_bounds(month)
+            cursor.execute(
+                f'INSERT OR REPLACE INTO {INVOICE_SEARCH_TABLE}'
+                + _sqlite_index_select('WHERE user_id = %s AND invoice_date >= %s AND invoice_date < %s'),
+                [user_id, start, end],
+            )
+
+
+def search_invoices(queryset, term, user_id=None, rank=False):
+    """
+    Filter an Invoice queryset to rows matching every word of term as a prefix.
+
+    Pass the owner's user_id on SQLite so the match only walks that user's
+    index entries. With rank=True the rows are annotated with search_rank
+    (higher is more relevant) and ordered by it.
+    """
+    words = search_words(term)
+    if not words:
+        return queryset
+
+    if connection.vendor == 'sqlite':
+        match = '{%s} : (%s)' % (' '.join(SEARCH_FIELDS), ' AND '.join(f'"{word}"*' for word in words))
+        if user_id is not None:
+            match = f'owner : "u{int(user_id)}" AND {match}'
+        queryset = queryset.filter(RawSQL(
+            f'"Recorder_invoice"."id" IN (SELECT rowid FROM {INVOICE_SEARCH_TABLE} '
+            f'WHERE {INVOICE_SEARCH_TABLE} MATCH %s)',
+            [match],
+            output_field=BooleanField(),
+        ))
+        rank_sql = (
+            f'(SELECT -bm25({INVOICE_SEARCH_TABLE}, {SQLITE_SEARCH_WEIGHTS}) FROM {INVOICE_SEARCH_TABLE} '
+            f'WHERE {INVOICE_SEARCH_TABLE} MATCH %s AND rowid = "Recorder_invoice"."id")'
+        )
+        rank_params = [match]
+    elif connection.vendor == 'postgresql':
+        tsquery = ' & '.join(f'{word}:*' for word in words)
+        document = _postgresql_document('Recorder_invoice')
+        queryset = queryset.filter(RawSQL(
+            f"{document} @@ to_tsquery('simple'::regconfig, %s)",
+            [tsquery],
+            output_field=BooleanField(),
+        ))
+        rank_sql = f"ts_rank({document}, to_tsquery('simple'::regconfig, %s))"
+        rank_params = [tsquery]
+    else:
+        for word in words:
+            queryset = queryset.filter(
+                Q(invoice_number__icontains=word) | Q(party__icontains=word)
+                | Q(firm__icontains=word) | Q(quality__icontains=word)
+            )
+        # No relevance information without an index: every hit ranks equally
+        rank_sql, rank_params = '0.0', []
+
+    if rank:
+        queryset = queryset.annotate(
+            search_rank=RawSQL(rank_sql, rank_params, output_field=FloatField())
+        ).order_by('-search_rank', '-invoice_date', '-id')
+    return queryset
@@ -0,0 +1,157 @@
+"""
+Atomic payment settlement.
+
+Each settlement is a single conditional UPDATE that subtracts the amount
+only while enough is still outstanding (``WHERE balance >= amount``), so
+two concurrent settlements of the same invoice can never both pass the
+check and over-settle it: whichever runs second sees the already-reduced
+row and either applies against that or matches nothing. Only the settled
+columns and updated_at are written.
+
+``queryset.update`` bypasses the post_save receivers, so the monthly
+summary row and cached results are brought up to date here, inside the
+same transaction as the UPDATE.
+
+``mark_settled`` settles a whole queryset in full with one UPDATE, for the
+admin's bulk action.
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import BooleanField, Case, DecimalField, F, Value, When
+from django.db.models.functions import Coalesce, Round
+from django.utils import timezone
+
+from . import caching, summaries
+from .models import Invoice
+from .recalculation import affected_months
+from .signals import invoices_bulk_changed
+
+ZERO = Decimal('0.00')
+
+
+class SettlementError(ValueError):
+    """A settlement that cannot be applied to the invoice as it is now"""
+
+
+def _outstanding(field, amount):
+    # Rounded to cents so SQLite, which does the arithmetic in floats, never
+    # leaves 0.0999999 behind for a later settlement to trip over
+    return Round(F(field) - Value(amount), 2, output_field=DecimalField(max_digits=15, decimal_places=2))
+
+
+def _apply(invoice_id, user_id, condition, changes, refused):
+    """
+    Run one conditional settlement UPDATE and return the invoice's summary
+    source fields as it left them.
+
+    Must run inside a transaction. ``refused(row)`` builds the error message
+    from the current row when the condition no longer holds.
+    """
+    invoices = Invoice.objects.filter(pk=invoice_id, user_id=user_id)
+    if not invoices.filter(**condition).update(updated_at=timezone.now(), **changes):
+        row = invoices.values('balance', 'payment_2', 'settled_payment_2').first()
+        if row is None:
+            raise Invoice.DoesNotExist(f'Invoice {invoice_id} not found')
+        raise SettlementError(refused(row))
+    # The UPDATE holds the row's write lock until commit, so this reads
+    # exactly what it wrote
+    return invoices.values(*summaries.SUMMARY_SOURCE_FIELDS, 'payment_2').get()
+
+
+def _refresh(previous, current):
+    """Move the invoice's summary contribution and invalidate its month"""
+    summaries.apply_contribution(previous, sign=-1)
+    summaries.apply_contribution(current)
+    caching.invalidate(current['user_id'], [current['invoice_date']])
+
+
+def _check_amount(amount):
+    amount = Decimal(amount)
+    if amount <= 0:
+        raise SettlementError('Please enter a positive amount.')
+    return amount
+
+
+def settle_payment_1(invoice_id, user_id, amount):
+    """
+    Take amount off the invoice's balance and return the remaining balance.
+
+    Raises SettlementError when the amount is not positive or exceeds the
+    current balance, and Invoice.DoesNotExist for someone else's invoice.
+    """
+    amount = _check_amount(amount)
+    with transaction.atomic():
+        current = _apply(
+            invoice_id, user_id,
+            condition={'balance__gte': amount},
+            changes={'balance': _outstanding('balance', amount)},
+            refused=lambda row: (
+                f'Settlement amount ({amount}) cannot exceed current balance ({row["balance"]}).'
+            ),
+        )
+        _refresh(dict(current, balance=current['balance'] + amount), current)
+    return current['balance']
+
+
+def settle_payment_2(invoice_id, user_id, amount):
+    """
+    Take amount off the invoice's outstanding payment 2, marking payment 2
+    settled once nothing is left, and return what remains.
+
+    Raises SettlementError when the amount is not positive, exceeds the
+    outstanding payment 2 or payment 2 is already settled.
+    """
+    amount = _check_amount(amount)
+    # Both SET expressions see the row as it was before the UPDATE
+    clears = When(payment_2__lte=amount, then=Value(True))
+
+    def refused(row):
+        if row['settled_payment_2']:
+            return 'Payment 2 is already settled for this invoice.'
+        return (
+            f'Settlement amount ({amount}) cannot exceed remaining '
+            f'Payment 2 amount ({row["payment_2"]}).'
+        )
+
+    with transaction.atomic():
+        current = _apply(
+            invoice_id, user_id,
+            condition={'payment_2__gte': amount, 'settled_payment_2': False},
+            changes={
+                'payment_2': Case(
+                    When(payment_2__lte=amount, then=Value(ZERO)),
+                    default=_outstanding('payment_2', amount),
+                    output_field=DecimalField(max_digits=15, decimal_places=2),
+                ),
+                'settled_payment_2': Case(clears, default=Value(False), output_field=BooleanField()),
+                # Kept so recalculations and re-imports leave the settlement in place
+                'payment_2_collected': F('payment_2_collected') + Value(amount),
+            },
+            refused=refused,
+        )
+        _refresh(dict(current, settled_payment_2=False), current)
+    return current['payment_2']
+
+
+def mark_settled(queryset):
+    """
+    Settle every invoice in queryset in full: balance and payment 2 go to
+    zero and payment 2 is marked settled. Returns the number of invoices
+    changed; ones already fully settled are left alone.
+    """
+    queryset = queryset.exclude(balance=ZERO, payment_2=ZERO, settled_payment_2=True)
+    months = affected_months(queryset)
+    if not months:
+        return 0
+    with transaction.atomic():
+        updated = queryset.update(
+            balance=ZERO,
+            payment_2=ZERO,
+            settled_payment_2=True,
+            payment_2_collected=F('payment_2_collected') + Coalesce(F('payment_2'), Value(ZERO)),
+            updated_at=timezone.now(),
+        )
+        for user_id, user_months in months.items():
+            invoices_bulk_changed.send(sender=Invoice, user_id=user_id, months=user_months)
+    return updated
@@ -1,35 +1,88 @@
-from django.db.models.signals import post_save, post_delete
-from django.dispatch import receiver
-from django.utils import timezone
+from django.db import connections
+from django.db.models.signals import post_migrate, post_save, post_delete, pre_save
+from django.dispatch import Signal, receiver
 from .models import Invoice
+from . import caching, search, summaries
+
+# Sent once after a bulk write (bulk_create, queryset.update) that bypassed
+# the per-instance receivers below. Arguments: user_id, months (dates in the
+# affected invoice_date months).
+invoices_bulk_changed = Signal()
+
+@receiver(pre_save, sender=Invoice)
+def remember_summary_state(sender, instance, **kwargs):
+    """
+    Before an existing invoice is saved, remember the values its monthly
+    summary row was built from so post_save can move them if they changed.
+    """
+    instance._summary_previous = None
+    if instance.pk:
+        instance._summary_previous = (
+            Invoice.objects.filter(pk=instance.pk)
+            .values(*summaries.SUMMARY_SOURCE_FIELDS)
+            .first()
+        )
+
+@receiver(post_save, sender=Invoice)
+def update_monthly_summary(sender, instance, created, raw=False, **kwargs):
+    """
+    Keep the MonthlySummary rows current: take the invoice's old values out
+    of their month and add the new ones, which also covers an invoice moving
+    to a different month.
+    """
+    if raw:
+        return
+    previous = getattr(instance, '_summary_previous', None)
+    if previous:
+        summaries.apply_contribution(previous, sign=-1)
+    summaries.apply_contribution(summaries.instance_state(instance))
+
+@receiver(post_save, sender=Invoice)
+def update_search_index(sender, instance, **kwargs):
+    """Keep the invoice's full-text search entry in step with its fields"""
+    search.index_invoices([instance.pk])
+
+@receiver(post_delete, sender=Invoice)
+def remove_from_search_index(sender, instance, **kwargs):
+    """Drop a deleted invoice from the full-text search index"""
+    search.unindex_invoice(instance.pk)
 
 @receiver(post_save, sender=Invoice)
-def mark_invoice_added(sender, instance, created, **kwargs):
-    """
-    When an invoice is created or updated, mark that there's a new invoice this month.
-    This will be used by the middleware to suggest generating an Excel file.
-    """
-    from django.core.cache import cache
-    
-    # Get the month-year from the instance
-    month_year = instance.created_at.strftime('%Y-%m')
-    
-    # Store in cache that a new invoice was added for this month
-    cache_key = f'invoice_added_{month_year}'
-    cache.set(cache_key, True, 60*60*24*7)  # Cache for a week
-    
-    # If there's an existing Excel file for this month, mark it as outdated
-    cache.set(f'excel_file_outdated_{month_year}', True, 60*60*24*7)
+def invalidate_after_save(sender, instance, **kwargs):
+    """
+    Invalidate the owner's cached results for the invoice's month, and for
+    its previous month (and owner) if the save moved it.
+    """
+    caching.invalidate(instance.user_id, [instance.invoice_date])
+    previous = getattr(instance, '_summary_previous', None)
+    if previous:
+        caching.invalidate(previous['user_id'], [previous['invoice_date']])
 
 @receiver(post_delete, sender=Invoice)
-def mark_invoice_deleted(sender, instance, **kwargs):
+def remove_deleted_invoice(sender, instance, **kwargs):
+    """
+    Take a deleted invoice out of its monthly summary and invalidate the
+    owner's cached results for its month.
+    """
+    summaries.apply_contribution(summaries.instance_state(instance), sign=-1)
+    caching.invalidate(instance.user_id, [instance.invoice_date])
+
+@receiver(invoices_bulk_changed)
+def refresh_after_bulk_change(sender, user_id, months, **kwargs):
+    """
+    Rebuild the monthly summaries and search index entries for the months a
+    bulk write touched and invalidate their cached results, once for the
+    whole batch.
+    """
+    summaries.rebuild_months(user_id, months)
+    search.reindex_months(user_id, months)
+    caching.invalidate(user_id, months)
+
+@receiver(post_migrate)
+def restore_party_search(sender, using, **kwargs):
     """
-    When an invoice is deleted, mark that the Excel file for this month is outdated.
+    Put back the SQLite party search triggers after migrations that rebuilt
+    the invoice table.
     """
-    from django.core.cache import cache
-    
-    # Get the month-year from the instance
-    month_year = instance.created_at.strftime('%Y-%m')
-    
-    # Mark any existing Excel file for this month as outdated
-    cache.set(f'excel_file_outdated_{month_year}', True, 60*60*24*7)
\ No newline at end of file
+    if sender.name == 'Recorder':
+        search.restore_party_search_triggers(connections[using])
@@ -0,0 +1,173 @@
+"""
+Summary statistics for the invoice dashboard.
+
+``summarize`` computes every statistic for an arbitrary queryset in a single
+conditional-aggregation query. ``MonthlySummary`` rows hold the same numbers
+pre-aggregated per user and invoice month; signals.py keeps them current one
+invoice at a time, and ``rebuild_months`` recomputes them after bulk writes.
+"""
+from decimal import Decimal
+
+from django.db.models import Count, F, Q, Sum, Value
+from django.db.models.functions import Coalesce, TruncMonth
+
+from .models import Invoice, MonthlySummary, month_bounds, month_start
+
+# Invoice columns that affect a monthly summary row
+SUMMARY_SOURCE_FIELDS = ('user_id', 'invoice_date', 'balance', 'total_amount', 'settled_payment_2')
+
+COUNT_FIELDS = ('invoice_count', 'pending_count', 'payment_1_settled_count', 'both_settled_count')
+AMOUNT_FIELDS = (
+    'pending_amount', 'payment_1_settled_amount', 'both_settled_amount', 'total_balance', 'total_amount',
+)
+SUMMARY_FIELDS = COUNT_FIELDS + AMOUNT_FIELDS
+
+PENDING = Q(balance__gt=0)
+PAYMENT_1_SETTLED = Q(balance=0, settled_payment_2=False)
+BOTH_SETTLED = Q(balance=0, settled_payment_2=True)
+
+ZERO = Decimal('0.00')
+
+
+def _sum(field, condition=None):
+    return Coalesce(Sum(field, filter=condition), Value(ZERO))
+
+
+def summary_aggregates():
+    """Conditional aggregates producing every summary statistic in one pass"""
+    return {
+        'invoice_count': Count('id'),
+        'pending_count': Count('id', filter=PENDING),
+        'pending_amount': _sum('balance', PENDING),
+        'payment_1_settled_count': Count('id', filter=PAYMENT_1_SETTLED),
+        'payment_1_settled_amount': _sum('total_amount', PAYMENT_1_SETTLED),
+        'both_settled_count': Count('id', filter=BOTH_SETTLED),
+        'both_settled_amount': _sum('total_amount', BOTH_SETTLED),
+        'total_balance': _sum('balance'),
+        'total_amount': _sum('total_amount'),
+    }
+
+
+def summarize(queryset):
+    """Return the summary statistics for queryset using a single query"""
+    return queryset.aggregate(**summary_aggregates())
+
+
+def empty_summary():
+    return {field: 0 if field in COUNT_FIELDS else ZERO for field in SUMMARY_FIELDS}
+
+
+def user_summary(user):
+    """Summary statistics across all of a user's months, read from MonthlySummary"""
+    totals = MonthlySummary.objects.filter(user=user).aggregate(
+        **{field: Sum(field) for field in SUMMARY_FIELDS}
+    )
+    return {field: value if value is not None else empty_summary()[field] for field, value in totals.items()}
+
+
+def month_summary(user, month):
+    """Summary statistics for a single invoice month, read from MonthlySummary"""
+    row = MonthlySummary.objects.filter(user=user, month=month_start(month)).values(*SUMMARY_FIELDS).first()
+    return row or empty_summary()
+
+
+def invoice_months(user_id):
+    """The first days of the user's invoice months, newest first, read from MonthlySummary"""
+    return list(
+        MonthlySummary.objects.filter(user_id=user_id, invoice_count__gt=0)
+        .order_by('-month')
+        .values_list('month', flat=True)
+    )
+
+
+def contribution(state):
+    """
+    The amounts a single invoice adds to its monthly summary row.
+
+    ``state`` is a mapping with the keys in SUMMARY_SOURCE_FIELDS.
+    """
+    balance = Decimal(state['balance'] or 0)
+    total_amount = Decimal(state['total_amount'] or 0)
+    delta = dict.fromkeys(SUMMARY_FIELDS, 0)
+    delta['invoice_count'] = 1
+    delta['total_balance'] = balance
+    delta['total_amount'] = total_amount
+    if balance > 0:
+        delta['pending_count'] = 1
+        delta['pending_amount'] = balance
+    elif balance == 0 and state['settled_payment_2']:
+        delta['both_settled_count'] = 1
+        delta['both_settled_amount'] = total_amount
+    elif balance == 0:
+        delta['payment_1_settled_count'] = 1
+        delta['payment_1_settled_amount'] = total_amount
+    return delta
+
+
+def apply_contribution(state, sign=1):
+    """Add (sign=1) or remove (sign=-1) one invoice's contribution to its month"""
+    rows = MonthlySummary.objects.filter(
+        user_id=state['user_id'],
+        month=month_start(state['invoice_date']),
+    )
+    if sign > 0:
+        # Removals only touch existing rows, so cascading user deletes
+        # never recreate a summary for a user that is going away
+        summary, _ = MonthlySummary.objects.get_or_create(
+            user_id=state['user_id'],
+            month=month_start(state['invoice_date']),
+        )
+        rows = MonthlySummary.objects.filter(pk=summary.pk)
+    rows.update(version=F('version') + 1, **{
+        field: F(field) + sign * value
+        for field, value in contribution(state).items()
+        if value
+    })
+
+
+def instance_state(invoice):
+    """Snapshot the summary source fields of an Invoice instance"""
+    return {field: getattr(invoice, field) for field in SUMMARY_SOURCE_FIELDS}
+
+
+def rebuild_months(user_id, months):
+    """
+    Recompute the MonthlySummary rows for the given user and months from Invoice.
+
+    Used after bulk writes (bulk_create, queryset.update) that bypass the
+    per-instance signals.
+    """
+    months = {month_start(month) for month in months}
+    if not months:
+        return
+    rows = {
+        row.pop('month'): row
+        for row in Invoice.objects.filter(user_id=user_id)
+        .filter(_month_ranges(months))
+        .annotate(month=TruncMonth('invoice_date'))
+        .values('month')
+        .annotate(**summary_aggregates())
+        .order_by()
+    }
+    for month in months:
+        MonthlySummary.objects.update_or_create(
+            user_id=user_id,
+            month=month,
+            defaults=rows.get(month, empty_summary()),
+        )
+    MonthlySummary.objects.filter(user_id=user_id, month__in=months).update(version=F('version') + 1)
+
+
+def month_version(user_id, month):
+    """The content version of a user's invoice month (0 if it has never had invoices)"""
+    return MonthlySummary.objects.filter(
+        user_id=user_id, month=month_start(month)
+    ).values_list('version', flat=True).first() or 0
+
+
+def _month_ranges(months):
+    condition = Q()
+    for month in months:
+        start, end = month_bounds(month)
+        condition |= Q(invoice_date__gte=start, invoice_date__lt=end)
+    return condition
@@ -0,0 +1,20 @@
+from django import template
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def list_query(context, **changes):
+    """
+    The current invoice list querystring with some parameters replaced, for
+    filter links. An empty value drops the parameter; the pagination cursor
+    is always dropped since the filters change the result set.
+    """
+    params = context['request'].GET.copy()
+    params.pop('cursor', None)
+    for key, value in changes.items():
+        if value:
+            params[key] = value
+        else:
+            params.pop(key, None)
+    return f'?{params.urlencode()}' if params else ''
@@ -1,3 +1,1514 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import zipfile
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import xlsxwriter
+from asgiref.sync import async_to_sync
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import OperationalError, connection, connections, transaction
+from django.test import AsyncRequestFactory, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from . import async_views, metrics, parsing, views
+from .admin import EstimatedCountPaginator, InvoiceAdmin
+from .aging import aging_report
+from .benchmarks import prepared_request, run_concurrent_exports
+from .caching import cached
+from .exports import write_xlsx
+from .importer import REQUIRED_FIELDS, batched, import_invoices
+from .jobs import claim_next_job, run_pending_jobs
+from .models import ImportJob, Invoice, MonthlySummary
+from .pagination import decode_cursor, encode_cursor
+from .parsing import parse_batches, parse_row
+from .recalculation import _recalculate_in_python, recalculate_payment_2
+from .receipts import apply_receipts
+from .reports import get_report
+from .settlement import SettlementError, settle_payment_1, settle_payment_2
+from .search import PARTY_TRIGRAM_TABLE, filter_party, search_invoices
+from .summaries import month_version, rebuild_months, summarize, user_summary
+
+LOCMEM_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+# Test databases reuse primary keys between tests, so cached entries could
+# leak from one test into the next. Tests run without a cache, and never
+# touch the file cache the project settings configure; the ones that
+# exercise caching opt in to LOCMEM_CACHE.
+no_cache = override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+
+
+def setUpModule():
+    no_cache.enable()
+
+
+def tearDownModule():
+    no_cache.disable()
+
+
+def make_invoice(user, **overrides):
+    """Create an invoice with sensible defaults for tests"""
+    fields = {
+        'firm': 'Acme Textiles',
+        'quality': 'Cotton',
+        'invoice_date': date(2025, 5, 10),
+        'invoice_number': 'INV-1',
+        'party': 'Shree Traders',
+        'meter': Decimal('100.00'),
+        'total_amount': Decimal('1000.00'),
+        'due_date': date(2025, 6, 10),
+        'balance': Decimal('1000.00'),
+        'dhara_day': 30,
+        'taka': Decimal('10.00'),
+    }
+    fields.update(overrides)
+    return Invoice.objects.create(user=user, **fields)
+
+
+class InvoiceListPaginationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='secret')
+        self.client.force_login(self.user)
+        start = date(2025, 5, 1)
+        for i in range(7):
+            make_invoice(
+                self.user,
+                invoice_number=f'INV-{i}',
+                invoice_date=start + timedelta(days=i // 2),
+                balance=Decimal('0.00') if i % 3 == 0 else Decimal('500.00'),
+            )
+
+    def walk_pages(self, params):
+        """Follow next cursors until the last page, returning all invoice ids"""
+        seen = []
+        cursor = None
+        while True:
+            query = dict(params, page_size=3)
+            if cursor:
+                query['cursor'] = cursor
+            response = self.client.get(reverse('Recorder:invoice_list'), query)
+            page = response.context['page_obj']
+            self.assertLessEqual(len(page), 3)
+            seen.extend(invoice.pk for invoice in page)
+            if not page.has_next:
+                return seen
+            cursor = page.next_cursor
+
+    def test_pages_cover_every_invoice_once_in_order(self):
+        expected = list(
+            Invoice.objects.filter(user=self.user)
+            .order_by('-invoice_date', '-id')
+            .values_list('id', flat=True)
+        )
+        self.assertEqual(self.walk_pages({}), expected)
+
+    def test_filters_are_kept_across_pages(self):
+        expected = list(
+            Invoice.objects.filter(user=self.user, balance__gt=0)
+            .order_by('-invoice_date', '-id')
+            .values_list('id', flat=True)
+        )
+        self.assertEqual(self.walk_pages({'payment_status': 'pending', 'month': '2025-05'}), expected)
+
+    def test_only_rendered_columns_are_loaded(self):
+        response = self.client.get(reverse('Recorder:invoice_list'))
+        invoice = response.context['page_obj'].object_list[0]
+        self.assertIn('taka', invoice.get_deferred_fields())
+        self.assertNotIn('balance', invoice.get_deferred_fields())
+
+    @override_settings(INVOICE_LIST_PAGE_SIZE=2)
+    def test_default_page_size_comes_from_settings(self):
+        response = self.client.get(reverse('Recorder:invoice_list'))
+        self.assertEqual(len(response.context['page_obj']), 2)
+        self.assertTrue(response.context['page_obj'].has_next)
+
+    def test_cursor_round_trip(self):
+        self.assertEqual(decode_cursor(encode_cursor(date(2025, 5, 3), 12)), (date(2025, 5, 3), 12))
+        self.assertIsNone(decode_cursor('not-a-cursor'))
+
+
+class SummaryStatsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='secret')
+        self.client.force_login(self.user)
+        make_invoice(self.user, invoice_number='P', balance=Decimal('250.00'))
+        make_invoice(self.user, invoice_number='S1', balance=Decimal('0.00'), total_amount=Decimal('700.00'))
+        make_invoice(
+            self.user, invoice_number='S2', balance=Decimal('0.00'), settled_payment_2=True,
+            total_amount=Decimal('300.00'), invoice_date=date(2025, 4, 2),
+        )
+
+    def expected(self, queryset):
+        return {
+            'pending_count': queryset.filter(balance__gt=0).count(),
+            'payment_1_settled_count': queryset.filter(balance=0, settled_payment_2=False).count(),
+            'both_settled_count': queryset.filter(balance=0, settled_payment_2=True).count(),
+            'total_balance': sum(i.balance for i in queryset),
+            'both_settled_amount': sum(i.total_amount for i in queryset.filter(balance=0, settled_payment_2=True)),
+            'total_amount': sum(i.total_amount for i in queryset),
+        }
+
+    def assertSummaryMatches(self, stats, queryset):
+        for key, value in self.expected(queryset).items():
+            self.assertEqual(stats[key], value, key)
+
+    def test_summarize_uses_one_query(self):
+        with self.assertNumQueries(1):
+            stats = summarize(Invoice.objects.filter(user=self.user))
+        self.assertSummaryMatches(stats, Invoice.objects.filter(user=self.user))
+
+    def test_monthly_summary_follows_saves_and_deletes(self):
+        invoice = Invoice.objects.get(invoice_number='P')
+        invoice.balance = Decimal('0.00')
+        invoice.invoice_date = date(2025, 4, 20)
+        invoice.save()
+        Invoice.objects.get(invoice_number='S1').delete()
+
+        invoices = Invoice.objects.filter(user=self.user)
+        self.assertSummaryMatches(user_summary(self.user), invoices)
+        april = MonthlySummary.objects.get(user=self.user, month=date(2025, 4, 1))
+        may = MonthlySummary.objects.get(user=self.user, month=date(2025, 5, 1))
+        self.assertEqual(april.invoice_count, 2)
+        self.assertEqual(april.payment_1_settled_count, 1)
+        self.assertEqual(may.invoice_count, 0)
+        self.assertEqual(may.total_balance, 0)
+
+    def test_rebuild_matches_incremental_rows(self):
+        before = list(MonthlySummary.objects.values())
+        MonthlySummary.objects.all().delete()
+        rebuild_months(self.user.pk, [date(2025, 4, 1), date(2025, 5, 1)])
+        strip = lambda rows: sorted(
+            ({k: v for k, v in row.items() if k not in ('id', 'updated_at', 'version')} for row in rows),
+            key=lambda row: row['month'],
+        )
+        self.assertEqual(strip(MonthlySummary.objects.values()), strip(before))
+
+    def test_month_bar_is_read_from_summary_table(self):
+        url = reverse('Recorder:invoice_list')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertFalse([q for q in queries.captured_queries if 'DISTINCT' in q['sql']])
+        self.assertEqual(response.context['months'], {'2025-05': 'May 2025', '2025-04': 'April 2025'})
+
+        # Moving April's only invoice into June drops April and adds June
+        invoice = Invoice.objects.get(invoice_number='S2')
+        invoice.invoice_date = date(2025, 6, 1)
+        invoice.save()
+        self.assertEqual(list(self.client.get(url).context['months']), ['2025-06', '2025-05'])
+        june = MonthlySummary.objects.get(user=self.user, month=date(2025, 6, 1))
+        self.assertEqual((june.invoice_count, june.total_amount), (1, Decimal('300.00')))
+
+        Invoice.objects.filter(invoice_number__in=['P', 'S1']).delete()
+        self.assertEqual(list(self.client.get(url).context['months']), ['2025-06'])
+
+    def test_unfiltered_list_reads_summary_table(self):
+        response = self.client.get(reverse('Recorder:invoice_list'))
+        self.assertSummaryMatches(response.context['summary_stats'], Invoice.objects.filter(user=self.user))
+        response = self.client.get(reverse('Recorder:invoice_list'), {'party_search': 'shree'})
+        self.assertSummaryMatches(response.context['summary_stats'], Invoice.objects.filter(user=self.user))
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN output checked against the SQLite planner')
+class InvoiceIndexTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='secret')
+        self.invoices = Invoice.objects.filter(user=self.user)
+        make_invoice(self.user, party='Shree Ganesh Traders')
+        make_invoice(self.user, party='Mahalaxmi Silk', invoice_number='INV-2', invoice_date=date(2025, 6, 1))
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(index_name, plan)
+
+    def test_month_filter_uses_user_date_index(self):
+        self.assertUsesIndex(self.invoices.for_month(date(2025, 5, 1)), 'invoice_user_date_idx')
+
+    def test_keyset_ordering_uses_user_date_index(self):
+        self.assertUsesIndex(self.invoices.order_by('-invoice_date', '-id')[:51], 'invoice_user_date_idx')
+
+    def test_payment_status_filter_uses_status_index(self):
+        self.assertUsesIndex(self.invoices.filter(balance=0, settled_payment_2=True), 'invoice_user_status_idx')
+
+    def test_due_date_filter_uses_due_index(self):
+        self.assertUsesIndex(self.invoices.filter(due_date__lt=date(2025, 7, 1)), 'invoice_user_due_idx')
+
+    def test_invoice_number_lookup_uses_unique_index(self):
+        # SQLite names the index behind an inline UNIQUE constraint itself
+        plan = self.invoices.filter(invoice_number__in=['INV-1', 'INV-2']).explain()
+        self.assertIn('USING INDEX sqlite_autoindex_Recorder_invoice', plan)
+        self.assertIn('invoice_number=?', plan)
+
+    def test_party_search_uses_trigram_index(self):
+        queryset = filter_party(self.invoices, 'ganesh')
+        self.assertIn(PARTY_TRIGRAM_TABLE, queryset.explain())
+        self.assertEqual([i.party for i in queryset], ['Shree Ganesh Traders'])
+
+    def test_party_search_follows_updates_and_short_terms(self):
+        invoice = Invoice.objects.get(invoice_number='INV-2')
+        invoice.party = 'Krishna Fabrics'
+        invoice.save()
+        self.assertFalse(filter_party(self.invoices, 'mahalaxmi').exists())
+        self.assertEqual(filter_party(self.invoices, 'KRISHNA').get(), invoice)
+        self.assertEqual(filter_party(self.invoices, 'kr').get(), invoice)
+
+    def test_for_month_handles_december(self):
+        make_invoice(self.user, invoice_number='INV-3', invoice_date=date(2024, 12, 31))
+        make_invoice(self.user, invoice_number='INV-4', invoice_date=date(2025, 1, 1))
+        self.assertEqual(
+            list(self.invoices.for_month(date(2024, 12, 1)).values_list('invoice_number', flat=True)),
+            ['INV-3'],
+        )
+
+
+CSV_HEADER = ','.join(REQUIRED_FIELDS + ['payment_date_1', 'payment_1', 'payment_date_2'])
+
+
+def csv_row(number, invoice_date='2025-05-10', balance='"1,000.00"', dhara_day='30', payment='', paid_on=''):
+    return (
+        f'Acme,Cotton,{invoice_date},{number},Shree Traders,100,"2,13,546.00",'
+        f'2025-06-10,{balance},{dhara_day},10,{paid_on},{payment},'
+    )
+
+
+def xlsx_upload(*rows, name='invoices.xlsx'):
+    """An .xlsx upload with the standard header and typed cells, as Excel saves them"""
+    output = io.BytesIO()
+    workbook = xlsxwriter.Workbook(output, {'in_memory': True})
+    sheet = workbook.add_worksheet()
+    dates = workbook.add_format({'num_format': 'yyyy-mm-dd'})
+    sheet.write_row(0, 0, CSV_HEADER.split(','))
+    for index, row in enumerate(rows, 1):
+        for column, value in enumerate(row):
+            if isinstance(value, date):
+                sheet.write_datetime(index, column, datetime.combine(value, datetime.min.time()), dates)
+            elif value is not None:
+                sheet.write(index, column, value)
+    # A formatted but empty row, as sheets often have below the data
+    sheet.set_row(len(rows) + 1, None, dates)
+    sheet.write_blank(len(rows) + 1, 0, None, dates)
+    workbook.close()
+    content_type = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    return SimpleUploadedFile(name, output.getvalue(), content_type=content_type)
+
+
+def xlsx_row(number, dhara_day=30):
+    return [
+        'Acme', 'Cotton', date(2025, 5, 10), number, 'Shree Traders', 100, 213546.5,
+        date(2025, 6, 10), 1000, dhara_day, 10, date(2025, 7, 1), 1050, None,
+    ]
+
+
+@override_settings(INVOICE_IMPORT_BACKGROUND=False)
+class CsvImportTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='secret')
+        self.client.force_login(self.user)
+
+    def upload(self, lines, name='invoices.csv'):
+        content = '\ufeff' + '\n'.join([CSV_HEADER] + lines) + '\n'
+        upload = SimpleUploadedFile(name, content.encode('utf-8'), content_type='text/csv')
+        return self.client.post(reverse('Recorder:invoice_csv_upload'), {'csv_file': upload})
+
+    def test_valid_rows_are_bulk_inserted(self):
+        rows = [csv_row(f'INV-{i}', payment='"1,050.00"', paid_on='2025-07-01') for i in range(25)]
+        with override_settings(INVOICE_IMPORT_BATCH_SIZE=10):
+            response = self.upload(rows)
+        self.assertRedirects(response, reverse('Recorder:invoice_list'), fetch_redirect_response=False)
+        self.assertEqual(Invoice.objects.filter(user=self.user).count(), 25)
+        invoice = Invoice.objects.get(invoice_number='INV-0')
+        self.assertEqual(invoice.total_amount, Decimal('213546.00'))
+        self.assertEqual(invoice.payment_2, invoice.calculate_payment_2().quantize(Decimal('0.01')))
+        summary = MonthlySummary.objects.get(user=self.user, month=date(2025, 5, 1))
+        self.assertEqual(summary.invoice_count, 25)
+        self.assertEqual(summary.pending_amount, Decimal('25000.00'))
+
+    def test_row_errors_are_reported_per_row(self):
+        response = self.upload([
+            csv_row('INV-1'),
+            csv_row('INV-2', invoice_date='10/05/2025'),
+            csv_row('INV-3', balance='abc'),
+            csv_row('INV-4', dhara_day='x'),
+            csv_row(''),
+        ])
+        messages = [str(m) for m in get_messages(response.wsgi_request)]
+        self.assertIn('Successfully imported 1 invoices', messages)
+        self.assertIn(
+            'Failed to import 4 invoices. Errors:'
+            '\nRow 2: Invalid invoice_date format: 10/05/2025. Expected YYYY-MM-DD'
+            '\nRow 3: Invalid number format: abc. Expected format: 2,13,546.00'
+            '\nRow 4: Invalid dhara_day: x. Must be a valid integer'
+            "\nRow 5: Required field 'invoice_number' is empty",
+            messages,
+        )
+
+    def test_xlsx_rows_are_imported_like_csv(self):
+        response = self.client.post(reverse('Recorder:invoice_csv_upload'), {
+            'csv_file': xlsx_upload(xlsx_row(1001), xlsx_row('INV-2', dhara_day='x')),
+        })
+        messages = [str(m) for m in get_messages(response.wsgi_request)]
+        self.assertIn('Successfully imported 1 invoices', messages)
+        self.assertIn('Row 2: Invalid dhara_day: x. Must be a valid integer', messages[1])
+        invoice = Invoice.objects.get(user=self.user)
+        self.assertEqual(invoice.invoice_number, '1001')
+        self.assertEqual((invoice.invoice_date, invoice.payment_date_1), (date(2025, 5, 10), date(2025, 7, 1)))
+        self.assertEqual(invoice.total_amount, Decimal('213546.50'))
+        self.assertIsNone(invoice.payment_date_2)
+
+    def test_other_file_types_are_rejected(self):
+        upload = SimpleUploadedFile('invoices.xls', b'not a workbook')
+        response = self.client.post(reverse('Recorder:invoice_csv_upload'), {'csv_file': upload})
+        messages = [str(m) for m in get_messages(response.wsgi_request)]
+        self.assertEqual(messages, ['Please upload a CSV or Excel (.xlsx) file'])
+
+    def test_missing_columns_are_rejected(self):
+        upload = SimpleUploadedFile('invoices.csv', b'firm,quality\nAcme,Cotton\n')
+        response = self.client.post(reverse('Recorder:invoice_csv_upload'), {'csv_file': upload})
+        messages = [str(m) for m in get_messages(response.wsgi_request)]
+        self.assertTrue(messages[0].startswith('Missing required fields: invoice_date, invoice_number'))
+        self.assertFalse(Invoice.objects.exists())
+
+    def test_each_batch_is_a_single_insert(self):
+        rows = [
+            dict(zip(CSV_HEADER.split(','), [
+                'Acme', 'Cotton', '2025-05-10', f'INV-{i}', 'Shree Traders', '100', '213546',
+                '2025-06-10', '1000', '30', '10', '', '', '',
+            ]))
+            for i in range(40)
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            result = import_invoices(self.user, rows, batch_size=10)
+        inserts = [q for q in queries.captured_queries if q['sql'].startswith('INSERT INTO "Recorder_invoice"')]
+        self.assertEqual(len(inserts), 4)
+        self.assertEqual(result.success_count, 40)
+
+
+    def test_pool_parsing_matches_in_process(self):
+        lines = [csv_row(f'INV-{i}', payment='"1,050.00"', paid_on='2025-07-01') for i in range(30)]
+        lines[7] = csv_row('INV-7', invoice_date='2025-02-30')
+        rows = csv.DictReader(io.StringIO('\n'.join([CSV_HEADER] + lines)))
+        batches = list(batched(enumerate(rows, 1), 4))
+        in_process = [parsed for _, parsed in parse_batches(batches)]
+        self.assertEqual([parsed for _, parsed in parse_batches(batches, workers=2)], in_process)
+        self.assertEqual(in_process[1][3][3], 'Invalid invoice_date format: 2025-02-30. Expected YYYY-MM-DD')
+
+    def test_unpadded_dates_still_parse(self):
+        values = parse_row(dict(zip(CSV_HEADER.split(','), next(csv.reader([csv_row('INV-1', '2025-5-1')])))))
+        self.assertEqual(values['invoice_date'], date(2025, 5, 1))
+
+    def test_amount_too_large_for_its_column_is_a_row_error(self):
+        rows = csv_rows(csv_row('INV-1'), csv_row('INV-2', balance='99999999999'), csv_row('INV-3'))
+        result = import_invoices(self.user, rows)
+        self.assertEqual(result.inserted_count, 2)
+        self.assertEqual(
+            result.error_details,
+            ['Row 2: Invalid balance: 99999999999. Must have at most 8 digits before the decimal point'],
+        )
+        self.assertEqual(
+            sorted(Invoice.objects.values_list('invoice_number', flat=True)), ['INV-1', 'INV-3'],
+        )
+
+    def test_write_errors_only_fail_their_row(self):
+        rows = csv_rows(csv_row('INV-1'), csv_row('INV-2', balance='99999999999'), csv_row('INV-3'))
+        # Let the value past parsing so the write itself rejects it
+        with mock.patch.dict(parsing.DECIMAL_LIMITS, balance=(20, 2)):
+            result = import_invoices(self.user, rows)
+        self.assertEqual(result.inserted_count, 2)
+        self.assertEqual(len(result.error_details), 1)
+        self.assertTrue(result.error_details[0].startswith('Row 2: '))
+
+    def test_decimal_limits_match_the_model(self):
+        for name, limits in parsing.DECIMAL_LIMITS.items():
+            field = Invoice._meta.get_field(name)
+            self.assertEqual((field.max_digits, field.decimal_places), limits, name)
+
+
+def csv_rows(*lines):
+    return list(csv.DictReader(io.StringIO('\n'.join([CSV_HEADER] + list(lines)))))
+
+
+class UpsertImportTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='secret')
+        import_invoices(self.user, csv_rows(csv_row('INV-1'), csv_row('INV-2'), csv_row('INV-3')))
+
+    def test_reimport_updates_changed_rows_and_skips_the_rest(self):
+        result = import_invoices(self.user, csv_rows(
+            csv_row('INV-1'),
+            csv_row('INV-2', dhara_day='45'),
+            csv_row('INV-3', invoice_date='2025-06-02'),
+            csv_row('INV-4'),
+        ))
+        self.assertEqual((result.inserted_count, result.updated_count, result.unchanged_count), (1, 2, 1))
+        self.assertEqual(result.summary, 'Successfully imported 4 invoices (1 new, 2 updated, 1 unchanged)')
+        self.assertEqual(Invoice.objects.filter(user=self.user).count(), 4)
+        self.assertEqual(Invoice.objects.get(invoice_number='INV-2').dhara_day, 45)
+        # The moved invoice leaves May's summary for June's
+        may = MonthlySummary.objects.get(user=self.user, month=date(2025, 5, 1))
+        self.assertEqual((may.invoice_count, may.total_balance), (3, Decimal('3000.00')))
+        self.assertEqual(MonthlySummary.objects.get(user=self.user, month=date(2025, 6, 1)).invoice_count, 1)
+
+    def test_unchanged_file_writes_nothing(self):
+        rows = csv_rows(csv_row('INV-1'), csv_row('INV-2'), csv_row('INV-3'))
+        with CaptureQueriesContext(connection) as queries:
+            result = import_invoices(self.user, rows)
+        self.assertEqual(result.unchanged_count, 3)
+        self.assertFalse([q for q in queries.captured_queries if q['sql'].startswith('INSERT INTO "Recorder_invoice"')])
+
+    def test_update_keeps_payment_2_settlement(self):
+        Invoice.objects.filter(invoice_number='INV-1').update(settled_payment_2=True, payment_2=0)
+        import_invoices(self.user, csv_rows(csv_row('INV-1', payment='"1,000.00"', paid_on='2025-08-01')))
+        invoice = Invoice.objects.get(invoice_number='INV-1')
+        self.assertTrue(invoice.settled_payment_2)
+        self.assertEqual(invoice.payment_1, Decimal('1000.00'))
+        self.assertEqual(invoice.payment_2, Decimal('0.00'))
+
+    def test_update_keeps_partial_settlements(self):
+        late = {'payment': '"1,050.00"', 'paid_on': '2025-07-19'}
+        import_invoices(self.user, csv_rows(csv_row('INV-5', **late)))
+        invoice = Invoice.objects.get(invoice_number='INV-5')
+        self.assertEqual(invoice.payment_2, Decimal('19.73'))
+        settle_payment_1(invoice.pk, self.user.pk, Decimal('200.00'))
+        settle_payment_2(invoice.pk, self.user.pk, Decimal('5.00'))
+
+        # A corrected row: one day less grace and a different balance
+        import_invoices(self.user, csv_rows(csv_row('INV-5', dhara_day='29', balance='"900.00"', **late)))
+        invoice.refresh_from_db()
+        self.assertEqual(invoice.dhara_day, 29)
+        self.assertEqual(invoice.balance, Decimal('800.00'))
+        self.assertEqual(invoice.payment_2_collected, Decimal('5.00'))
+        # 20.22 for 41 days late, less the 5.00 already collected
+        self.assertEqual((invoice.payment_2, invoice.settled_payment_2), (Decimal('15.22'), False))
+
+    def test_repeated_number_in_one_file_keeps_the_first_row_whatever_the_batches(self):
+        rows = csv_rows(csv_row('INV-8'), csv_row('INV-9', balance='1.00'), csv_row('INV-9', balance='2.00'))
+        # Batches of 2 put the repeat across a batch boundary, 3 inside one batch
+        for batch_size in (2, 3):
+            with self.subTest(batch_size=batch_size), transaction.atomic():
+                result = import_invoices(self.user, rows, batch_size=batch_size)
+                self.assertEqual(result.inserted_count, 2)
+                self.assertEqual(result.error_details, ['Row 3: Duplicate invoice_number; already used on row 2'])
+                self.assertEqual(Invoice.objects.get(invoice_number='INV-9').balance, Decimal('1.00'))
+                transaction.set_rollback(True)
+
+    def test_form_rejects_a_duplicate_number(self):
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('Recorder:invoice_create'), {
+            'firm': 'Acme', 'quality': 'Cotton', 'invoice_date': '2025-05-10', 'invoice_number': 'INV-1',
+            'party': 'Shree Traders', 'meter': '100', 'total_amount': '1000', 'due_date': '2025-06-10',
+            'balance': '1000', 'dhara_day': '30', 'taka': '10',
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('invoice_number', response.context['form'].errors)
+        self.assertEqual(Invoice.objects.filter(invoice_number='INV-1').count(), 1)
+        # Another user may use the same number
+        other = User.objects.create_user('other', password='secret')
+        make_invoice(other, invoice_number='INV-1')
+
+
+@override_settings(INVOICE_IMPORT_BACKGROUND=True, MEDIA_ROOT=tempfile.mkdtemp())
+class ImportJobTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='secret')
+        self.client.force_login(self.user)
+
+    def upload(self, lines):
+        content = '\n'.join([CSV_HEADER] + lines) + '\n'
+        upload = SimpleUploadedFile('invoices.csv', content.encode('utf-8'), content_type='text/csv')
+        return self.client.post(reverse('Recorder:invoice_csv_upload'), {'csv_file': upload})
+
+    def test_upload_returns_job_and_worker_imports_it(self):
+        response = self.upload([csv_row('INV-1'), csv_row('INV-2', dhara_day='x'), csv_row('INV-3')])
+        job = ImportJob.objects.get(user=self.user)
+        self.assertRedirects(response, reverse('Recorder:import_job_detail', args=[job.pk]))
+        self.assertEqual(job.status, ImportJob.QUEUED)
+        self.assertFalse(Invoice.objects.exists())
+
+        self.assertEqual(run_pending_jobs(), 1)
+
+        status = self.client.get(reverse('Recorder:import_job_status', args=[job.pk])).json()
+        self.assertEqual(status['status'], ImportJob.SUCCEEDED)
+        self.assertEqual(status['rows_processed'], 3)
+        self.assertEqual(status['rows_imported'], 2)
+        self.assertEqual(status['rows_failed'], 1)
+        self.assertEqual(Invoice.objects.filter(user=self.user).count(), 2)
+
+        report = self.client.get(reverse('Recorder:import_job_errors', args=[job.pk]))
+        self.assertEqual(
+            report.content.decode().splitlines(),
+            ['Row,Error', '2,Invalid dhara_day: x. Must be a valid integer'],
+        )
+
+    def test_worker_imports_xlsx_uploads(self):
+        self.client.post(reverse('Recorder:invoice_csv_upload'), {'csv_file': xlsx_upload(xlsx_row('X-1'), xlsx_row('X-2'))})
+        job = ImportJob.objects.get(user=self.user)
+        self.assertEqual(job.file_name, 'invoices.xlsx')
+        run_pending_jobs()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.rows_imported), (ImportJob.SUCCEEDED, 2))
+        self.assertEqual(set(Invoice.objects.values_list('invoice_number', flat=True)), {'X-1', 'X-2'})
+
+    def test_claimed_jobs_are_not_handed_out_twice(self):
+        self.upload([csv_row('INV-1')])
+        self.assertIsNotNone(claim_next_job())
+        self.assertIsNone(claim_next_job())
+
+    @override_settings(INVOICE_IMPORT_STALE_AFTER=600)
+    def test_stalled_running_jobs_are_requeued(self):
+        self.upload([csv_row('INV-1')])
+        job = claim_next_job()
+        # A live worker's job is left alone
+        self.assertEqual(run_pending_jobs(), 0)
+        self.assertEqual(ImportJob.objects.get(pk=job.pk).status, ImportJob.RUNNING)
+
+        # Its worker died eleven minutes ago
+        ImportJob.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now() - timedelta(minutes=11))
+        self.assertEqual(run_pending_jobs(), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.rows_imported), (ImportJob.SUCCEEDED, 1))
+        self.assertTrue(Invoice.objects.filter(user=self.user, invoice_number='INV-1').exists())
+
+    def test_jobs_are_private_to_their_owner(self):
+        self.upload([csv_row('INV-1')])
+        job = ImportJob.objects.get()
+        other = User.objects.create_user('other', password='secret')
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(reverse('Recorder:import_job_status', args=[job.pk])).status_code, 404)
+
+
+class CsvExportTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='secret')
+        self.client.force_login(self.user)
+        make_invoice(self.user, invoice_number='INV-2', invoice_date=date(2025, 5, 20))
+        make_invoice(
+            self.user, invoice_number='INV-1', invoice_date=date(2025, 5, 2),
+            payment_date_1=date(2025, 6, 30), payment_1=Decimal('1050.00'), payment_2=Decimal('12.34'),
+            balance=Decimal('0.00'),
+        )
+        make_invoice(self.user, invoice_number='INV-OTHER-MONTH', invoice_date=date(2025, 6, 1))
+
+    def test_export_streams_rows_and_database_totals(self):
+        response = self.client.get(reverse('Recorder:generate_csv'), {'month': '2025-05'})
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="invoices_2025-05.csv"')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines, [
+            'Firm,Quality,Invoice Date,Invoice Number,Party,Total Amount,Due Date,Balance,'
+            'Payment Date 1,Payment 1,Dhara Day,Taka,Payment Date 2,Payment 2,Meter',
+            'Acme Textiles,Cotton,2025-05-02,INV-1,Shree Traders,1000.00,2025-06-10,0.00,'
+            '2025-06-30,1050.00,30,10.00,,12.34,100.00',
+            'Acme Textiles,Cotton,2025-05-20,INV-2,Shree Traders,1000.00,2025-06-10,1000.00,'
+            ',,30,10.00,,,100.00',
+            'Total,,,,,2000.00,,1000.00,,1050.00,,20.00,,12.34,200.00',
+        ])
+
+    def test_empty_month_redirects_with_warning(self):
+        response = self.client.get(reverse('Recorder:generate_csv'), {'month': '2024-01'})
+        self.assertRedirects(response, reverse('Recorder:invoice_list'), fetch_redirect_response=False)
+        messages = [str(m) for m in get_messages(response.wsgi_request)]
+        self.assertEqual(messages, ['No invoices found for January 2024'])
+
+    def test_xlsx_export_has_typed_cells_and_sum_formulas(self):
+        response = self.client.get(reverse('Recorder:generate_xlsx'), {'month': '2025-05'})
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="invoices_2025-05.xlsx"')
+        with zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content))) as workbook:
+            sheet = workbook.read('xl/worksheets/sheet1.xml').decode()
+        # Header, two invoices and the totals row
+        self.assertEqual(sheet.count('<row '), 4)
+        self.assertIn('<f>SUM(F2:F3)</f>', sheet)
+        self.assertIn('<f>SUM(O2:O3)</f>', sheet)
+        # 2025-05-02 as an Excel serial date and 1000.00 as a number
+        self.assertIn('<v>45779</v>', sheet)
+        self.assertIn('<v>1000</v>', sheet)
+
+    def test_empty_xlsx_export_totals_are_zero_not_formulas(self):
+        output = io.BytesIO()
+        write_xlsx(Invoice.objects.none(), output)
+        with zipfile.ZipFile(output) as workbook:
+            sheet = workbook.read('xl/worksheets/sheet1.xml').decode()
+        # Header and the totals row, with no formula that could refer to itself
+        self.assertEqual(sheet.count('<row '), 2)
+        self.assertNotIn('<f>', sheet)
+        self.assertIn('<v>0</v>', sheet)
+
+
+@override_settings(INVOICE_EXCEL_DIR=tempfile.mkdtemp())
+class ReportCacheTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='secret')
+        self.client.force_login(self.user)
+        self.invoice = make_invoice(self.user)
+
+    def download(self):
+        response = self.client.get(reverse('Recorder:download_csv', args=['2025-05']))
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def test_unchanged_month_is_served_from_the_stored_file(self):
+        first = self.download()
+        # Served from disk: no invoice rows are read the second time
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.download(), first)
+        self.assertFalse(any('"Recorder_invoice"."firm"' in q['sql'] for q in queries.captured_queries))
+
+    def test_saving_an_invoice_rebuilds_only_its_month(self):
+        make_invoice(self.user, invoice_number='JUNE', invoice_date=date(2025, 6, 3))
+        june = get_report(self.user.pk, date(2025, 6, 1))
+        may = get_report(self.user.pk, date(2025, 5, 1))
+
+        self.invoice.party = 'Renamed Party'
+        self.invoice.save()
+
+        self.assertIn('Renamed Party', self.download())
+        new_may = get_report(self.user.pk, date(2025, 5, 1))
+        self.assertNotEqual(new_may, may)
+        self.assertFalse(os.path.exists(may))
+        self.assertEqual(get_report(self.user.pk, date(2025, 6, 1)), june)
+
+    def test_bulk_import_bumps_the_version(self):
+        before = get_report(self.user.pk, date(2025, 5, 1))
+        import_invoices(self.user, [dict(zip(CSV_HEADER.split(','), [
+            'Acme', 'Cotton', '2025-05-11', 'INV-9', 'Bulk Party', '1', '1', '2025-06-10', '1', '1', '1', '', '', '',
+        ]))])
+        self.assertNotEqual(get_report(self.user.pk, date(2025, 5, 1)), before)
+        self.assertIn('Bulk Party', self.download())
+
+
+class Payment2RecalculationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='secret')
+        self.other = User.objects.create_user('other', password='secret')
+        paid = {'payment_1': Decimal('1050.00'), 'payment_date_1': date(2025, 7, 19)}
+        self.invoices = [
+            # 70 days after the invoice, 40 past dhara
+            make_invoice(self.user, invoice_number='LATE', **paid),
+            # Paid within dhara: no interest
+            make_invoice(self.user, invoice_number='ON-TIME', payment_1=Decimal('1050.00'),
+                         payment_date_1=date(2025, 5, 20)),
+            # Not paid yet
+            make_invoice(self.user, invoice_number='UNPAID'),
+            make_invoice(self.user, invoice_number='SETTLED', settled_payment_2=True, **paid),
+            make_invoice(self.user, invoice_number='NO-DHARA', dhara_day=0, **paid),
+        ]
+        Invoice.objects.update(payment_2=Decimal('999.99'))
+        self.untouched = make_invoice(self.other, invoice_number='OTHER', payment_2=Decimal('999.99'), **paid)
+
+    def expected(self, invoice):
+        value = invoice.calculate_payment_2()
+        return value.quantize(Decimal('0.01')) if value is not None else None
+
+    def test_database_update_matches_the_python_formula(self):
+        updated = recalculate_payment_2(Invoice.objects.filter(user=self.user))
+        self.assertEqual(updated, 5)
+        for invoice in self.invoices:
+            invoice.refresh_from_db()
+            self.assertEqual(invoice.payment_2, self.expected(invoice), invoice.invoice_number)
+        self.assertEqual(Invoice.objects.get(invoice_number='LATE').payment_2, Decimal('19.73'))
+        self.untouched.refresh_from_db()
+        self.assertEqual(self.untouched.payment_2, Decimal('999.99'))
+
+    def test_python_fallback_matches_the_database_update(self):
+        queryset = Invoice.objects.filter(user=self.user)
+        _recalculate_in_python(queryset, batch_size=2)
+        fallback = dict(queryset.values_list('invoice_number', 'payment_2'))
+        recalculate_payment_2(queryset)
+        self.assertEqual(dict(queryset.values_list('invoice_number', 'payment_2')), fallback)
+
+    def test_command_limits_to_user_and_month(self):
+        make_invoice(self.user, invoice_number='JUNE', invoice_date=date(2025, 6, 1),
+                     payment_1=Decimal('1050.00'), payment_date_1=date(2025, 8, 1), payment_2=Decimal('5.00'))
+        out = io.StringIO()
+        call_command('recalculate_payment_2', user='owner', month='2025-05', stdout=out)
+        self.assertIn('5 invoice(s)', out.getvalue())
+        self.assertEqual(Invoice.objects.get(invoice_number='JUNE').payment_2, Decimal('5.00'))
+
+    def test_partial_payment_2_settlement_survives_recalculation(self):
+        late = Invoice.objects.get(invoice_number='LATE')
+        Invoice.objects.filter(pk=late.pk).update(payment_2=Decimal('19.73'))
+        settle_payment_2(late.pk, self.user.pk, Decimal('5.00'))
+        queryset = Invoice.objects.filter(pk=late.pk)
+        for recalculate in (recalculate_payment_2, lambda invoices: _recalculate_in_python(invoices, None)):
+            recalculate(queryset)
+            late.refresh_from_db()
+            self.assertEqual(late.payment_2, Decimal('14.73'))
+            self.assertEqual(late.payment_2_collected, Decimal('5.00'))
+        # Collecting the rest settles it; a recalculation keeps it at zero
+        settle_payment_2(late.pk, self.user.pk, Decimal('14.73'))
+        recalculate_payment_2(queryset)
+        late.refresh_from_db()
+        self.assertEqual((late.payment_2, late.settled_payment_2), (Decimal('0.00'), True))
+
+    def test_recalculation_bumps_the_month_version(self):
+        before = month_version(self.user.pk, date(2025, 5, 1))
+        recalculate_payment_2(Invoice.objects.filter(user=self.user))
+        self.assertGreater(month_version(self.user.pk, date(2025, 5, 1)), before)
+
+
+class InterestAnnotationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='secret', is_staff=True, is_superuser=True)
+        self.client.force_login(self.user)
+        self.late = make_invoice(self.user, invoice_number='LATE', payment_1=Decimal('1050.00'),
+                                 payment_date_1=date(2025, 7, 19))
+        self.overdue = make_invoice(self.user, invoice_number='OVERDUE', due_date=date(2025, 6, 1))
+        self.paid = make_invoice(self.user, invoice_number='PAID', due_date=date(2025, 6, 1),
+                                 balance=Decimal('0.00'))
+
+    def test_annotations_are_computed_in_the_database(self):
+        invoices = {
+            invoice.invoice_number: invoice
+            for invoice in Invoice.objects.with_days_diff().with_days_after_dhara()
+            .with_interest().with_days_overdue(today=date(2025, 6, 11))
+        }
+        late = invoices['LATE']
+        self.assertEqual((late.days_diff, late.days_after_dhara), (70, 40))
+        self.assertEqual(late.accrued_interest, Decimal('19.73'))
+        self.assertEqual(late.days_overdue, 1)
+        self.assertIsNone(invoices['OVERDUE'].days_diff)
+        self.assertIsNone(invoices['OVERDUE'].accrued_interest)
+        self.assertEqual(invoices['OVERDUE'].days_overdue, 10)
+        self.assertEqual(invoices['PAID'].days_overdue, 0)
+
+    def test_overdue_filter_and_ordering(self):
+        overdue = Invoice.objects.overdue(today=date(2025, 6, 11)).order_by('-days_overdue')
+        self.assertEqual([invoice.invoice_number for invoice in overdue], ['OVERDUE', 'LATE'])
+        self.assertEqual(
+            Invoice.objects.with_interest().filter(accrued_interest__gt=0).get().pk, self.late.pk
+        )
+
+    def test_list_view_overdue_filter(self):
+        response = self.client.get(reverse('Recorder:invoice_list'), {'payment_status': 'overdue'})
+        self.assertEqual({invoice.invoice_number for invoice in response.context['page_obj']}, {'LATE', 'OVERDUE'})
+
+    def test_detail_view_uses_annotations(self):
+        response = self.client.get(reverse('Recorder:invoice_detail', args=[self.late.pk]))
+        self.assertEqual(response.context['days_diff'], 70)
+        self.assertEqual(response.context['days_minus_dhara'], 40)
+        self.assertEqual(response.context['payment_2'], Decimal('19.73'))
+
+    def test_admin_sorts_by_days_overdue(self):
+        url = reverse('admin:Recorder_invoice_changelist')
+        # Column 8 is days_overdue (the action checkbox is column 0)
+        response = self.client.get(url, {'o': '-8', 'overdue': '1'})
+        self.assertEqual(response.status_code, 200)
+        numbers = [invoice.invoice_number for invoice in response.context['cl'].result_list]
+        self.assertEqual(numbers, ['OVERDUE', 'LATE'])
+
+
+class FullTextSearchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='secret', is_staff=True, is_superuser=True)
+        self.other = User.objects.create_user('other', password='secret')
+        self.client.force_login(self.user)
+        self.shree = make_invoice(self.user, invoice_number='SH-100', party='Shree Traders')
+        self.silk = make_invoice(self.user, invoice_number='INV-200', party='Mehta Sons', quality='Shreeji Silk')
+        self.foreign = make_invoice(self.other, invoice_number='SH-300', party='Shree Traders')
+
+    def numbers(self, queryset):
+        return [invoice.invoice_number for invoice in queryset]
+
+    def test_prefix_match_across_fields_for_one_user(self):
+        mine = Invoice.objects.filter(user=self.user)
+        self.assertEqual(
+            set(self.numbers(search_invoices(mine, 'shr', user_id=self.user.pk))), {'SH-100', 'INV-200'}
+        )
+        self.assertEqual(self.numbers(search_invoices(mine, 'shree trad', user_id=self.user.pk)), ['SH-100'])
+        self.assertEqual(self.numbers(search_invoices(mine, 'inv 200', user_id=self.user.pk)), ['INV-200'])
+        self.assertEqual(self.numbers(search_invoices(mine, 'acme', user_id=self.other.pk)), [])
+
+    def test_ranking_prefers_stronger_fields(self):
+        results = search_invoices(Invoice.objects.filter(user=self.user), 'shree', user_id=self.user.pk, rank=True)
+        self.assertEqual(self.numbers(results), ['SH-100', 'INV-200'])
+        self.assertGreater(results[0].search_rank, results[1].search_rank)
+
+    def test_index_follows_saves_deletes_and_bulk_imports(self):
+        mine = Invoice.objects.filter(user=self.user)
+        self.shree.party = 'Ganesh Fabrics'
+        self.shree.save()
+        self.assertEqual(self.numbers(search_invoices(mine, 'ganesh')), ['SH-100'])
+        self.assertEqual(self.numbers(search_invoices(mine, 'shree trad')), [])
+
+        self.silk.delete()
+        self.assertEqual(self.numbers(search_invoices(mine, 'shreeji')), [])
+
+        import_invoices(self.user, [dict(zip(CSV_HEADER.split(','), [
+            'Acme', 'Linen', '2025-05-11', 'BULK-1', 'Kapoor Mills', '1', '1', '2025-06-10', '1', '1', '1', '', '', '',
+        ]))])
+        self.assertEqual(self.numbers(search_invoices(mine, 'kapoor', user_id=self.user.pk)), ['BULK-1'])
+
+    def test_filter_links_keep_the_search_without_a_month(self):
+        url = reverse('Recorder:invoice_list')
+        response = self.client.get(url, {'q': 'shree traders', 'party_search': 'mehta'})
+        content = response.content.decode()
+        self.assertIn(f'href="{url}?q=shree+traders&amp;party_search=mehta&amp;payment_status=pending"', content)
+        # Clearing one search keeps the other
+        self.assertIn(f'href="{url}?party_search=mehta"', content)
+        self.assertIn(f'href="{url}?q=shree+traders"', content)
+        self.assertNotIn(f'{url}&', content)
+
+    def test_list_view_and_admin_search(self):
+        response = self.client.get(reverse('Recorder:invoice_list'), {'q': 'shreeji'})
+        self.assertEqual(self.numbers(response.context['page_obj']), ['INV-200'])
+
+        response = self.client.get(reverse('admin:Recorder_invoice_changelist'), {'q': 'shree'})
+        numbers = self.numbers(response.context['cl'].result_list)
+        # Party matches outrank the quality match
+        self.assertEqual(set(numbers[:2]), {'SH-100', 'SH-300'})
+        self.assertEqual(numbers[2:], ['INV-200'])
+
+
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class AgingReportTests(TestCase):
+    today = date(2025, 9, 1)
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('owner', password='secret')
+        self.client.force_login(self.user)
+        for number, party, due_date, balance in [
+            ('A1', 'Shree Traders', date(2025, 9, 1), '100.00'),    # due today: current
+            ('A2', 'Shree Traders', date(2025, 8, 2), '200.00'),    # 30 days
+            ('A3', 'Shree Traders', date(2025, 8, 1), '300.00'),    # 31 days
+            ('A4', 'Shree Traders', date(2025, 6, 3), '400.00'),    # 90 days
+            ('A5', 'Shree Traders', date(2025, 6, 2), '500.00'),    # 91 days
+            ('B1', 'Mehta Sons', date(2025, 7, 15), '50.00'),       # 48 days
+            ('B2', 'Mehta Sons', date(2025, 7, 15), '0.00'),        # settled
+        ]:
+            make_invoice(self.user, invoice_number=number, party=party, due_date=due_date, balance=Decimal(balance))
+
+    def test_buckets_come_from_one_grouped_query(self):
+        with self.assertNumQueries(1):
+            report = aging_report(self.user.pk, today=self.today)
+        shree, mehta = report['rows']
+        self.assertEqual(shree['party'], 'Shree Traders')
+        self.assertEqual(
+            [shree[field] for field in ('current', 'days_1_30', 'days_31_60', 'days_61_90', 'days_over_90', 'total')],
+            [Decimal('100.00'), Decimal('200.00'), Decimal('300.00'), Decimal('400.00'), Decimal('500.00'),
+             Decimal('1500.00')],
+        )
+        self.assertEqual((mehta['invoice_count'], mehta['days_31_60']), (1, Decimal('50.00')))
+        self.assertEqual(report['totals']['total'], Decimal('1550.00'))
+
+    def test_cached_until_an_invoice_changes(self):
+        aging_report(self.user.pk, today=self.today)
+        with self.assertNumQueries(0):
+            aging_report(self.user.pk, today=self.today)
+
+        Invoice.objects.get(invoice_number='B1').delete()
+        report = aging_report(self.user.pk, today=self.today)
+        self.assertEqual([row['party'] for row in report['rows']], ['Shree Traders'])
+
+    def test_csv_export(self):
+        response = self.client.get(reverse('Recorder:aging_report_csv'))
+        lines = response.content.decode().splitlines()
+        self.assertEqual(lines[0], 'Party,Invoices,Current,1-30 Days,31-60 Days,61-90 Days,90+ Days,Total')
+        self.assertEqual(lines[-1].split(',')[0], 'Total')
+        self.assertEqual(lines[-1].split(',')[-1], '1550.00')
+        self.assertEqual(self.client.get(reverse('Recorder:aging_report')).status_code, 200)
+
+
+class InvoiceApiTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='secret')
+        self.client.force_login(self.user)
+        self.invoices = [
+            make_invoice(self.user, invoice_number=f'API-{i}', invoice_date=date(2025, 5, 1 + i),
+                         balance=Decimal('0.00') if i == 0 else Decimal('500.00'))
+            for i in range(3)
+        ]
+        make_invoice(self.user, invoice_number='JUNE', invoice_date=date(2025, 6, 1))
+
+    def test_list_is_filtered_and_cursor_paginated(self):
+        url = reverse('Recorder:api_invoice_list')
+        params = {'month': '2025-05', 'payment_status': 'pending', 'page_size': 1}
+        first = self.client.get(url, params).json()
+        self.assertEqual([row['invoice_number'] for row in first['results']], ['API-2'])
+        self.assertEqual(first['results'][0]['balance'], '500.00')
+        second = self.client.get(url, dict(params, cursor=first['next_cursor'])).json()
+        self.assertEqual([row['invoice_number'] for row in second['results']], ['API-1'])
+        self.assertIsNone(second['next_cursor'])
+        self.assertEqual(self.client.get(url, {'month': 'bad'}).status_code, 400)
+
+    def test_unchanged_list_poll_gets_304(self):
+        url = reverse('Recorder:api_invoice_list')
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertIn('Last-Modified', response)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.invoices[1].party = 'Changed'
+        self.invoices[1].save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        etag = self.client.get(url)['ETag']
+        self.invoices[2].delete()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_detail_and_summary(self):
+        invoice = self.invoices[1]
+        url = reverse('Recorder:api_invoice_detail', args=[invoice.pk])
+        response = self.client.get(url)
+        self.assertEqual(response.json()['invoice_number'], 'API-1')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertEqual(self.client.get(reverse('Recorder:api_invoice_detail', args=[0])).status_code, 404)
+
+        summary = self.client.get(reverse('Recorder:api_summary'), {'month': '2025-05'})
+        self.assertEqual(summary.json()['pending_count'], 2)
+        self.assertEqual(
+            self.client.get(reverse('Recorder:api_summary'), {'month': '2025-05'},
+                            HTTP_IF_NONE_MATCH=summary['ETag']).status_code,
+            304,
+        )
+
+    def test_requires_login(self):
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('Recorder:api_invoice_list')).status_code, 401)
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        metrics_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(metrics_dir.cleanup)
+        self.metrics_dir = metrics_dir.name
+        self.settings_override = override_settings(
+            METRICS_ENABLED=True, METRICS_DIR=self.metrics_dir, METRICS_FLUSH_INTERVAL=0,
+        )
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        metrics.registry.series.clear()
+        self.user = User.objects.create_user('owner', password='secret')
+        self.client.force_login(self.user)
+        make_invoice(self.user)
+
+    def scrape(self, **headers):
+        response = self.client.get('/metrics', **headers)
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    def test_requests_are_recorded_per_view(self):
+        self.client.get(reverse('Recorder:invoice_list'))
+        body = self.scrape()
+        self.assertIn('# TYPE recorder_request_duration_seconds histogram', body)
+        self.assertIn('recorder_request_duration_seconds_count{view="Recorder:invoice_list"} 1', body)
+        self.assertIn('recorder_request_queries_bucket{view="Recorder:invoice_list",le="+Inf"} 1', body)
+        self.assertIn('recorder_response_size_bytes_count{view="Recorder:invoice_list"} 1', body)
+
+    def test_files_from_other_workers_are_merged(self):
+        self.client.get(reverse('Recorder:invoice_list'))
+        metrics.registry.flush(force=True)
+        with open(metrics.process_file(metrics.registry.key)) as source:
+            series = source.read()
+        with open(metrics.process_file((os.getppid(), 'beef')), 'w') as target:
+            target.write(series)
+        self.assertIn('recorder_request_duration_seconds_count{view="Recorder:invoice_list"} 2', self.scrape())
+
+    @skipUnless(metrics.fcntl, 'Files are only retired where fcntl is available')
+    def test_files_of_exited_workers_are_retired(self):
+        self.client.get(reverse('Recorder:invoice_list'))
+        metrics.registry.flush(force=True)
+        with open(metrics.process_file(metrics.registry.key)) as source:
+            series = source.read()
+        exited = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'], capture_output=True)
+        dead_files = [
+            metrics.process_file((int(exited.stdout), 'beef')),
+            # An earlier process that had this process's pid
+            metrics.process_file((os.getpid(), 'dead')),
+        ]
+        for path in dead_files:
+            with open(path, 'w') as target:
+                target.write(series)
+            os.utime(path, (0, 0))
+
+        for _ in range(2):
+            self.assertIn('recorder_request_duration_seconds_count{view="Recorder:invoice_list"} 3', self.scrape())
+        self.assertFalse([path for path in dead_files if os.path.exists(path)])
+        self.assertEqual(
+            sorted(os.listdir(self.metrics_dir)),
+            sorted(['metrics.lock', 'retired.json', os.path.basename(metrics.process_file(metrics.registry.key))]),
+        )
+
+    def test_streamed_bodies_are_measured(self):
+        view = 'Recorder:generate_csv'
+        series = metrics.registry.series
+        response = self.client.get(reverse(view), {'month': '2025-05'})
+        # Nothing is recorded until the body has been produced
+        self.assertNotIn(f'view="{view}"', self.scrape())
+        # A client that disconnects before the body: only the view's own queries
+        response.close()
+        view_queries = series[('recorder_request_queries', view)]['sum']
+        self.assertEqual(series[('recorder_response_size_bytes', view)]['sum'], 0)
+
+        response = self.client.get(reverse(view), {'month': '2025-05'})
+        with CaptureQueriesContext(connection) as streamed:
+            body = b''.join(response.streaming_content)
+        self.assertTrue(streamed)
+        self.assertEqual(series[('recorder_request_queries', view)]['sum'], 2 * view_queries + len(streamed))
+        self.assertEqual(series[('recorder_response_size_bytes', view)]['sum'], len(body))
+
+    @override_settings(SLOW_REQUEST_THRESHOLD_MS=0)
+    def test_slow_requests_are_logged_with_sql(self):
+        with self.assertLogs('Recorder.metrics', level='WARNING') as logs:
+            self.client.get(reverse('Recorder:invoice_list'))
+        self.assertIn('Slow request: GET /', logs.output[0])
+        self.assertIn('Recorder_invoice', logs.output[0])
+
+    @override_settings(METRICS_TOKEN='s3cret')
+    def test_token_protects_the_endpoint(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.scrape(HTTP_AUTHORIZATION='Bearer s3cret')
+
+    def test_async_requests_are_recorded_with_their_queries(self):
+        self.async_client.force_login(self.user)
+
+        async def get():
+            return await self.async_client.get(reverse('Recorder:invoice_list'))
+        response = async_to_sync(get)()
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(metrics.registry.series[('recorder_request_queries', 'Recorder:invoice_list')]['sum'], 0)
+
+    @override_settings(METRICS_ENABLED=False)
+    def test_disabled_metrics_record_and_serve_nothing(self):
+        self.client.get(reverse('Recorder:invoice_list'))
+        self.assertFalse(metrics.registry.series)
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+
+
+class DatasetAndBenchmarkTests(TestCase):
+    def test_generated_dataset_is_summarised_and_searchable(self):
+        call_command(
+            'generate_invoices', users=2, parties=5, months=3, invoices_per_month=20, seed=1,
+            stdout=io.StringIO(),
+        )
+        user = User.objects.get(username='bench_1')
+        invoices = Invoice.objects.filter(user=user)
+        self.assertEqual(invoices.count(), 60)
+        self.assertEqual(len(set(invoices.values_list('invoice_number', flat=True))), 60)
+        self.assertEqual(len(set(invoices.values_list('party', flat=True))), 5)
+        self.assertEqual(user_summary(user), summarize(invoices))
+        party = invoices.first().party
+        self.assertTrue(search_invoices(invoices, party, user_id=user.pk).exists())
+
+    def test_benchmark_reports_json_and_rolls_back(self):
+        call_command('generate_invoices', parties=5, months=2, invoices_per_month=10, seed=2, stdout=io.StringIO())
+        before = Invoice.objects.count()
+        out = io.StringIO()
+        call_command('benchmark', iterations=1, warmup=0, upload_rows=5, stdout=out)
+        report = json.loads(out.getvalue())
+        names = {result['name'] for result in report['results']}
+        self.assertTrue({'invoice_list.pending', 'invoice_detail', 'generate_csv', 'invoice_csv_upload'} <= names)
+        self.assertTrue(all(result['status'] in (200, 302) for result in report['results']))
+        self.assertEqual(report['dataset']['invoices'], before)
+        self.assertEqual(Invoice.objects.count(), before)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class ResultCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('owner', password='secret')
+        self.other = User.objects.create_user('other', password='secret')
+        self.client.force_login(self.user)
+        self.may = make_invoice(self.user, invoice_number='MAY', invoice_date=date(2025, 5, 10))
+        self.june = make_invoice(self.user, invoice_number='JUNE', invoice_date=date(2025, 6, 10))
+
+    def test_month_entries_survive_changes_to_other_months(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return len(calls)
+
+        self.assertEqual(cached(self.user.pk, 'probe', compute, month=date(2025, 5, 1)), 1)
+        self.assertEqual(cached(self.user.pk, 'probe', compute, month=date(2025, 5, 20)), 1)
+        self.assertEqual(cached(self.user.pk, 'probe', compute), 2)
+
+        self.june.party = 'Changed'
+        self.june.save()
+        # June changed: May's entry stands, the user-wide entry is recomputed
+        self.assertEqual(cached(self.user.pk, 'probe', compute, month=date(2025, 5, 1)), 1)
+        self.assertEqual(cached(self.user.pk, 'probe', compute), 3)
+
+        # Other users' changes never touch this user's entries
+        make_invoice(self.other, invoice_number='OTHER', invoice_date=date(2025, 5, 3))
+        self.assertEqual(cached(self.user.pk, 'probe', compute, month=date(2025, 5, 1)), 1)
+
+    def test_moving_an_invoice_invalidates_both_months(self):
+        compute = lambda: Invoice.objects.filter(user=self.user).for_month(date(2025, 6, 1)).count()
+        self.assertEqual(cached(self.user.pk, 'count', compute, month=date(2025, 6, 1)), 1)
+        self.may.invoice_date = date(2025, 6, 12)
+        self.may.save()
+        self.assertEqual(cached(self.user.pk, 'count', compute, month=date(2025, 6, 1)), 2)
+
+    def test_invoice_list_months_and_summary_are_cached(self):
+        url = reverse('Recorder:invoice_list')
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        sql = ' '.join(query['sql'] for query in queries.captured_queries)
+        self.assertNotIn('Recorder_monthlysummary', sql)
+        self.assertEqual(list(response.context['months']), ['2025-06', '2025-05'])
+
+        make_invoice(self.user, invoice_number='JULY', invoice_date=date(2025, 7, 1))
+        response = self.client.get(url)
+        self.assertEqual(list(response.context['months']), ['2025-07', '2025-06', '2025-05'])
+        self.assertEqual(response.context['summary_stats']['invoice_count'], 3)
+
+
+class SettlementTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='secret')
+        self.client.force_login(self.user)
+        self.invoice = make_invoice(self.user, payment_2=Decimal('50.00'))
+
+    def test_settle_payment_1_updates_balance_and_summary(self):
+        url = reverse('Recorder:settle_payment_1', args=[self.invoice.pk])
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(url, {'amount': '400.00'})
+        update = next(q['sql'] for q in queries.captured_queries if q['sql'].startswith('UPDATE "Recorder_invoice"'))
+        self.assertNotIn('"party"', update)
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.balance, Decimal('600.00'))
+
+        self.assertEqual(settle_payment_1(self.invoice.pk, self.user.pk, Decimal('600.00')), Decimal('0.00'))
+        summary = MonthlySummary.objects.get(user=self.user)
+        self.assertEqual((summary.pending_count, summary.payment_1_settled_count), (0, 1))
+        self.assertEqual(summary.total_balance, Decimal('0.00'))
+
+    def test_over_settlement_is_refused(self):
+        with self.assertRaisesMessage(SettlementError, 'cannot exceed current balance (1000.00)'):
+            settle_payment_1(self.invoice.pk, self.user.pk, Decimal('1000.01'))
+        response = self.client.post(
+            reverse('Recorder:settle_payment_2', args=[self.invoice.pk]), {'amount': '60'}, follow=True,
+        )
+        self.assertIn('cannot exceed remaining Payment 2 amount (50.00)',
+                      [str(m) for m in get_messages(response.wsgi_request)][0])
+        self.invoice.refresh_from_db()
+        self.assertEqual((self.invoice.balance, self.invoice.payment_2), (Decimal('1000.00'), Decimal('50.00')))
+
+    def test_settle_payment_2_marks_settled_when_cleared(self):
+        settle_payment_1(self.invoice.pk, self.user.pk, Decimal('1000.00'))
+        self.assertEqual(settle_payment_2(self.invoice.pk, self.user.pk, Decimal('20.00')), Decimal('30.00'))
+        self.assertEqual(settle_payment_2(self.invoice.pk, self.user.pk, Decimal('30.00')), Decimal('0.00'))
+        self.invoice.refresh_from_db()
+        self.assertTrue(self.invoice.settled_payment_2)
+        self.assertEqual(MonthlySummary.objects.get(user=self.user).both_settled_count, 1)
+        with self.assertRaisesMessage(SettlementError, 'already settled'):
+            settle_payment_2(self.invoice.pk, self.user.pk, Decimal('0.01'))
+
+    def test_other_users_invoice_is_not_found(self):
+        other = User.objects.create_user('other', password='secret')
+        self.client.force_login(other)
+        response = self.client.post(reverse('Recorder:settle_payment_1', args=[self.invoice.pk]), {'amount': '1'})
+        self.assertEqual(response.status_code, 404)
+
+
+class ConcurrentSettlementTests(TransactionTestCase):
+    def test_concurrent_settlements_never_over_settle(self):
+        user = User.objects.create_user('owner', password='secret')
+        invoice = make_invoice(user, balance=Decimal('10.00'))
+        workers, attempts = 8, 5
+        start = threading.Barrier(workers)
+        applied = []
+        lock = threading.Lock()
+
+        def settle():
+            start.wait()
+            try:
+                for _ in range(attempts):
+                    while True:
+                        try:
+                            settle_payment_1(invoice.pk, user.pk, Decimal('0.30'))
+                        except SettlementError:
+                            pass
+                        except OperationalError:
+                            # SQLite's shared in-memory test database refuses
+                            # concurrent writers outright; try again
+                            continue
+                        else:
+                            with lock:
+                                applied.append(Decimal('0.30'))
+                        break
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=settle) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        invoice.refresh_from_db()
+        # 40 attempts at 0.30 against 10.00: exactly 33 fit
+        self.assertEqual(len(applied), 33)
+        self.assertEqual(invoice.balance, Decimal('10.00') - sum(applied))
+        self.assertEqual(MonthlySummary.objects.get(user=user).total_balance, invoice.balance)
+
+
+class ReceiptSettlementTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='secret')
+        self.client.force_login(self.user)
+        make_invoice(self.user, invoice_number='A1', balance=Decimal('500.00'))
+        make_invoice(self.user, invoice_number='A2', balance=Decimal('800.00'), invoice_date=date(2025, 6, 3))
+        make_invoice(self.user, invoice_number='B1', party='Lakshmi Mills')
+        make_invoice(self.user, invoice_number='B2', party='Om Fabrics')
+
+    def receipt_file(self, *rows):
+        content = 'invoice_number,party,amount\n' + '\n'.join(rows) + '\n'
+        return SimpleUploadedFile('receipts.csv', content.encode(), content_type='text/csv')
+
+    def test_reconciliation(self):
+        response = self.client.post(reverse('Recorder:settlement_upload'), {'receipt_file': self.receipt_file(
+            'A1,,500.00',
+            'A2,,"300.00"',
+            'A2,,600.00',
+            'B1,Om Fabrics,10.00',
+            'B2,Om Fabrics,"1,000.00"',
+            'MISSING,,5.00',
+            'A1,,abc',
+        )})
+        result = response.context['result']
+        self.assertEqual(
+            [(line['invoice_number'], line['status']) for line in result.lines],
+            [('A1', 'applied'), ('A2', 'partial'), ('A2', 'overpayment'), ('B1', 'unmatched'),
+             ('B2', 'applied'), ('MISSING', 'unmatched'), ('A1', 'error')],
+        )
+        self.assertEqual(result.lines[2]['balance'], Decimal('500.00'))
+        summary = {line['status']: (line['count'], line['amount']) for line in result.summary}
+        self.assertEqual(summary['applied'], (2, Decimal('1500.00')))
+        self.assertEqual(summary['unmatched'], (2, Decimal('15.00')))
+
+        balances = dict(Invoice.objects.filter(user=self.user, party__in=['Lakshmi Mills', 'Om Fabrics']).values_list('party', 'balance'))
+        self.assertEqual(balances, {'Lakshmi Mills': Decimal('1000.00'), 'Om Fabrics': Decimal('0.00')})
+        self.assertEqual(Invoice.objects.get(invoice_number='A2').balance, Decimal('500.00'))
+        self.assertEqual(MonthlySummary.objects.get(user=self.user, month=date(2025, 5, 1)).payment_1_settled_count, 2)
+
+    def test_one_lookup_and_one_update_per_batch(self):
+        rows = [{'invoice_number': number, 'amount': '1'} for number in ('A1', 'A2')] * 3
+        with CaptureQueriesContext(connection) as queries:
+            apply_receipts(self.user, rows, batch_size=3)
+        invoice_queries = [q['sql'] for q in queries.captured_queries if '"Recorder_invoice"' in q['sql'].split(' WHERE')[0]]
+        self.assertEqual(len([sql for sql in invoice_queries if sql.startswith('SELECT') and ' IN (' in sql]), 2)
+        self.assertEqual(len([sql for sql in invoice_queries if sql.startswith('UPDATE')]), 2)
+        self.assertEqual(Invoice.objects.get(invoice_number='A1').balance, Decimal('497.00'))
+
+    def test_missing_columns_are_rejected(self):
+        upload = SimpleUploadedFile('receipts.csv', b'invoice_number\nA1\n', content_type='text/csv')
+        response = self.client.post(reverse('Recorder:settlement_upload'), {'receipt_file': upload}, follow=True)
+        self.assertIn('Missing required fields: amount', [str(m) for m in get_messages(response.wsgi_request)])
+
+
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='secret')
+        for n in range(5):
+            make_invoice(self.user, invoice_number=f'INV-{n}', invoice_date=date(2025, 5, n + 1),
+                         balance=Decimal('0.00') if n % 2 else Decimal('1000.00'))
+
+    def call(self, module, name, path, data=None, **kwargs):
+        factory = AsyncRequestFactory() if module is async_views else RequestFactory()
+        request = prepared_request(factory, self.user, path, data)
+        view = getattr(module, name)
+        return async_to_sync(view)(request, **kwargs) if module is async_views else view(request, **kwargs)
+
+    def content(self, response):
+        if not response.streaming:
+            return response.content
+        if not response.is_async:
+            return b''.join(response.streaming_content)
+
+        async def collect():
+            return b''.join([chunk async for chunk in response.streaming_content])
+        return async_to_sync(collect)()
+
+    def test_list_and_detail_match_sync_views(self):
+        path = reverse('Recorder:invoice_list')
+        data = {'month': '2025-05', 'payment_status': 'pending', 'page_size': '2'}
+        responses = [self.call(module, 'invoice_list', path, data) for module in (views, async_views)]
+        for response in responses:
+            self.assertEqual(response.status_code, 200)
+        sync_html, async_html = (response.content.decode() for response in responses)
+        self.assertInHTML('<td>INV-4</td>', async_html, count=1)
+        self.assertEqual(sync_html.count('INV-'), async_html.count('INV-'))
+
+        invoice = Invoice.objects.get(invoice_number='INV-1')
+        path = reverse('Recorder:invoice_detail', args=[invoice.pk])
+        response = self.call(async_views, 'invoice_detail', path, pk=invoice.pk)
+        self.assertContains(response, 'INV-1')
+
+    def test_exports_match_sync_views(self):
+        path = reverse('Recorder:generate_csv')
+        sync_csv, async_csv = (
+            self.content(self.call(module, 'generate_csv', path, {'month': '2025-05'}))
+            for module in (views, async_views)
+        )
+        self.assertEqual(sync_csv, async_csv)
+        self.assertEqual(async_csv.decode().count('\r\n'), 7)
+
+        path = reverse('Recorder:download_csv', args=['2025-05'])
+        with tempfile.TemporaryDirectory() as report_dir, override_settings(INVOICE_EXCEL_DIR=report_dir):
+            download = self.call(async_views, 'download_csv', path, year_month='2025-05')
+            self.assertEqual(int(download['Content-Length']), len(sync_csv))
+            self.assertEqual(self.content(download), sync_csv)
+
+    def test_anonymous_requests_are_sent_to_login(self):
+        request = AsyncRequestFactory().get(reverse('Recorder:invoice_list'))
+        request.user = AnonymousUser()
+        response = async_to_sync(async_views.invoice_list)(request)
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response.url.startswith(reverse('Recorder:login')))
+
+    def test_concurrent_export_benchmark(self):
+        result = run_concurrent_exports(self.user, clients=3, client_delay=0)
+        self.assertEqual(result['clients'], 3)
+        # Both handlers served the whole export, past the login check
+        self.client.force_login(self.user)
+        export = self.client.get(reverse('Recorder:generate_csv'), {'month': result['month']})
+        self.assertEqual(result['export_bytes'], len(self.content(export)))
+
+    async def test_static_files_are_served_to_async_requests(self):
+        response = await self.async_client.get('/static/admin/css/autocomplete.css')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/css; charset="utf-8"')
+
+    def test_middleware_is_async_capable(self):
+        # One sync-only middleware makes Django run the async views through async_to_sync
+        sync_only = [path for path in settings.MIDDLEWARE if not getattr(import_string(path), 'async_capable', False)]
+        self.assertEqual(sync_only, [])
+
+
+class SessionWriteTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='secret')
+        self.client.force_login(self.user)
+        make_invoice(self.user)
+
+    def session_writes(self, *args, method='get', **kwargs):
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(*args, **kwargs)
+        writes = [
+            q['sql'] for q in queries.captured_queries
+            if 'django_session' in q['sql'] and not q['sql'].startswith('SELECT')
+        ]
+        return response, writes
+
+    def test_repeated_list_request_does_not_write_the_session(self):
+        url = reverse('Recorder:invoice_list')
+        _, writes = self.session_writes(url, {'month': '2025-05'})
+        self.assertTrue(writes)
+        response, writes = self.session_writes(url, {'month': '2025-05'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(writes, [])
+        _, writes = self.session_writes(url, {'month': '2025-06'})
+        self.assertTrue(writes)
+        self.assertEqual(self.client.session['current_month_filter'], '2025-06')
+
+    @override_settings(CACHES=LOCMEM_CACHE, SESSION_ENGINE='django.contrib.sessions.backends.cached_db')
+    def test_cached_db_sessions_are_read_from_the_cache(self):
+        self.client.force_login(self.user)
+        url = reverse('Recorder:invoice_list')
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([q for q in queries.captured_queries if 'django_session' in q['sql']])
+
+    def test_save_and_add_only_writes_changed_defaults(self):
+        url = reverse('Recorder:invoice_create')
+        data = {
+            'firm': 'Acme Textiles', 'quality': 'Cotton', 'invoice_date': '2025-05-10',
+            'party': 'Shree Traders', 'meter': '100', 'total_amount': '1000',
+            'due_date': '2025-06-10', 'balance': '1000', 'dhara_day': '30', 'taka': '10',
+            'save_and_add': '1',
+        }
+        self.session_writes(url, dict(data, invoice_number='A'), method='post')
+        self.assertEqual(self.client.session['last_firm'], 'Acme Textiles')
+        _, writes = self.session_writes(url, dict(data, invoice_number='B'), method='post')
+        self.assertEqual(writes, [])
+        self.assertEqual(Invoice.objects.filter(invoice_number='B').count(), 1)
+        response = self.client.get(url)
+        self.assertEqual(response.context['form'].initial, {'firm': 'Acme Textiles', 'quality': 'Cotton'})
+
+
+class InvoiceAdminTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='secret', is_staff=True, is_superuser=True)
+        self.client.force_login(self.user)
+        self.url = reverse('admin:Recorder_invoice_changelist')
+        for i in range(5):
+            make_invoice(self.user, invoice_number=f'INV-{i}', firm='Royal Fabrics' if i % 2 else 'Acme Textiles')
+
+    def test_changelist_never_counts_or_lists_firms_over_the_whole_table(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, {'firm': 'Royal Fabrics'})
+        self.assertEqual(len(response.context['cl'].result_list), 2)
+        invoice_queries = [q['sql'] for q in queries.captured_queries if '"Recorder_invoice"' in q['sql']]
+        counts = [sql for sql in invoice_queries if 'COUNT(' in sql]
+        self.assertTrue(counts)
+        self.assertTrue(all('LIMIT' in sql for sql in counts))
+        self.assertFalse([sql for sql in invoice_queries if 'DISTINCT' in sql])
+        self.assertEqual(
+            [choice['display'] for choice in response.context['cl'].filter_specs[1].choices(response.context['cl'])],
+            ['All', 'Acme Textiles', 'Royal Fabrics'],
+        )
+
+    def test_large_counts_are_estimated(self):
+        invoices = Invoice.objects.order_by('pk')
+        with mock.patch.object(EstimatedCountPaginator, 'COUNT_LIMIT', 3):
+            self.assertEqual(EstimatedCountPaginator(invoices, 2).count, invoices.last().pk)
+            capped = EstimatedCountPaginator(invoices.filter(balance__gt=0), 1)
+            self.assertEqual((capped.count, capped.capped), (3, True))
+            # Far enough to know whether the next page exists
+            self.assertEqual(EstimatedCountPaginator(invoices.filter(balance__gt=0), 1, current_page=3).count, 4)
+            self.assertEqual(EstimatedCountPaginator(invoices.filter(firm='Royal Fabrics'), 2).count, 2)
+
+    def test_pages_past_the_count_limit_stay_reachable(self):
+        with mock.patch.object(EstimatedCountPaginator, 'COUNT_LIMIT', 1), \
+                mock.patch.object(InvoiceAdmin, 'list_per_page', 1):
+            response = self.client.get(self.url, {'firm': 'Acme Textiles'})
+            self.assertContains(response, '2+ invoices')
+            self.assertContains(response, 'p=2')
+            response = self.client.get(self.url, {'firm': 'Acme Textiles', 'p': 3})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['cl'].result_list), 1)
+        self.assertContains(response, '3 invoices')
+
+    def test_mark_settled_is_one_update(self):
+        selected = list(Invoice.objects.filter(firm='Acme Textiles').values_list('pk', flat=True))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.url, {'action': 'mark_settled', '_selected_action': selected}, follow=True)
+        self.assertIn('Marked 3 invoice(s) as fully settled.', [str(m) for m in response.context['messages']])
+        updates = [q for q in queries.captured_queries if q['sql'].startswith('UPDATE "Recorder_invoice"')]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(
+            set(Invoice.objects.filter(pk__in=selected).values_list('balance', 'payment_2', 'settled_payment_2')),
+            {(Decimal('0.00'), Decimal('0.00'), True)},
+        )
+        summary = MonthlySummary.objects.get(user=self.user, month=date(2025, 5, 1))
+        self.assertEqual(summary.both_settled_count, 3)
+
+    def test_export_selection(self):
+        selected = list(Invoice.objects.filter(firm='Royal Fabrics').values_list('pk', flat=True))
+        response = self.client.post(self.url, {'action': 'export_csv', '_selected_action': selected})
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="invoices_selected.csv"')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 4)
+        self.assertEqual({line.split(',')[3] for line in lines[1:3]}, {'INV-1', 'INV-3'})
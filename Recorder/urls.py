@@ -1,11 +1,15 @@
 """
 App URL Configuration
 """
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import api, async_views, views
 
 app_name = 'Recorder'
 
+# The read and export hot paths, async when served under ASGI
+read_views = async_views if settings.RECORDER_ASYNC_VIEWS else views
+
 urlpatterns = [
     # Authentication URLs
     path('login/', views.login_view, name='login'),
@@ -13,14 +17,27 @@ urlpatterns = [
     path('logout/', views.logout_view, name='logout'),
     
     # Invoice URLs
-    path('', views.invoice_list, name='invoice_list'),
+    path('', read_views.invoice_list, name='invoice_list'),
     path('invoice/create/', views.invoice_create, name='invoice_create'),
-    path('invoice/<int:pk>/', views.invoice_detail, name='invoice_detail'),
+    path('invoice/<int:pk>/', read_views.invoice_detail, name='invoice_detail'),
     path('invoice/<int:pk>/update/', views.invoice_update, name='invoice_update'),
     path('invoice/<int:pk>/delete/', views.invoice_delete, name='invoice_delete'),
-    path('csv/generate/', views.generate_csv, name='generate_csv'),
-    path('csv/download/<str:year_month>/', views.download_csv, name='download_csv'),
+    path('csv/generate/', read_views.generate_csv, name='generate_csv'),
+    path('csv/download/<str:year_month>/', read_views.download_csv, name='download_csv'),
+    path('xlsx/generate/', views.generate_xlsx, name='generate_xlsx'),
+    path('xlsx/download/<str:year_month>/', views.download_xlsx, name='download_xlsx'),
     path('invoice/<int:pk>/settle-payment-1/', views.settle_payment_1, name='settle_payment_1'),
     path('invoice/<int:pk>/settle-payment-2/', views.settle_payment_2, name='settle_payment_2'),
     path('invoice/csv-upload/', views.invoice_csv_upload, name='invoice_csv_upload'),
+    path('invoice/settlement-upload/', views.settlement_upload, name='settlement_upload'),
+    path('imports/<int:pk>/', views.import_job_detail, name='import_job_detail'),
+    path('imports/<int:pk>/status/', views.import_job_status, name='import_job_status'),
+    path('imports/<int:pk>/errors/', views.import_job_errors, name='import_job_errors'),
+    path('reports/aging/', views.aging_report_view, name='aging_report'),
+    path('reports/aging/csv/', views.aging_report_csv, name='aging_report_csv'),
+    
+    # Read-only JSON API
+    path('api/invoices/', api.invoice_list, name='api_invoice_list'),
+    path('api/invoices/<int:pk>/', api.invoice_detail, name='api_invoice_detail'),
+    path('api/summary/', api.summary, name='api_summary'),
 ]
\ No newline at end of file
@@ -1,20 +1,37 @@
-import os
 import csv
 import calendar
-from datetime import datetime, date
+import logging
+from datetime import date
 from decimal import Decimal, InvalidOperation
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import HttpResponse, JsonResponse
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse
 from django.contrib import messages
 from django.conf import settings
 from django.utils import timezone
-from django.db.models import Sum
-from django.core.paginator import Paginator
 from django.contrib.auth import login, logout, authenticate
 from django.contrib.auth.decorators import login_required
 
-from .models import Invoice
+from . import settlement
+from .aging import AGING_BUCKETS, AMOUNT_FIELDS, aging_report
+from .caching import cached
+from .models import ImportJob, Invoice
 from .forms import InvoiceForm, UserRegistrationForm, UserLoginForm
+from .exports import stream_csv, stream_xlsx
+from .filters import filter_invoices, filter_payment_status
+from .importer import UPLOAD_EXTENSIONS, import_invoices, missing_fields, read_csv, read_upload
+from .jobs import enqueue_import
+from .pagination import paginate_keyset, parse_page_size
+from .receipts import apply_receipts, missing_receipt_fields
+from .reports import get_report, remove_reports
+from .summaries import invoice_months, month_summary, summarize, user_summary
+
+logger = logging.getLogger(__name__)
+
+# Columns rendered by the invoice table in invoice_list.html
+INVOICE_LIST_COLUMNS = (
+    'id', 'invoice_number', 'invoice_date', 'party', 'firm', 'meter',
+    'total_amount', 'balance', 'settled_payment_2',
+)
 
 def register_view(request):
     """Handle user registration"""
@@ -70,6 +87,37 @@ def logout_view(request):
     messages.success(request, 'You have been logged out successfully.')
     return redirect('Recorder:login')
 
+def update_session(session, **values):
+    """
+    Store values in the session, skipping keys that already hold them.
+
+    Assigning to a session key marks it modified even when the value is the
+    same, and a modified session is written back at the end of the request,
+    so repeat page loads would each cost a session UPDATE.
+    """
+    for key, value in values.items():
+        if key not in session or session[key] != value:
+            session[key] = value
+
+def month_choices(user):
+    """The user's invoice months as {'YYYY-MM': 'Month YYYY'}, newest first"""
+    def build():
+        # The monthly summary rows index the months without scanning Invoice
+        return {month.strftime('%Y-%m'): month.strftime('%B %Y') for month in invoice_months(user.pk)}
+    return cached(user.pk, 'months', build)
+
+def list_summary(user, invoices, month, searching):
+    """
+    Summary statistics for the invoice list. Without a search they come
+    straight from the pre-aggregated monthly summary table; otherwise one
+    conditional-aggregation query over the filtered invoices.
+    """
+    if searching:
+        return summarize(invoices)
+    if month:
+        return cached(user.pk, 'summary', lambda: month_summary(user, month), month=month)
+    return cached(user.pk, 'summary', lambda: user_summary(user))
+
 # Add login_required decorator to all views that need authentication
 @login_required(login_url='Recorder:login')
 def invoice_list(request):
@@ -77,71 +125,58 @@ def invoice_list(request):
     Display all invoices with pagination and filtering options
     Allow generating and downloading monthly Excel files
     """
-    # Get all invoices ordered by invoice date for the current user
-    invoices = Invoice.objects.filter(user=request.user).order_by('-invoice_date')
+    # Get all invoices for the current user; ordering is applied by the paginator
+    invoices = Invoice.objects.filter(user=request.user).with_days_overdue()
     
     # Get unique months from invoices for filtering based on invoice_date
-    months = {}
-    for invoice in Invoice.objects.filter(user=request.user).dates('invoice_date', 'month', order='DESC'):
-        month_year = invoice.strftime('%Y-%m')
-        month_name = invoice.strftime('%B %Y')
-        months[month_year] = month_name
+    months = month_choices(request.user)
     
-    # Filter by month if requested
+    # Filter by month, party name and full-text search if requested
     month_filter = request.GET.get('month')
-    if month_filter:
-        year, month = month_filter.split('-')
-        invoices = invoices.filter(invoice_date__year=year, invoice_date__month=month)
-    
-    # Filter by party name if search term is provided
     party_search = request.GET.get('party_search', '').strip()
-    if party_search:
-        invoices = invoices.filter(party__icontains=party_search)
+    search_query = request.GET.get('q', '').strip()
+    try:
+        invoices, month = filter_invoices(invoices, request.GET, request.user.pk)
+    except ValueError:
+        messages.error(request, "Invalid month format. Please use YYYY-MM format.")
+        return redirect('Recorder:invoice_list')
     
     # Calculate summary statistics
-    all_invoices = invoices  # Store the current queryset before payment status filtering
-    total_balance = all_invoices.aggregate(Sum('balance'))['balance__sum'] or 0
-    
-    # Count and sum for different payment statuses
-    pending_invoices = all_invoices.filter(balance__gt=0)
-    payment_1_settled = all_invoices.filter(balance=0, settled_payment_2=False)
-    both_settled = all_invoices.filter(balance=0, settled_payment_2=True)
-    
-    summary_stats = {
-        'pending_count': pending_invoices.count(),
-        'pending_amount': pending_invoices.aggregate(Sum('balance'))['balance__sum'] or 0,
-        'payment_1_settled_count': payment_1_settled.count(),
-        'payment_1_settled_amount': payment_1_settled.aggregate(Sum('total_amount'))['total_amount__sum'] or 0,
-        'both_settled_count': both_settled.count(),
-        'both_settled_amount': both_settled.aggregate(Sum('total_amount'))['total_amount__sum'] or 0,
-        'total_balance': total_balance,
-    }
+    summary_stats = list_summary(request.user, invoices, month, searching=bool(party_search or search_query))
     
     # Filter by payment status
     payment_status = request.GET.get('payment_status')
-    if payment_status:
-        if payment_status == 'both_settled':
-            invoices = invoices.filter(balance=0, settled_payment_2=True)
-        elif payment_status == 'payment_1_settled':
-            invoices = invoices.filter(balance=0, settled_payment_2=False)
-        elif payment_status == 'pending':
-            invoices = invoices.filter(balance__gt=0)
+    invoices = filter_payment_status(invoices, payment_status)
     
-    # Paginate results
-    # paginator = Paginator(invoices, 10)  # Show 10 invoices per page
-    # page_number = request.GET.get('page')
-    # page_obj = paginator.get_page(page_number)
+    # Paginate results with a keyset cursor on (invoice_date, id), fetching
+    # only the columns the invoice table renders
+    page_size = parse_page_size(
+        request.GET.get('page_size'),
+        settings.INVOICE_LIST_PAGE_SIZE,
+        settings.INVOICE_LIST_MAX_PAGE_SIZE,
+    )
+    page_obj = paginate_keyset(
+        invoices.only(*INVOICE_LIST_COLUMNS),
+        cursor=request.GET.get('cursor'),
+        page_size=page_size,
+    )
+    
+    # Keep the active filters on the pagination links
+    filter_params = request.GET.copy()
+    filter_params.pop('cursor', None)
     
     # Store current filter in session
-    request.session['current_month_filter'] = month_filter
+    update_session(request.session, current_month_filter=month_filter)
     
     context = {
-        'page_obj': invoices,
+        'page_obj': page_obj,
+        'filter_query': filter_params.urlencode(),
         'months': months,
         'current_month': month_filter,
         'current_payment_status': payment_status,
         'summary_stats': summary_stats,
         'party_search': party_search,
+        'search_query': search_query,
     }
     return render(request, 'Recorder/invoice_list.html', context)
 
@@ -149,7 +184,7 @@ def invoice_list(request):
 def invoice_create(request):
     """Create a new invoice"""
     if request.method == 'POST':
-        form = InvoiceForm(request.POST)
+        form = InvoiceForm(request.POST, instance=Invoice(user=request.user))
         if form.is_valid():
             # Get form data
             invoice = form.save(commit=False)
@@ -162,17 +197,12 @@ def invoice_create(request):
             # Save the invoice
             invoice.save()
             
-            # Store in session that a new invoice was added this month
-            month_year = invoice.created_at.strftime('%Y-%m')
-            request.session[f'invoice_added_{month_year}'] = True
-            
             messages.success(request, 'Invoice created successfully!')
             
             # If user wants to add another invoice, redirect to empty form
             if 'save_and_add' in request.POST:
                 # Save some form data in session for convenience
-                request.session['last_firm'] = invoice.firm
-                request.session['last_quality'] = invoice.quality
+                update_session(request.session, last_firm=invoice.firm, last_quality=invoice.quality)
                 return redirect('Recorder:invoice_create')
             
             return redirect('Recorder:invoice_list')
@@ -220,23 +250,17 @@ def invoice_delete(request, pk):
     invoice = get_object_or_404(Invoice, pk=pk, user=request.user)
     
     if request.method == 'POST':
-        month_year = invoice.created_at.strftime('%Y-%m')
+        invoice_month = invoice.invoice_date
         invoice.delete()
         messages.success(request, 'Invoice deleted successfully!')
         
         # Check if this was the last invoice for this month
-        remaining = Invoice.objects.filter(
-            user=request.user,
-            created_at__year=invoice.created_at.year, 
-            created_at__month=invoice.created_at.month
-        ).count()
+        remaining = Invoice.objects.filter(user=request.user).for_month(invoice_month).exists()
         
-        if remaining == 0:
-            # Clean up any monthly CSV file
+        if not remaining:
+            # Clean up any stored monthly report files
             try:
-                csv_path = os.path.join(settings.INVOICE_EXCEL_DIR, f'invoices_{month_year}_{request.user.id}.csv')
-                if os.path.exists(csv_path):
-                    os.remove(csv_path)
+                remove_reports(request.user.id, invoice_month)
             except Exception as e:
                 messages.error(request, f'Error cleaning up CSV file: {str(e)}')
         
@@ -248,24 +272,14 @@ def invoice_delete(request, pk):
 @login_required(login_url='Recorder:login')
 def invoice_detail(request, pk):
     """Show invoice details"""
-    invoice = get_object_or_404(Invoice, pk=pk, user=request.user)
-    
-    # Initialize default values
-    days_diff = None
-    days_minus_dhara = None
-    payment_2 = None
-    
-    # Calculate the difference in days between payment_date_1 and invoice_date
-    if invoice.payment_date_1 and invoice.invoice_date:
-        days_diff = (invoice.payment_date_1 - invoice.invoice_date).days
-        
-        # Calculate days_minus_dhara only if dhara_day is provided
-        if invoice.dhara_day is not None:
-            days_minus_dhara = days_diff - invoice.dhara_day
-            
-            # Calculate payment_2 using your formula
-            if invoice.payment_1:
-                payment_2 = (invoice.payment_1 / Decimal('1.05')) * Decimal('0.0004931507') * days_minus_dhara
+    # Day counts and payment 2 are computed by the database
+    invoice = get_object_or_404(
+        Invoice.objects.with_days_diff().with_days_after_dhara().with_interest(),
+        pk=pk, user=request.user,
+    )
+    days_diff = invoice.days_diff
+    days_minus_dhara = invoice.days_after_dhara
+    payment_2 = invoice.accrued_interest
     
     context = {
         'invoice': invoice,
@@ -275,146 +289,126 @@ def invoice_detail(request, pk):
     }
     return render(request, 'Recorder/invoice_detail.html', context)
 
+def _export_month(request):
+    """
+    Read the ?month=YYYY-MM parameter for the export views, defaulting to the
+    current month. Returns (year, month) or None after adding an error message.
+    """
+    month_filter = request.GET.get('month')
+    
+    if not month_filter:
+        month_filter = timezone.now().strftime('%Y-%m')
+    
+    try:
+        year, month = month_filter.split('-')
+        month_num = int(month)
+        if not (1 <= month_num <= 12):
+            raise ValueError("Invalid month number")
+    except (ValueError, IndexError):
+        messages.error(request, "Invalid month format. Please use YYYY-MM format.")
+        return None
+    return year, month
+
+def _month_invoices(request, year, month):
+    """Invoices for the current user in the given month, or None if there are none"""
+    invoices = Invoice.objects.filter(
+        user=request.user
+    ).for_month(date(int(year), int(month), 1))
+    
+    if not invoices.exists():
+        month_name = calendar.month_name[int(month)]
+        messages.warning(request, f'No invoices found for {month_name} {year}')
+        return None
+    return invoices
+
 @login_required(login_url='Recorder:login')
 def generate_csv(request):
     """Generate CSV file for the current month or specified month"""
     try:
-        # Get month from form or use current month
-        month_filter = request.GET.get('month')
-        print(f"Generating CSV for month: {month_filter}")
-        
-        if not month_filter:
-            month_filter = timezone.now().strftime('%Y-%m')
-        
-        try:
-            year, month = month_filter.split('-')
-            month_num = int(month)
-            if not (1 <= month_num <= 12):
-                raise ValueError("Invalid month number")
-        except (ValueError, IndexError):
-            messages.error(request, "Invalid month format. Please use YYYY-MM format.")
+        logger.debug('Generating CSV for month: %s', request.GET.get('month'))
+        export_month = _export_month(request)
+        if export_month is None:
             return redirect('Recorder:invoice_list')
+        year, month = export_month
         
         # Get invoices for the specified month for the current user
-        invoices = Invoice.objects.filter(
-            user=request.user,
-            invoice_date__year=year, 
-            invoice_date__month=month
-        ).order_by('invoice_date')
-        
-        print(f"Found {invoices.count()} invoices for {year}-{month}")
-        
-        if not invoices:
-            month_name = calendar.month_name[month_num]
-            messages.warning(request, f'No invoices found for {month_name} {year}')
+        invoices = _month_invoices(request, year, month)
+        if invoices is None:
             return redirect('Recorder:invoice_list')
         
-        # Create the response object with CSV content type
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = f'attachment; filename="invoices_{year}-{month}.csv"'
-        
-        # Create CSV writer
-        writer = csv.writer(response)
-        
-        # Define columns
-        columns = [
-            'Firm', 'Quality', 'Invoice Date', 'Invoice Number', 'Party', 
-            'Total Amount', 'Due Date', 'Balance', 'Payment Date 1', 
-            'Payment 1', 'Dhara Day', 'Taka', 'Payment Date 2', 'Payment 2', 'Meter'
-        ]
-        
-        # Write headers
-        writer.writerow(columns)
-        
-        # Initialize totals
-        total_amount = Decimal('0')
-        total_balance = Decimal('0')
-        total_payment_1 = Decimal('0')
-        total_taka = Decimal('0')
-        total_payment_2 = Decimal('0')
-        total_meter = Decimal('0')
-        
-        # Write data rows
-        for invoice in invoices:
-            row = [
-                invoice.firm,
-                invoice.quality,
-                invoice.invoice_date.strftime('%Y-%m-%d') if invoice.invoice_date else '',
-                invoice.invoice_number,
-                invoice.party,
-                str(invoice.total_amount),
-                invoice.due_date.strftime('%Y-%m-%d') if invoice.due_date else '',
-                str(invoice.balance),
-                invoice.payment_date_1.strftime('%Y-%m-%d') if invoice.payment_date_1 else '',
-                str(invoice.payment_1) if invoice.payment_1 else '',
-                str(invoice.dhara_day),
-                str(invoice.taka),
-                invoice.payment_date_2.strftime('%Y-%m-%d') if invoice.payment_date_2 else '',
-                str(invoice.payment_2) if invoice.payment_2 else '',
-                str(invoice.meter)
-            ]
-            writer.writerow(row)
+        # Stream the rows as they are read; the totals row is one aggregate
+        return stream_csv(invoices, f'invoices_{year}-{month}.csv')
             
-            # Update totals
-            total_amount += invoice.total_amount or Decimal('0')
-            total_balance += invoice.balance or Decimal('0')
-            total_payment_1 += invoice.payment_1 or Decimal('0')
-            total_taka += invoice.taka or Decimal('0')
-            total_payment_2 += invoice.payment_2 or Decimal('0')
-            total_meter += invoice.meter or Decimal('0')
+    except Exception as e:
+        logger.exception('Error in generate_csv view')
+        messages.error(request, f'Error generating CSV: {str(e)}')
+        return redirect('Recorder:invoice_list')
+
+@login_required(login_url='Recorder:login')
+def generate_xlsx(request):
+    """Generate an Excel workbook for the current month or specified month"""
+    try:
+        export_month = _export_month(request)
+        if export_month is None:
+            return redirect('Recorder:invoice_list')
+        year, month = export_month
         
-        # Write totals row
-        writer.writerow([
-            'Total', '', '', '', '',
-            str(total_amount),
-            '',
-            str(total_balance),
-            '',
-            str(total_payment_1),
-            '',
-            str(total_taka),
-            '',
-            str(total_payment_2),
-            str(total_meter)
-        ])
+        invoices = _month_invoices(request, year, month)
+        if invoices is None:
+            return redirect('Recorder:invoice_list')
         
-        print(f"CSV file generated successfully for {year}-{month}")
-        return response
+        # Rows are flushed to a temporary file as they are written
+        return stream_xlsx(invoices, f'invoices_{year}-{month}.xlsx')
             
     except Exception as e:
-        print(f"Error in generate_csv view: {str(e)}")
-        messages.error(request, f'Error generating CSV: {str(e)}')
+        logger.exception('Error in generate_xlsx view')
+        messages.error(request, f'Error generating Excel file: {str(e)}')
         return redirect('Recorder:invoice_list')
 
+REPORT_CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+def _download_report(request, year_month, fmt):
+    """Serve the stored report for a month, rebuilding it only if it is stale"""
+    year, month = year_month.split('-')
+    invoices = _month_invoices(request, year, month)
+    if invoices is None:
+        return redirect('Recorder:invoice_list')
+    
+    file_path = get_report(request.user.id, date(int(year), int(month), 1), fmt)
+    logger.debug('Serving %s file from: %s', fmt.upper(), file_path)
+    return FileResponse(
+        open(file_path, 'rb'),
+        as_attachment=True,
+        filename=f'invoices_{year_month}.{fmt}',
+        content_type=REPORT_CONTENT_TYPES[fmt],
+    )
+
 @login_required(login_url='Recorder:login')
 def download_csv(request, year_month):
     """Download the CSV file for a specific month"""
     try:
-        year, month = year_month.split('-')
-        file_path = os.path.join(settings.INVOICE_EXCEL_DIR, f'invoices_{year}-{month}_{request.user.id}.csv')
-        print(f"Attempting to download CSV file from: {file_path}")
-        
-        if not os.path.exists(file_path):
-            print(f"CSV file not found at: {file_path}")
-            # Try to generate the file if it doesn't exist
-            return redirect('Recorder:generate_csv')
-        
-        with open(file_path, 'rb') as csv_file:
-            response = HttpResponse(csv_file.read(), content_type='text/csv')
-            response['Content-Disposition'] = f'attachment; filename="invoices_{year_month}.csv"'
-            print(f"Serving CSV file with filename: invoices_{year_month}.csv")
-            return response
-            
+        return _download_report(request, year_month, 'csv')
     except Exception as e:
-        print(f"Error downloading CSV: {str(e)}")
+        logger.exception('Error downloading CSV')
         messages.error(request, f'Error downloading CSV: {str(e)}')
         return redirect('Recorder:invoice_list')
 
+@login_required(login_url='Recorder:login')
+def download_xlsx(request, year_month):
+    """Download the Excel file for a specific month"""
+    try:
+        return _download_report(request, year_month, 'xlsx')
+    except Exception as e:
+        logger.exception('Error downloading Excel file')
+        messages.error(request, f'Error downloading Excel file: {str(e)}')
+        return redirect('Recorder:invoice_list')
+
 @login_required(login_url='Recorder:login')
 def settle_payment_1(request, pk):
     """Handle Payment 1 settlement with amount input"""
-    invoice = get_object_or_404(Invoice, pk=pk, user=request.user)
-
     if request.method == 'POST':
         try:
             amount_str = request.POST.get('amount')
@@ -423,18 +417,13 @@ def settle_payment_1(request, pk):
                 return redirect('Recorder:invoice_detail', pk=pk)
 
             settle_amount = Decimal(amount_str)
-
-            if settle_amount <= 0:
-                messages.error(request, 'Please enter a positive amount.')
-                return redirect('Recorder:invoice_detail', pk=pk)
-
-            if settle_amount > invoice.balance:
-                messages.error(request, f'Settlement amount ({settle_amount}) cannot exceed current balance ({invoice.balance}).')
-                return redirect('Recorder:invoice_detail', pk=pk)
-
-            invoice.balance -= settle_amount
-            invoice.save()
-            messages.success(request, f'₹{settle_amount} has been settled for Payment 1. Remaining balance: ₹{invoice.balance}.')
+            balance = settlement.settle_payment_1(pk, request.user.pk, settle_amount)
+            messages.success(request, f'₹{settle_amount} has been settled for Payment 1. Remaining balance: ₹{balance}.')
+            return redirect('Recorder:invoice_detail', pk=pk)
+        except Invoice.DoesNotExist:
+            raise Http404('No Invoice matches the given query.')
+        except settlement.SettlementError as e:
+            messages.error(request, str(e))
             return redirect('Recorder:invoice_detail', pk=pk)
         except InvalidOperation:
             messages.error(request, 'Invalid amount entered.')
@@ -443,13 +432,12 @@ def settle_payment_1(request, pk):
             messages.error(request, f'An error occurred: {e}')
             return redirect('Recorder:invoice_detail', pk=pk)
 
+    get_object_or_404(Invoice, pk=pk, user=request.user)
     return redirect('Recorder:invoice_detail', pk=pk)
 
 @login_required(login_url='Recorder:login')
 def settle_payment_2(request, pk):
     """Handle Payment 2 settlement with amount input"""
-    invoice = get_object_or_404(Invoice, pk=pk, user=request.user)
-
     if request.method == 'POST':
         try:
             amount_str = request.POST.get('amount')
@@ -458,22 +446,13 @@ def settle_payment_2(request, pk):
                 return redirect('Recorder:invoice_detail', pk=pk)
 
             settle_amount = Decimal(amount_str)
-
-            if settle_amount <= 0:
-                messages.error(request, 'Please enter a positive amount.')
-                return redirect('Recorder:invoice_detail', pk=pk)
-
-            if settle_amount > invoice.payment_2:
-                messages.error(request, f'Settlement amount ({settle_amount}) cannot exceed remaining Payment 2 amount ({invoice.payment_2}).')
-                return redirect('Recorder:invoice_detail', pk=pk)
-
-            invoice.payment_2 -= settle_amount
-            if invoice.payment_2 <= 0:
-                invoice.settled_payment_2 = True
-                invoice.payment_2 = Decimal('0.00') # Ensure it's exactly 0 if fully settled
-
-            invoice.save()
-            messages.success(request, f'₹{settle_amount} has been settled for Payment 2. Remaining Payment 2 amount: ₹{invoice.payment_2}.')
+            payment_2 = settlement.settle_payment_2(pk, request.user.pk, settle_amount)
+            messages.success(request, f'₹{settle_amount} has been settled for Payment 2. Remaining Payment 2 amount: ₹{payment_2}.')
+            return redirect('Recorder:invoice_detail', pk=pk)
+        except Invoice.DoesNotExist:
+            raise Http404('No Invoice matches the given query.')
+        except settlement.SettlementError as e:
+            messages.error(request, str(e))
             return redirect('Recorder:invoice_detail', pk=pk)
         except InvalidOperation:
             messages.error(request, 'Invalid amount entered.')
@@ -482,182 +461,157 @@ def settle_payment_2(request, pk):
             messages.error(request, f'An error occurred: {e}')
             return redirect('Recorder:invoice_detail', pk=pk)
 
+    get_object_or_404(Invoice, pk=pk, user=request.user)
     return redirect('Recorder:invoice_detail', pk=pk)
 
-def parse_indian_number(number_str):
-    """Convert Indian number format (e.g., 2,13,546.00) to Decimal."""
-    try:
-        # Remove all commas and convert to Decimal
-        return Decimal(number_str.replace(',', ''))
-    except (ValueError, InvalidOperation):
-        raise ValueError(f"Invalid number format: {number_str}. Expected format: 2,13,546.00")
-
 @login_required(login_url='Recorder:login')
 def invoice_csv_upload(request):
-    """Handle CSV file upload for creating multiple invoices"""
+    """Handle CSV or .xlsx file upload for creating multiple invoices"""
     if request.method == 'POST':
-        print("POST request received for CSV upload")
+        logger.debug('POST request received for CSV upload')
         if 'csv_file' not in request.FILES:
-            print("No file uploaded")
+            logger.debug('No file uploaded')
             messages.error(request, 'No file uploaded')
             return redirect('Recorder:invoice_csv_upload')
             
         csv_file = request.FILES['csv_file']
-        print(f"File received: {csv_file.name}")
-        if not csv_file.name.endswith('.csv'):
-            print("Invalid file type")
-            messages.error(request, 'Please upload a CSV file')
+        logger.debug('File received: %s', csv_file.name)
+        if not csv_file.name.lower().endswith(UPLOAD_EXTENSIONS):
+            logger.debug('Invalid file type')
+            messages.error(request, 'Please upload a CSV or Excel (.xlsx) file')
             return redirect('Recorder:invoice_csv_upload')
             
         try:
-            # Read CSV file
-            print("Reading CSV file")
-            decoded_file = csv_file.read().decode('utf-8-sig').splitlines()  # Use utf-8-sig to handle BOM
-            reader = csv.DictReader(decoded_file)
-            
-            # Required fields
-            required_fields = [
-                'firm', 'quality', 'invoice_date', 'invoice_number', 'party',
-                'meter', 'total_amount', 'due_date', 'balance', 'dhara_day', 'taka'
-            ]
-            
-            # Optional fields
-            optional_fields = ['payment_date_1', 'payment_1', 'payment_date_2']
+            # Stream the file instead of reading it all into memory
+            logger.debug('Reading uploaded file')
+            reader = read_upload(csv_file, csv_file.name)
             
             # Validate headers
-            print(f"CSV headers: {reader.fieldnames}")
-            if not all(field in reader.fieldnames for field in required_fields):
-                missing_fields = [field for field in required_fields if field not in reader.fieldnames]
-                print(f"Missing required fields: {missing_fields}")
-                messages.error(request, f'Missing required fields: {", ".join(missing_fields)}')
+            logger.debug('CSV headers: %s', reader.fieldnames)
+            missing = missing_fields(reader.fieldnames)
+            if missing:
+                logger.debug('Missing required fields: %s', missing)
+                messages.error(request, f'Missing required fields: {", ".join(missing)}')
                 return redirect('Recorder:invoice_csv_upload')
             
-            # Process each row
-            success_count = 0
-            error_count = 0
-            error_details = []
+            # Large files are handed to the import worker so the request
+            # returns straight away with a job id
+            if settings.INVOICE_IMPORT_BACKGROUND:
+                csv_file.seek(0)
+                job = enqueue_import(request.user, csv_file)
+                messages.info(request, f'Import job #{job.pk} queued for {csv_file.name}')
+                return redirect('Recorder:import_job_detail', pk=job.pk)
             
-            for row_num, row in enumerate(reader, 1):
-                try:
-                    print(f"\nProcessing row {row_num}")
-                    print(f"Row data: {row}")
-                    
-                    # Validate required fields are not empty
-                    for field in required_fields:
-                        if not row.get(field):
-                            raise ValueError(f"Required field '{field}' is empty")
-                    
-                    # Convert date strings to date objects (YYYY-MM-DD format)
-                    try:
-                        invoice_date = datetime.strptime(row['invoice_date'], '%Y-%m-%d').date()
-                    except ValueError:
-                        raise ValueError(f"Invalid invoice_date format: {row['invoice_date']}. Expected YYYY-MM-DD")
-                        
-                    try:
-                        due_date = datetime.strptime(row['due_date'], '%Y-%m-%d').date()
-                    except ValueError:
-                        raise ValueError(f"Invalid due_date format: {row['due_date']}. Expected YYYY-MM-DD")
-                        
-                    # Handle optional payment_date_1
-                    payment_date_1 = None
-                    if row.get('payment_date_1'):
-                        try:
-                            payment_date_1 = datetime.strptime(row['payment_date_1'], '%Y-%m-%d').date()
-                        except ValueError:
-                            raise ValueError(f"Invalid payment_date_1 format: {row['payment_date_1']}. Expected YYYY-MM-DD")
-                    
-                    # Handle optional payment_date_2
-                    payment_date_2 = None
-                    if row.get('payment_date_2'):
-                        try:
-                            payment_date_2 = datetime.strptime(row['payment_date_2'], '%Y-%m-%d').date()
-                        except ValueError:
-                            raise ValueError(f"Invalid payment_date_2 format: {row['payment_date_2']}. Expected YYYY-MM-DD")
-                    
-                    # Validate numeric fields using Indian number format
-                    try:
-                        total_amount = parse_indian_number(row['total_amount'])
-                    except ValueError as e:
-                        raise ValueError(str(e))
-                        
-                    try:
-                        balance = parse_indian_number(row['balance'])
-                    except ValueError as e:
-                        raise ValueError(str(e))
-                        
-                    # Handle optional payment_1
-                    payment_1 = None
-                    if row.get('payment_1'):
-                        try:
-                            payment_1 = parse_indian_number(row['payment_1'])
-                        except ValueError as e:
-                            raise ValueError(str(e))
-                        
-                    try:
-                        dhara_day = int(row['dhara_day'])
-                    except ValueError:
-                        raise ValueError(f"Invalid dhara_day: {row['dhara_day']}. Must be a valid integer")
-                        
-                    try:
-                        taka = parse_indian_number(row['taka'])
-                    except ValueError as e:
-                        raise ValueError(str(e))
-
-                    try:
-                        meter = parse_indian_number(row['meter'])
-                    except ValueError as e:
-                        raise ValueError(str(e))
-                    
-                    # Create invoice
-                    invoice = Invoice(
-                        user=request.user,
-                        firm=row['firm'],
-                        quality=row['quality'],
-                        invoice_date=invoice_date,
-                        invoice_number=row['invoice_number'],
-                        party=row['party'],
-                        meter=meter,
-                        total_amount=total_amount,
-                        due_date=due_date,
-                        balance=balance,
-                        payment_date_1=payment_date_1,
-                        payment_1=payment_1,
-                        dhara_day=dhara_day,
-                        taka=taka,
-                        payment_date_2=payment_date_2
-                    )
-                    
-                    # Calculate payment_2
-                    invoice.payment_2 = invoice.calculate_payment_2()
-                    
-                    # Save invoice
-                    invoice.save()
-                    success_count += 1
-                    print(f"Successfully saved invoice {invoice.invoice_number}")
-                    
-                except Exception as e:
-                    error_count += 1
-                    error_msg = f"Row {row_num}: {str(e)}"
-                    print(error_msg)
-                    error_details.append(error_msg)
-                    continue
+            # Validate and insert the rows in batches inside one transaction
+            result = import_invoices(request.user, reader)
             
             # Show results
-            if success_count > 0:
-                messages.success(request, f'Successfully imported {success_count} invoices')
-            if error_count > 0:
-                error_message = f'Failed to import {error_count} invoices. Errors:'
-                for error in error_details[:5]:  # Show first 5 errors
+            if result.success_count > 0:
+                messages.success(request, result.summary)
+            if result.error_count > 0:
+                error_message = f'Failed to import {result.error_count} invoices. Errors:'
+                for error in result.error_details[:5]:  # Show first 5 errors
                     error_message += f'\n{error}'
-                if len(error_details) > 5:
-                    error_message += f'\n... and {len(error_details) - 5} more errors'
+                if len(result.error_details) > 5:
+                    error_message += f'\n... and {len(result.error_details) - 5} more errors'
                 messages.warning(request, error_message)
             
             return redirect('Recorder:invoice_list')
             
         except Exception as e:
-            print(f"Error processing CSV file: {str(e)}")
-            messages.error(request, f'Error processing CSV file: {str(e)}')
+            logger.exception('Error processing uploaded file')
+            messages.error(request, f'Error processing uploaded file: {str(e)}')
             return redirect('Recorder:invoice_csv_upload')
     
-    return render(request, 'Recorder/invoice_csv_upload.html')
\ No newline at end of file
+    return render(request, 'Recorder/invoice_csv_upload.html')
+
+@login_required(login_url='Recorder:login')
+def settlement_upload(request):
+    """Settle invoices in bulk from an uploaded payment-receipt CSV"""
+    if request.method == 'POST':
+        if 'receipt_file' not in request.FILES:
+            messages.error(request, 'No file uploaded')
+            return redirect('Recorder:settlement_upload')
+
+        receipt_file = request.FILES['receipt_file']
+        if not receipt_file.name.endswith('.csv'):
+            messages.error(request, 'Please upload a CSV file')
+            return redirect('Recorder:settlement_upload')
+
+        try:
+            reader = read_csv(receipt_file)
+            missing = missing_receipt_fields(reader.fieldnames)
+            if missing:
+                messages.error(request, f'Missing required fields: {", ".join(missing)}')
+                return redirect('Recorder:settlement_upload')
+
+            result = apply_receipts(request.user, reader)
+        except Exception as e:
+            messages.error(request, f'Error processing receipt file: {str(e)}')
+            return redirect('Recorder:settlement_upload')
+
+        # The reconciliation is shown straight away rather than after a
+        # redirect, so it doesn't have to be stored anywhere
+        return render(request, 'Recorder/settlement_upload.html', {
+            'result': result,
+            'file_name': receipt_file.name,
+        })
+
+    return render(request, 'Recorder/settlement_upload.html')
+
+@login_required(login_url='Recorder:login')
+def import_job_detail(request, pk):
+    """Show the progress of a background import job"""
+    job = get_object_or_404(ImportJob, pk=pk, user=request.user)
+    return render(request, 'Recorder/import_job_detail.html', {'job': job})
+
+@login_required(login_url='Recorder:login')
+def import_job_status(request, pk):
+    """Return the progress of a background import job as JSON"""
+    job = get_object_or_404(ImportJob, pk=pk, user=request.user)
+    return JsonResponse({
+        'id': job.pk,
+        'file_name': job.file_name,
+        'status': job.status,
+        'rows_processed': job.rows_processed,
+        'rows_imported': job.rows_imported,
+        'rows_failed': job.rows_failed,
+        'rows_per_second': job.throughput,
+        'message': job.message,
+        'created_at': job.created_at.isoformat(),
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    })
+
+@login_required(login_url='Recorder:login')
+def import_job_errors(request, pk):
+    """Download the per-row errors of an import job as CSV"""
+    job = get_object_or_404(ImportJob, pk=pk, user=request.user)
+    response = HttpResponse(content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="import_{job.pk}_errors.csv"'
+    writer = csv.writer(response)
+    writer.writerow(['Row', 'Error'])
+    writer.writerows(job.errors)
+    return response
+
+@login_required(login_url='Recorder:login')
+def aging_report_view(request):
+    """Outstanding balance per party, split into aging buckets by due date"""
+    report = aging_report(request.user.pk)
+    context = {
+        'report': report,
+        'buckets': AGING_BUCKETS,
+    }
+    return render(request, 'Recorder/aging_report.html', context)
+
+@login_required(login_url='Recorder:login')
+def aging_report_csv(request):
+    """Download the aging report as CSV"""
+    report = aging_report(request.user.pk)
+    response = HttpResponse(content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="aging_{report["as_of"]:%Y-%m-%d}.csv"'
+    writer = csv.writer(response)
+    writer.writerow(['Party', 'Invoices'] + [heading for _, heading, _, _ in AGING_BUCKETS] + ['Total'])
+    for row in report['rows'] + [dict(report['totals'], party='Total')]:
+        writer.writerow([row['party'], row['invoice_count']] + [row[field] for field in AMOUNT_FIELDS])
+    return response